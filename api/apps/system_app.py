@@ -32,6 +32,7 @@ from api.utils.api_utils import (
     generate_confirmation_token,
 )
 from api.versions import get_ragflow_version
+from rag.nlp.retrieval_cache import RETRIEVAL_CACHE
 from rag.utils.storage_factory import STORAGE_IMPL, STORAGE_IMPL_TYPE
 from timeit import default_timer as timer
 
@@ -168,6 +169,9 @@ def status():
         logging.exception("get task executor heartbeats failed!")
     res["task_executor_heartbeats"] = task_executor_heartbeats
 
+    if RETRIEVAL_CACHE:
+        res["retrieval_cache"] = RETRIEVAL_CACHE.stats()
+
     return get_json_result(data=res)
 
 
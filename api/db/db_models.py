@@ -809,11 +809,24 @@ class Conversation(DataBaseModel):
     reference = JSONField(null=True, default=[])
     user_id = CharField(max_length=255, null=True, help_text="user_id", index=True)
     model_card_id = IntegerField(null=True, index=True, help_text="current model card ID for this conversation")
+    message_count = IntegerField(default=0, help_text="Cached message count for performance")
 
     class Meta:
         db_table = "conversation"
 
 
+class ConversationMessage(DataBaseModel):
+    conversation_id = CharField(max_length=32, null=False)
+    kind = CharField(max_length=16, null=False, help_text="message|reference")
+    seq = IntegerField(null=False, help_text="position in the message or reference list of the conversation")
+    content = JSONField(null=True, help_text="a message, or the reference of an answer")
+    digest = CharField(max_length=16, null=False, help_text="hash of the content")
+
+    class Meta:
+        db_table = "conversation_message"
+        primary_key = CompositeKey("conversation_id", "kind", "seq")
+
+
 class FreeChatUserSettings(DataBaseModel):
     user_id = CharField(max_length=255, primary_key=True, help_text="external user ID for free chat")
     dialog_id = CharField(max_length=32, null=False, default="", index=True, help_text="selected dialog ID")
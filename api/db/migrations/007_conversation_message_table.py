@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Migration: Move conversation messages to the conversation_message table
+
+Purpose:
+  - Copy the `message` and `reference` JSON lists of every conversation into
+    conversation_message, one row per message / reference
+  - Empty the JSON columns and set conversation.message_count
+  - Not migrated conversations keep working, and are migrated on their next write
+
+Usage:
+  python api/db/migrations/007_conversation_message_table.py --dry-run
+  python api/db/migrations/007_conversation_message_table.py
+"""
+
+import sys
+import os
+import logging
+from datetime import datetime
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+
+from api.db.services.conversation_service import ConversationService
+from api.db.db_models import DB
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def migrate_conversation_messages(dry_run: bool = False):
+    """Move the messages of all conversations to conversation_message"""
+
+    model = ConversationService.model
+    with DB.connection_context():
+        conversation_ids = [c.id for c in model.select(model.id).where(model.message.is_null(False))]
+
+        total_conversations = 0
+        total_migrated = 0
+
+        for conversation_id in conversation_ids:
+            total_conversations += 1
+            if dry_run:
+                conv = model.select(model.message).where(model.id == conversation_id).first()
+                if conv and conv.message:
+                    total_migrated += 1
+                    logging.info(f"[{conversation_id}] Would migrate {len(conv.message)} messages")
+                continue
+            try:
+                if ConversationService.migrate_messages(conversation_id):
+                    total_migrated += 1
+                    logging.info(f"[{conversation_id}] Migrated")
+            except Exception as e:
+                logging.error(f"[{conversation_id}] Migration failed: {e}")
+
+        logging.info(f"\n{'[DRY RUN] ' if dry_run else ''}Summary:")
+        logging.info(f"  Total conversations: {total_conversations}")
+        logging.info(f"  Conversations migrated: {total_migrated}")
+
+        if dry_run:
+            logging.info("\n⚠️  This was a DRY RUN. No data was modified.")
+            logging.info("   Run without --dry-run to apply changes.")
+
+
+if __name__ == "__main__":
+    dry_run = "--dry-run" in sys.argv
+
+    print("=" * 60)
+    print("Conversation Message Table Migration")
+    print("=" * 60)
+    print(f"Mode: {'DRY RUN (no changes)' if dry_run else 'PRODUCTION (will modify data)'}")
+    print(f"Time: {datetime.now()}")
+    print("=" * 60)
+
+    if not dry_run:
+        confirm = input("\n⚠️  This will MODIFY database. Type 'yes' to continue: ")
+        if confirm.lower() != 'yes':
+            print("Aborted.")
+            sys.exit(0)
+
+    migrate_conversation_messages(dry_run)
+    print("\n✅ Migration completed.")
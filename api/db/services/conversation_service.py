@@ -16,8 +16,12 @@
 import time
 import logging
 from uuid import uuid4
+
+import xxhash
+from peewee import fn
+
 from api.db import StatusEnum
-from api.db.db_models import Conversation, DB
+from api.db.db_models import Conversation, ConversationMessage, DB
 from api.db.services.api_service import API4ConversationService
 from api.db.services.common_service import CommonService
 from api.db.services.dialog_service import DialogService, chat
@@ -27,8 +31,147 @@ import json
 from rag.prompts.generator import chunks_format
 
 
+def _digest(content):
+    return xxhash.xxh64(json.dumps(content, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
 class ConversationService(CommonService):
+    """
+    Messages and references of conversations are stored one row each in ConversationMessage, in two
+    lists ("message" and "reference") ordered by seq. Writes only touch the rows that changed, and
+    conversation.message_count keeps the number of messages.
+    The `message` and `reference` JSON columns of conversation are only read for conversations not
+    migrated yet, which are moved to ConversationMessage on their next write.
+    """
+
     model = Conversation
+    list_kinds = ("message", "reference")
+
+    @classmethod
+    def _lists(cls, conversation_ids):
+        lists = {cid: {kind: [] for kind in cls.list_kinds} for cid in conversation_ids}
+        if not conversation_ids:
+            return lists
+        rows = (ConversationMessage.select(ConversationMessage.conversation_id, ConversationMessage.kind, ConversationMessage.content)
+                .where(ConversationMessage.conversation_id.in_(list(conversation_ids)))
+                .order_by(ConversationMessage.conversation_id, ConversationMessage.kind, ConversationMessage.seq))
+        for r in rows:
+            lists[r.conversation_id][r.kind].append(r.content)
+        return lists
+
+    @classmethod
+    def _hydrate(cls, convs):
+        """Fills the messages and references of migrated conversations, model instances or dicts, in place."""
+        def get(c, k):
+            return c.get(k) if isinstance(c, dict) else getattr(c, k)
+
+        migrated = [c for c in convs if not get(c, "message")]
+        lists = cls._lists({get(c, "id") for c in migrated})
+        for c in migrated:
+            for kind in cls.list_kinds:
+                if isinstance(c, dict):
+                    c[kind] = lists[c["id"]][kind]
+                else:
+                    setattr(c, kind, lists[c.id][kind])
+        return convs
+
+    @classmethod
+    def _sync_list(cls, conversation_id, kind, items):
+        """Makes the `kind` list of a conversation equal to `items`, rewriting it from the first item that differs."""
+        stored = [r.digest for r in ConversationMessage.select(ConversationMessage.digest)
+                  .where((ConversationMessage.conversation_id == conversation_id) & (ConversationMessage.kind == kind))
+                  .order_by(ConversationMessage.seq)]
+        digests = []
+        k = 0
+        while k < min(len(stored), len(items)):
+            digests.append(_digest(items[k]))
+            if digests[k] != stored[k]:
+                break
+            k += 1
+        if k < len(stored):
+            ConversationMessage.delete().where((ConversationMessage.conversation_id == conversation_id) & (ConversationMessage.kind == kind) & (ConversationMessage.seq >= k)).execute()
+        rows = [{"conversation_id": conversation_id, "kind": kind, "seq": i, "content": items[i], "digest": digests[i] if i < len(digests) else _digest(items[i]),
+                 "create_time": current_timestamp()} for i in range(k, len(items))]
+        for i in range(0, len(rows), 100):
+            ConversationMessage.insert_many(rows[i:i + 100]).execute()
+
+    @classmethod
+    def _write_lists(cls, conversation_id, data):
+        """Moves the `message` and `reference` lists out of `data` into ConversationMessage."""
+        legacy = cls.model.select(cls.model.message, cls.model.reference).where(cls.model.id == conversation_id).first()
+        if legacy and legacy.message:
+            # Not migrated yet: the JSON columns are the source of truth, until now.
+            for kind in cls.list_kinds:
+                if kind not in data:
+                    data[kind] = getattr(legacy, kind) or []
+            ConversationMessage.delete().where(ConversationMessage.conversation_id == conversation_id).execute()
+        for kind in cls.list_kinds:
+            if kind in data:
+                items = data[kind] or []
+                cls._sync_list(conversation_id, kind, items)
+                if kind == "message":
+                    data["message_count"] = len(items)
+                data[kind] = []
+
+    @classmethod
+    @DB.connection_context()
+    def save(cls, **kwargs):
+        with DB.atomic():
+            cls._write_lists(kwargs["id"], kwargs)
+            return super().save(**kwargs)
+
+    @classmethod
+    @DB.connection_context()
+    def update_by_id(cls, pid, data):
+        if not any(kind in data for kind in cls.list_kinds):
+            return super().update_by_id(pid, data)
+        data = dict(data)
+        with DB.atomic():
+            cls._write_lists(pid, data)
+            return super().update_by_id(pid, data)
+
+    @classmethod
+    @DB.connection_context()
+    def get_by_id(cls, pid):
+        e, conv = super().get_by_id(pid)
+        if e:
+            cls._hydrate([conv])
+        return e, conv
+
+    @classmethod
+    @DB.connection_context()
+    def query(cls, cols=None, reverse=None, order_by=None, **kwargs):
+        convs = list(super().query(cols=cols, reverse=reverse, order_by=order_by, **kwargs))
+        if cols is None:
+            cls._hydrate(convs)
+        return convs
+
+    @classmethod
+    @DB.connection_context()
+    def delete_by_id(cls, pid):
+        with DB.atomic():
+            ConversationMessage.delete().where(ConversationMessage.conversation_id == pid).execute()
+            return super().delete_by_id(pid)
+
+    @classmethod
+    @DB.connection_context()
+    def delete_by_ids(cls, pids):
+        with DB.atomic():
+            ConversationMessage.delete().where(ConversationMessage.conversation_id.in_(pids)).execute()
+            return super().delete_by_ids(pids)
+
+    @classmethod
+    @DB.connection_context()
+    def migrate_messages(cls, conversation_id) -> bool:
+        """Moves the messages and references of a conversation from its JSON columns to ConversationMessage."""
+        with DB.atomic():
+            legacy = cls.model.select(cls.model.message, cls.model.reference).where(cls.model.id == conversation_id).first()
+            if not legacy or not legacy.message:
+                return False
+            data = {}
+            cls._write_lists(conversation_id, data)
+            cls.model.update(data).where(cls.model.id == conversation_id).execute()
+            return True
 
     @classmethod
     @DB.connection_context()
@@ -47,7 +190,7 @@ class ConversationService(CommonService):
 
         sessions = sessions.paginate(page_number, items_per_page)
 
-        return list(sessions.dicts())
+        return cls._hydrate(list(sessions.dicts()))
 
     @classmethod
     @DB.connection_context()
@@ -61,7 +204,7 @@ class ConversationService(CommonService):
             _temp = list(s_batch.dicts())
             if not _temp:
                 break
-            res.extend(_temp)
+            res.extend(cls._hydrate(_temp))
             offset += limit
         return res
 
@@ -69,64 +212,69 @@ class ConversationService(CommonService):
     @DB.connection_context()
     def append_message(cls, conversation_id: str, message: dict) -> tuple[bool, str]:
         """
-        Atomically append a message to conversation.message array.
-        This implements the "Real-time Write" principle for message content.
-        
+        Atomically append a message to the conversation.
+        Only the new message row is written, whatever the length of the conversation.
+
         Args:
             conversation_id: Conversation ID
             message: Message object, e.g. {"role": "user", "content": "...", "id": "..."}
-        
+
         Returns:
             (success: bool, error_msg: str)
         """
         try:
-            e, conv = cls.get_by_id(conversation_id)
-            if not e:
-                return False, "Conversation not found"
-            
-            # Initialize message array if None
-            if conv.message is None:
-                conv.message = []
-            
-            # Append message (atomic operation via Peewee)
-            conv.message.append(message)
-            
-            # Update timestamp
-            conv.update_time = current_timestamp()
-            
-            # Save (Peewee handles JSON serialization)
-            conv.save()
-            
-            logging.info(f"[ConversationService] Appended message to {conversation_id}, total: {len(conv.message)}")
+            with DB.atomic():
+                cls.migrate_messages(conversation_id)
+                conv = cls.model.select(cls.model.message_count).where(cls.model.id == conversation_id).first()
+                if not conv:
+                    return False, "Conversation not found"
+                seq = ConversationMessage.select(fn.COUNT(ConversationMessage.seq)).where(
+                    (ConversationMessage.conversation_id == conversation_id) & (ConversationMessage.kind == "message")).scalar()
+                ConversationMessage.insert(conversation_id=conversation_id, kind="message", seq=seq, content=message, digest=_digest(message),
+                                           create_time=current_timestamp()).execute()
+                cls.model.update(message_count=seq + 1, update_time=current_timestamp()).where(cls.model.id == conversation_id).execute()
+
+            logging.info(f"[ConversationService] Appended message to {conversation_id}, total: {seq + 1}")
             return True, ""
-            
+
         except Exception as e:
             logging.error(f"[ConversationService] append_message failed for {conversation_id}: {e}")
             return False, str(e)
 
     @classmethod
     @DB.connection_context()
-    def get_messages(cls, conversation_id: str) -> tuple[bool, list]:
+    def get_messages(cls, conversation_id: str, page: int = 0, page_size: int = 0) -> tuple[bool, list]:
         """
-        Get complete message list for a conversation (lazy loading).
-        This supports the "Lazy Load" principle - messages loaded on-demand.
-        
+        Get the messages of a conversation (lazy loading), all of them or one page.
+
         Args:
             conversation_id: Conversation ID
-        
+            page: 1-based page number, 0 for all the messages
+            page_size: Number of messages per page
+
         Returns:
             (success: bool, messages: list)
         """
         try:
-            e, conv = cls.get_by_id(conversation_id)
-            if not e:
+            legacy = cls.model.select(cls.model.message).where(cls.model.id == conversation_id).first()
+            if not legacy:
                 logging.warning(f"[ConversationService] Conversation {conversation_id} not found")
                 return False, []
-            
-            messages = conv.message or []
+
+            if legacy.message:
+                messages = legacy.message
+                if page > 0 and page_size > 0:
+                    messages = messages[(page - 1) * page_size:page * page_size]
+            else:
+                rows = (ConversationMessage.select(ConversationMessage.content)
+                        .where((ConversationMessage.conversation_id == conversation_id) & (ConversationMessage.kind == "message"))
+                        .order_by(ConversationMessage.seq))
+                if page > 0 and page_size > 0:
+                    rows = rows.paginate(page, page_size)
+                messages = [r.content for r in rows]
             logging.info(f"[ConversationService] Loaded {len(messages)} messages from {conversation_id}")
             return True, messages
-            
+
         except Exception as e:
             logging.error(f"[ConversationService] get_messages failed for {conversation_id}: {e}")
             return False, []
@@ -136,26 +284,38 @@ class ConversationService(CommonService):
     def get_message_count(cls, conversation_id: str) -> int:
         """
         Get message count for display in session list (metadata).
-        
+
         Args:
             conversation_id: Conversation ID
-        
+
         Returns:
             Message count (0 if error/not found)
         """
         try:
             if not conversation_id:
                 return 0
-            
-            e, conv = cls.get_by_id(conversation_id)
+
+            conv = cls.model.select(cls.model.message_count).where(cls.model.id == conversation_id).first()
+            if not conv:
+                return 0
+            if conv.message_count:
+                return conv.message_count
+            # Not migrated yet
+            e, conv = super().get_by_id(conversation_id)
             if e and conv.message:
                 return len(conv.message)
         except Exception as e:
             logging.error(f"[ConversationService] get_message_count failed: {e}")
-        
+
         return 0
 
 def structure_answer(conv, ans, message_id, session_id):
+    if ans.get("delta"):
+        # Only new text, the conversation is updated by the final frame holding the whole answer.
+        ans["id"] = message_id
+        ans["session_id"] = session_id
+        return ans
+
     reference = ans["reference"]
     if not isinstance(reference, dict):
         reference = {}
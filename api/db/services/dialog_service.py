@@ -15,8 +15,12 @@
 #
 import binascii
 import logging
+import math
+import os
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from datetime import datetime
 from functools import partial
@@ -29,10 +33,10 @@ from api import settings
 from api.db import LLMType, ParserType, StatusEnum
 from api.db.db_models import DB, Dialog
 from api.db.services.common_service import CommonService
-from api.db.services.document_service import DocumentService
+from api.db.services.document_service import DocumentService, MetaIndex
 from api.db.services.knowledgebase_service import KnowledgebaseService
 from api.db.services.langfuse_service import TenantLangfuseService
-from api.db.services.llm_service import LLMBundle
+from api.db.services.llm_service import QUERY_EMBEDDING_CACHE, LLMBundle
 from api.db.services.tenant_llm_service import TenantLLMService
 from api.utils import current_timestamp, datetime_format
 from graphrag.general.mind_map_extractor import MindMapExtractor
@@ -44,6 +48,59 @@ from rag.prompts.generator import chunks_format, citation_prompt, cross_language
 from rag.utils import num_tokens_from_string, rmSpace
 from rag.utils.tavily_conn import Tavily
 
+# Runs the pre-retrieval steps of chat turns that don't depend on each other concurrently.
+CHAT_STAGE_WORKERS = int(os.environ.get("CHAT_STAGE_WORKERS", 32))
+chat_stage_executor = ThreadPoolExecutor(max_workers=CHAT_STAGE_WORKERS, thread_name_prefix="chat_stage")
+
+
+class ChatStages:
+    """Wall time of the steps of a chat turn, some of which run concurrently in chat_stage_executor."""
+
+    def __init__(self):
+        self.spans = {}
+        self.lock = threading.Lock()
+
+    def run(self, name, fn, *args, **kwargs):
+        st = timer()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.spans[name] = (st, timer())
+
+    def submit(self, name, fn, *args, **kwargs):
+        return chat_stage_executor.submit(self.run, name, fn, *args, **kwargs)
+
+    @staticmethod
+    def drop(futures):
+        """Gives up submitted steps: those not started yet are cancelled, the errors of the others are logged."""
+        def log_error(name, future):
+            if not future.cancelled() and future.exception() is not None:
+                logging.warning(f"[chat] {name} failed: {future.exception()}")
+
+        for name, future in futures.items():
+            if not future.cancel():
+                future.add_done_callback(partial(log_error, name))
+
+    def report(self, indent="    "):
+        with self.lock:
+            spans = sorted(self.spans.items(), key=lambda x: x[1][0])
+        if not spans:
+            return ""
+        lines = [f"{indent}- {name}: {(ed - st) * 1000:.1f}ms\n" for name, (st, ed) in spans]
+        busy = sum(ed - st for _, (st, ed) in spans)
+        wall, cur_st, cur_ed = 0.0, None, None
+        for _, (st, ed) in spans:
+            if cur_ed is None or st > cur_ed:
+                if cur_ed is not None:
+                    wall += cur_ed - cur_st
+                cur_st, cur_ed = st, ed
+            else:
+                cur_ed = max(cur_ed, ed)
+        wall += cur_ed - cur_st
+        lines.append(f"{indent}- Overlapped: {(busy - wall) * 1000:.1f}ms\n")
+        return "".join(lines)
+
 
 class DialogService(CommonService):
     model = Dialog
@@ -176,7 +233,20 @@ class DialogService(CommonService):
             offset += limit
         return res
 
-def chat_solo(dialog, messages, stream=True):
+def streamed_answer(answer, sent, delta, **kwargs):
+    """
+    A frame of a streamed answer. By default it carries the whole answer so far. With `delta`, when the
+    answer extends `sent`, the answer held by the client after the previous frame, it only carries the
+    text after it and is flagged with "delta": True, so that the answer isn't sent again and again as it
+    grows. Streams aren't always append-only (e.g. a trailing "</think>" is dropped once reasoning goes
+    on), so whenever the answer doesn't extend `sent`, the whole answer is sent again.
+    """
+    if delta and sent and answer.startswith(sent):
+        return {"answer": answer[len(sent):], "reference": {}, "delta": True, **kwargs}
+    return {"answer": answer, "reference": {}, **kwargs}
+
+
+def chat_solo(dialog, messages, stream=True, delta=False):
     # CRITICAL FIX: Validate messages array is not empty
     if not messages or len(messages) == 0:
         raise ValueError("Messages array cannot be empty in chat_solo")
@@ -201,6 +271,7 @@ def chat_solo(dialog, messages, stream=True):
         last_ans = ""
         delta_ans = ""
         answer = ""  # Initialize in case stream is empty
+        sent = ""
         for ans in chat_mdl.chat_streamly(prompt_config.get("system", ""), msg, dialog.llm_setting):
             answer = ans
             delta_ans = ans[len(last_ans):]
@@ -208,10 +279,14 @@ def chat_solo(dialog, messages, stream=True):
             last_ans = answer
             if num_tokens_from_string(delta_ans) < 16:
                 continue
-            yield {"answer": answer, "reference": {}, "audio_binary": tts(tts_mdl, delta_ans), "prompt": "", "created_at": time.time()}
+            yield streamed_answer(answer, sent, delta, audio_binary=tts(tts_mdl, delta_ans), prompt="", created_at=time.time())
+            sent = answer
             delta_ans = ""
         if delta_ans:
-            yield {"answer": answer, "reference": {}, "audio_binary": tts(tts_mdl, delta_ans), "prompt": "", "created_at": time.time()}
+            yield streamed_answer(answer, sent, delta, audio_binary=tts(tts_mdl, delta_ans), prompt="", created_at=time.time())
+        if delta:
+            # The final frame holds the whole answer.
+            yield {"answer": answer, "reference": {}, "audio_binary": None, "prompt": "", "created_at": time.time()}
     else:
         answer = chat_mdl.chat(prompt_config.get("system", ""), msg, dialog.llm_setting)
         user_content = msg[-1].get("content", "[content not available]")
@@ -333,11 +408,24 @@ def meta_filter(metas: dict, filters: list[dict]):
                     pass
         return ids
 
+    def numeric_filter_out(k, v2docs, operator, value):
+        # Numbers are compared through the sorted values of the index, the other values as strings.
+        if not isinstance(metas, MetaIndex) or operator not in {"=", "≠", ">", "<", "≥", "≤"}:
+            return filter_out(v2docs, operator, value)
+        try:
+            number = float(value)
+        except Exception:
+            return filter_out(v2docs, operator, value)
+        if math.isnan(number):
+            return filter_out(v2docs, operator, value)
+        ids, rest = metas.select(k, operator, number)
+        return ids + filter_out(rest, operator, value)
+
     for k, v2docs in metas.items():
         for f in filters:
             if k != f["key"]:
                 continue
-            ids = filter_out(v2docs, f["op"], f["value"])
+            ids = numeric_filter_out(k, v2docs, f["op"], f["value"])
             if not doc_ids:
                 doc_ids = set(ids)
             else:
@@ -361,7 +449,7 @@ def chat(dialog, messages, stream=True, **kwargs):
 
     if not dialog.kb_ids and not dialog.prompt_config.get("tavily_api_key"):
         logging.info(f"[chat] Entering chat_solo mode (no KB)")
-        for ans in chat_solo(dialog, messages, stream):
+        for ans in chat_solo(dialog, messages, stream, kwargs.get("delta", False)):
             yield ans
         return
 
@@ -419,37 +507,70 @@ def chat(dialog, messages, stream=True, **kwargs):
         if p["key"] not in kwargs:
             prompt_config["system"] = prompt_config["system"].replace("{%s}" % p["key"], " ")
 
+    stages = ChatStages()
     if len(questions) > 1 and prompt_config.get("refine_multiturn"):
-        questions = [full_question(dialog.tenant_id, dialog.llm_id, messages)]
+        questions = [stages.run("Multi-turn refinement(LLM)", full_question, dialog.tenant_id, dialog.llm_id, messages)]
     else:
         questions = questions[-1:]
 
     if prompt_config.get("cross_languages"):
-        questions = [cross_languages(dialog.tenant_id, dialog.llm_id, questions[0], prompt_config["cross_languages"])]
+        questions = [stages.run("Cross-language(LLM)", cross_languages, dialog.tenant_id, dialog.llm_id, questions[0], prompt_config["cross_languages"])]
 
+    # The metadata filter is generated from the question before keyword extraction, concurrently with it.
+    metas = None
+    meta_filter_future = None
     if dialog.meta_data_filter:
         metas = DocumentService.get_meta_by_kbs(dialog.kb_ids)
         if dialog.meta_data_filter.get("method") == "auto":
-            filters = gen_meta_filter(chat_mdl, metas, questions[-1])
-            attachments.extend(meta_filter(metas, filters))
-            if not attachments:
-                attachments = None
-        elif dialog.meta_data_filter.get("method") == "manual":
-            attachments.extend(meta_filter(metas, dialog.meta_data_filter["manual"]))
-            if not attachments:
-                attachments = None
+            meta_filter_future = stages.submit("Metadata filter(LLM)", gen_meta_filter, chat_mdl, metas, questions[-1])
 
     if prompt_config.get("keyword", False):
-        questions[-1] += keyword_extraction(chat_mdl, questions[-1])
+        questions[-1] += stages.run("Keyword extraction(LLM)", keyword_extraction, chat_mdl, questions[-1])
 
     refine_question_ts = timer()
 
+    # The question is final: the query embedding and tags are computed while the metadata filter may still
+    # be generated, they are dropped if the filter leaves no document to search.
     thought = ""
     kbinfos = {"total": 0, "chunks": [], "doc_aggs": []}
     knowledges = []
+    tenant_ids = list(set([kb.tenant_id for kb in kbs]))
+    use_knowledge = "knowledge" in [p["key"] for p in prompt_config["parameters"]]
+    query = " ".join(questions)
+    futures = {}
+    if attachments is not None and use_knowledge and not prompt_config.get("reasoning", False) and embd_mdl:
+        if QUERY_EMBEDDING_CACHE:
+            futures["embedding"] = stages.submit("Query embedding", embd_mdl.encode_queries, query)
+        futures["tags"] = stages.submit("Tag labelling", label_question, query, kbs)
 
-    if attachments is not None and "knowledge" in [p["key"] for p in prompt_config["parameters"]]:
-        tenant_ids = list(set([kb.tenant_id for kb in kbs]))
+    if dialog.meta_data_filter:
+        try:
+            if meta_filter_future is not None:
+                filters = meta_filter_future.result()
+                attachments.extend(meta_filter(metas, filters))
+                if not attachments:
+                    attachments = None
+            elif dialog.meta_data_filter.get("method") == "manual":
+                attachments.extend(meta_filter(metas, dialog.meta_data_filter["manual"]))
+                if not attachments:
+                    attachments = None
+        except BaseException:
+            stages.drop(futures)
+            raise
+        if attachments is None:
+            stages.drop(futures)
+            futures = {}
+
+    # Web search and knowledge graph retrieval (an LLM call) only run if there are documents to search,
+    # concurrently with the vector retrieval.
+    if attachments is not None and use_knowledge and not prompt_config.get("reasoning", False):
+        if prompt_config.get("tavily_api_key"):
+            futures["tavily"] = stages.submit("Web search(Tavily)", Tavily(prompt_config["tavily_api_key"]).retrieve_chunks, query)
+        if prompt_config.get("use_kg"):
+            futures["kg"] = stages.submit("Knowledge graph retrieval",
+                                          lambda: settings.kg_retrievaler.retrieval(query, tenant_ids, dialog.kb_ids, embd_mdl, LLMBundle(dialog.tenant_id, LLMType.CHAT)))
+
+    if attachments is not None and use_knowledge:
         knowledges = []
         if prompt_config.get("reasoning", False):
             reasoner = DeepResearcher(
@@ -477,8 +598,12 @@ def chat(dialog, messages, stream=True, **kwargs):
         else:
             if embd_mdl:
                 try:
-                    kbinfos = retriever.retrieval(
-                        " ".join(questions),
+                    if "embedding" in futures:
+                        futures["embedding"].result()
+                    kbinfos = stages.run(
+                        "Vector retrieval",
+                        retriever.retrieval,
+                        query,
                         embd_mdl,
                         tenant_ids,
                         dialog.kb_ids,
@@ -490,22 +615,21 @@ def chat(dialog, messages, stream=True, **kwargs):
                         top=dialog.top_k,
                         aggs=False,
                         rerank_mdl=rerank_mdl,
-                        rank_feature=label_question(" ".join(questions), kbs),
+                        rank_feature=futures["tags"].result(),
                     )
                 except Exception as e:
                     logging.error(f"[chat] Retrieval failed: {e}")
+                    stages.drop(futures)
                     # Fallback to chat without KB if retrieval fails
-                    for ans in chat_solo(dialog, messages, stream):
+                    for ans in chat_solo(dialog, messages, stream, kwargs.get("delta", False)):
                         yield ans
                     return
-            if prompt_config.get("tavily_api_key"):
-                tav = Tavily(prompt_config["tavily_api_key"])
-                tav_res = tav.retrieve_chunks(" ".join(questions))
+            if "tavily" in futures:
+                tav_res = futures["tavily"].result()
                 kbinfos["chunks"].extend(tav_res["chunks"])
                 kbinfos["doc_aggs"].extend(tav_res["doc_aggs"])
-            if prompt_config.get("use_kg"):
-                ck = settings.kg_retrievaler.retrieval(" ".join(questions), tenant_ids, dialog.kb_ids, embd_mdl,
-                                                       LLMBundle(dialog.tenant_id, LLMType.CHAT))
+            if "kg" in futures:
+                ck = futures["kg"].result()
                 if ck["content_with_weight"]:
                     kbinfos["chunks"].insert(0, ck)
 
@@ -536,7 +660,7 @@ def chat(dialog, messages, stream=True, **kwargs):
         gen_conf["max_tokens"] = min(gen_conf["max_tokens"], max_tokens - used_token_count)
 
     def decorate_answer(answer):
-        nonlocal embd_mdl, prompt_config, knowledges, kwargs, kbinfos, prompt, retrieval_ts, questions, langfuse_tracer
+        nonlocal embd_mdl, prompt_config, knowledges, kwargs, kbinfos, prompt, retrieval_ts, questions, langfuse_tracer, stages
 
         refs = []
         ans = answer.split("</think>")
@@ -598,6 +722,7 @@ def chat(dialog, messages, stream=True, **kwargs):
             f"  - Bind models: {bind_embedding_time_cost:.1f}ms\n"
             f"  - Query refinement(LLM): {refine_question_time_cost:.1f}ms\n"
             f"  - Retrieval: {retrieval_time_cost:.1f}ms\n"
+            f"{stages.report()}"
             f"  - Generate answer: {generate_result_time_cost:.1f}ms\n\n"
             "## Token usage:\n"
             f"  - Generated tokens(approximately): {tk_num}\n"
@@ -620,6 +745,9 @@ def chat(dialog, messages, stream=True, **kwargs):
         )
 
     if stream:
+        # With "delta", the frames after the first one only carry new text, and the answer with its
+        # reference is sent once, in the final frame.
+        delta = kwargs.get("delta", False)
         last_ans = ""
         answer = ""
         for ans in chat_mdl.chat_streamly(prompt + prompt4citation, msg[1:], gen_conf):
@@ -629,11 +757,11 @@ def chat(dialog, messages, stream=True, **kwargs):
             delta_ans = ans[len(last_ans):]
             if num_tokens_from_string(delta_ans) < 16:
                 continue
+            yield streamed_answer(thought + answer, thought + last_ans if last_ans else "", delta, audio_binary=tts(tts_mdl, delta_ans))
             last_ans = answer
-            yield {"answer": thought + answer, "reference": {}, "audio_binary": tts(tts_mdl, delta_ans)}
         delta_ans = answer[len(last_ans):]
         if delta_ans:
-            yield {"answer": thought + answer, "reference": {}, "audio_binary": tts(tts_mdl, delta_ans)}
+            yield streamed_answer(thought + answer, thought + last_ans if last_ans else "", delta, audio_binary=tts(tts_mdl, delta_ans))
         yield decorate_answer(thought + answer)
     else:
         answer = chat_mdl.chat(prompt + prompt4citation, msg[1:], gen_conf)
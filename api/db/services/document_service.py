@@ -13,10 +13,14 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import bisect
 import json
 import logging
+import math
+import os
 import random
 import re
+import threading
 from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from datetime import datetime
@@ -24,6 +28,7 @@ from io import BytesIO
 
 import trio
 import xxhash
+from cachetools import TTLCache
 from peewee import fn, Case
 
 from api import settings
@@ -40,6 +45,101 @@ from rag.utils.redis_conn import REDIS_CONN
 from rag.utils.storage_factory import STORAGE_IMPL
 from rag.utils.doc_store_conn import OrderByExpr
 
+DOC_META_CACHE_SIZE = int(os.environ.get("DOC_META_CACHE_SIZE", "256"))
+DOC_META_CACHE_TTL = int(os.environ.get("DOC_META_CACHE_TTL", "3600"))
+
+# kb_id -> (version, MetaIndex)
+_doc_meta_cache = TTLCache(maxsize=max(DOC_META_CACHE_SIZE, 1), ttl=DOC_META_CACHE_TTL)
+_doc_meta_cache_lock = threading.Lock()
+
+
+class MetaIndex(dict):
+    """
+    Inverted index of document metadata: {field: {str(value): [doc_id, ...]}}.
+    The numeric values of each field are also kept sorted, so that range filters are answered by bisection.
+    An index is never modified once shared, `patched()` returns an updated copy.
+    """
+
+    def __init__(self, *args, parts=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._parts = parts
+        self._numbers = {}
+
+    @classmethod
+    def merge(cls, indexes):
+        merged = cls(parts=indexes)
+        for index in indexes:
+            for k, v2docs in index.items():
+                vals = merged.setdefault(k, {})
+                for v, docids in v2docs.items():
+                    vals[v] = vals[v] + docids if v in vals else docids
+        return merged
+
+    def numbers(self, field):
+        """Returns (sorted numeric values, their str values, non numeric str values) of `field`."""
+        if field not in self._numbers:
+            nums, others = [], []
+            for v in self.get(field, {}):
+                try:
+                    f = float(v)
+                except Exception:
+                    f = math.nan
+                if math.isnan(f):
+                    others.append(v)
+                else:
+                    nums.append((f, v))
+            nums.sort()
+            self._numbers[field] = ([f for f, _ in nums], [v for _, v in nums], others)
+        return self._numbers[field]
+
+    def select(self, field, operator, value: float):
+        """
+        Returns the documents whose numeric `field` value compares to `value` with `operator` (=, ≠, >, <, ≥, ≤),
+        and the {str value: doc_ids} of the values of `field` which are not numbers.
+        """
+        if self._parts is not None:
+            ids, rest = [], {}
+            for part in self._parts:
+                i, r = part.select(field, operator, value)
+                ids.extend(i)
+                for v, docids in r.items():
+                    rest[v] = rest[v] + docids if v in rest else docids
+            return ids, rest
+
+        nums, vals, others = self.numbers(field)
+        lo, hi = bisect.bisect_left(nums, value), bisect.bisect_right(nums, value)
+        matched = {
+            "=": vals[lo:hi],
+            "≠": vals[:lo] + vals[hi:],
+            ">": vals[hi:],
+            "<": vals[:lo],
+            "≥": vals[lo:],
+            "≤": vals[:hi],
+        }[operator]
+        v2docs = self.get(field, {})
+        ids = [docid for v in matched for docid in v2docs[v]]
+        return ids, {v: v2docs[v] for v in others}
+
+    def patched(self, doc_id, old_meta, new_meta):
+        index = MetaIndex(self)
+        index._numbers = dict(self._numbers)
+        for k in set(old_meta or {}) | set(new_meta or {}):
+            vals = dict(index.get(k, {}))
+            for v in {str(m[k]) for m in (old_meta or {}, new_meta or {}) if k in m}:
+                if doc_id in vals.get(v, []):
+                    vals[v] = [docid for docid in vals[v] if docid != doc_id]
+                    if not vals[v]:
+                        del vals[v]
+            if new_meta and k in new_meta:
+                v = str(new_meta[k])
+                vals[v] = vals.get(v, []) + [doc_id]
+            if vals:
+                index[k] = vals
+            else:
+                index.pop(k, None)
+            index._numbers.pop(k, None)
+        return index
+
 
 class DocumentService(CommonService):
     model = Document
@@ -275,6 +375,8 @@ class DocumentService(CommonService):
             raise RuntimeError("Database error (Document)!")
         if not KnowledgebaseService.atomic_increase_doc_num_by_id(doc["kb_id"]):
             raise RuntimeError("Database error (Knowledgebase)!")
+        if doc.get("meta_fields"):
+            cls._update_meta_index(doc["kb_id"], doc["id"], {}, doc["meta_fields"])
         return Document(**doc)
 
     @classmethod
@@ -318,7 +420,10 @@ class DocumentService(CommonService):
                                              search.index_name(tenant_id), doc.kb_id)
         except Exception:
             pass
-        return cls.delete_by_id(doc.id)
+        num = cls.delete_by_id(doc.id)
+        if doc.meta_fields:
+            cls._update_meta_index(doc.kb_id, doc.id, doc.meta_fields, {})
+        return num
 
     @classmethod
     @DB.connection_context()
@@ -612,19 +717,41 @@ class DocumentService(CommonService):
     @classmethod
     @DB.connection_context()
     def update_meta_fields(cls, doc_id, meta_fields):
-        return cls.update_by_id(doc_id, {"meta_fields": meta_fields})
+        doc = cls.model.select(cls.model.kb_id, cls.model.meta_fields).where(cls.model.id == doc_id).first()
+        num = cls.update_by_id(doc_id, {"meta_fields": meta_fields})
+        if doc and num:
+            cls._update_meta_index(doc.kb_id, doc_id, doc.meta_fields, meta_fields)
+        return num
+
+    @staticmethod
+    def _meta_version_key(kb_id):
+        return f"doc_meta_ver:{kb_id}"
+
+    @classmethod
+    def _update_meta_index(cls, kb_id, doc_id, old_meta, new_meta):
+        """
+        Bumps the metadata index version of the KB, so that other processes rebuild it,
+        and patches the index cached by this process if it was the latest one.
+        """
+        ver = REDIS_CONN.incr(cls._meta_version_key(kb_id))
+        with _doc_meta_cache_lock:
+            cached = _doc_meta_cache.pop(kb_id, None)
+        if ver is None or not cached or cached[0] != str(ver - 1):
+            return
+        with _doc_meta_cache_lock:
+            _doc_meta_cache[kb_id] = (str(ver), cached[1].patched(doc_id, old_meta, new_meta))
 
     @classmethod
     @DB.connection_context()
-    def get_meta_by_kbs(cls, kb_ids):
+    def _build_meta_index(cls, kb_id):
         fields = [
             cls.model.id,
             cls.model.meta_fields,
         ]
-        meta = {}
-        for r in cls.model.select(*fields).where(cls.model.kb_id.in_(kb_ids)):
+        meta = MetaIndex()
+        for r in cls.model.select(*fields).where(cls.model.kb_id == kb_id):
             doc_id = r.id
-            for k,v in r.meta_fields.items():
+            for k,v in (r.meta_fields or {}).items():
                 if k not in meta:
                     meta[k] = {}
                 v = str(v)
@@ -633,6 +760,51 @@ class DocumentService(CommonService):
                 meta[k][v].append(doc_id)
         return meta
 
+    @classmethod
+    def get_meta_by_kbs(cls, kb_ids):
+        """
+        Returns the metadata inverted index of the documents of the KBs: {field: {str(value): [doc_id, ...]}}.
+        The index of each KB is cached in this process and in Redis, under a version bumped by every metadata change.
+        The returned index is shared, don't modify it.
+        """
+        kb_ids = list(dict.fromkeys(kb_ids))
+        versions = REDIS_CONN.mget([cls._meta_version_key(kb_id) for kb_id in kb_ids])
+        # None when Redis can't be read, the versions are then unknown.
+        known = versions is not None
+        versions = versions or [None] * len(kb_ids)
+        indexes = []
+        for kb_id, ver in zip(kb_ids, versions):
+            if not known:
+                # Without the version, a cached index can't be told from a stale one: build it from the DB.
+                indexes.append(cls._build_meta_index(kb_id))
+                continue
+            ver = str(ver or 0)
+            with _doc_meta_cache_lock:
+                cached = _doc_meta_cache.get(kb_id)
+            if cached and cached[0] == ver:
+                indexes.append(cached[1])
+                continue
+
+            key = f"doc_meta:{kb_id}:{ver}"
+            index = None
+            try:
+                v = REDIS_CONN.get(key)
+                if v:
+                    index = MetaIndex(json.loads(v))
+            except Exception as e:
+                logging.warning(f"Failed to load the metadata index of KB {kb_id}: {e}")
+            if index is None:
+                index = cls._build_meta_index(kb_id)
+                REDIS_CONN.set(key, json.dumps(index, ensure_ascii=False), DOC_META_CACHE_TTL)
+            if DOC_META_CACHE_SIZE > 0:
+                with _doc_meta_cache_lock:
+                    _doc_meta_cache[kb_id] = (ver, index)
+            indexes.append(index)
+
+        if len(indexes) == 1:
+            return indexes[0]
+        return MetaIndex.merge(indexes)
+
     @classmethod
     @DB.connection_context()
     def update_progress(cls):
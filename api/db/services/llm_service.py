@@ -15,12 +15,20 @@
 #
 import inspect
 import logging
+import os
 import re
 from functools import partial
 from typing import Generator
 from api.db.db_models import LLM
 from api.db.services.common_service import CommonService
 from api.db.services.tenant_llm_service import LLM4Tenant, TenantLLMService
+from rag.utils.embedding_cache import EmbeddingCache
+
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+QUERY_EMBEDDING_CACHE_TTL = int(os.environ.get("QUERY_EMBEDDING_CACHE_TTL", "3600"))
+QUERY_EMBEDDING_CACHE_REDIS = int(os.environ.get("QUERY_EMBEDDING_CACHE_REDIS", "0"))
+# Least recently used entries are evicted first, and none outlives the TTL.
+QUERY_EMBEDDING_CACHE = EmbeddingCache(QUERY_EMBEDDING_CACHE_SIZE, "ttl", QUERY_EMBEDDING_CACHE_TTL, use_redis=bool(QUERY_EMBEDDING_CACHE_REDIS)) if QUERY_EMBEDDING_CACHE_SIZE > 0 else None
 
 
 class LLMService(CommonService):
@@ -108,6 +116,13 @@ class LLMBundle(LLM4Tenant):
         return embeddings, used_tokens
 
     def encode_queries(self, query: str):
+        # A question is usually embedded several times per chat turn (retrieval, tagging, KG, citations).
+        cache_model = "{}/{}/query".format(self.tenant_id, self.llm_name)
+        if QUERY_EMBEDDING_CACHE:
+            emd = QUERY_EMBEDDING_CACHE.get_many(cache_model, [query])[0]
+            if emd is not None:
+                return emd.copy(), 0
+
         if self.langfuse:
             generation = self.langfuse.start_generation(trace_context=self.trace_context, name="encode_queries", model=self.llm_name, input={"query": query})
 
@@ -120,6 +135,8 @@ class LLMBundle(LLM4Tenant):
             generation.update(usage_details={"total_tokens": used_tokens})
             generation.end()
 
+        if QUERY_EMBEDDING_CACHE:
+            QUERY_EMBEDDING_CACHE.set_many(cache_model, [query], [emd])
         return emd, used_tokens
 
     def similarity(self, query: str, texts: list):
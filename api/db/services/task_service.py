@@ -21,7 +21,7 @@ from datetime import datetime
 
 from api.db.db_utils import bulk_insert_into_db
 from deepdoc.parser import PdfParser
-from peewee import JOIN
+from peewee import JOIN, fn
 from api.db.db_models import DB, File2Document, File
 from api.db import StatusEnum, FileType, TaskStatus
 from api.db.db_models import Task, Document, Knowledgebase, Tenant
@@ -180,6 +180,22 @@ class TaskService(CommonService):
         """
         cls.model.update(chunk_ids=chunk_ids).where(cls.model.id == id).execute()
 
+    @classmethod
+    @DB.connection_context()
+    def append_chunk_ids(cls, id: str, chunk_ids: list[str]):
+        """Append chunk IDs to those associated with a task.
+
+        Unlike update_chunk_ids, only the new IDs are sent, so recording the chunks
+        of a document bulk by bulk stays linear in the number of chunks.
+
+        Args:
+            id (str): The unique identifier of the task.
+            chunk_ids (list[str]): Identifiers of the newly indexed chunks.
+        """
+        if not chunk_ids:
+            return
+        cls.model.update(chunk_ids=fn.CONCAT_WS(" ", cls.model.chunk_ids, " ".join(chunk_ids))).where(cls.model.id == id).execute()
+
     @classmethod
     @DB.connection_context()
     def get_ongoing_doc_name(cls):
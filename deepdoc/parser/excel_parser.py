@@ -18,11 +18,13 @@ from io import BytesIO
 
 import pandas as pd
 from openpyxl import Workbook, load_workbook
+from openpyxl.worksheet.cell_range import CellRange
 
 from rag.nlp import find_codec
 
 # copied from `/openpyxl/cell/cell.py`
 ILLEGAL_CHARACTERS_RE = re.compile(r"[\000-\010]|[\013-\014]|[\016-\037]")
+MERGE_CELL_RE = re.compile(rb'<(?:[\w.-]+:)?mergeCell\s[^>]*?ref="([A-Z]+[0-9]+(?::[A-Z]+[0-9]+)?)"')
 
 
 class RAGFlowExcelParser:
@@ -64,6 +66,89 @@ class RAGFlowExcelParser:
             except Exception as e_pandas:
                 raise Exception(f"pandas.read_excel error: {e_pandas}, original openpyxl error: {e}")
 
+    @staticmethod
+    def _load_excel_to_rows(file_like_object, merged=False):
+        """
+        Streams a spreadsheet sheet by sheet, without building a Workbook of all cells.
+        Yields (sheetname, first_row, rows, merged_ranges): rows iterates over the rows as lists of
+        cell values, first_row being the number of its first row. merged_ranges are the CellRanges
+        of merged cells, only read when `merged` is set.
+        Excel files are read with openpyxl in read-only mode. CSV files, and Excel files openpyxl
+        can't read, go through a pandas DataFrame, as the single sheet "Data".
+        """
+        if isinstance(file_like_object, bytes):
+            file_like_object = BytesIO(file_like_object)
+
+        # Read first 4 bytes to determine file type
+        file_like_object.seek(0)
+        file_head = file_like_object.read(4)
+        file_like_object.seek(0)
+
+        if not (file_head.startswith(b"PK\x03\x04") or file_head.startswith(b"\xd0\xcf\x11\xe0")):
+            logging.info("Not an Excel file, reading it as CSV")
+            try:
+                file_like_object.seek(0)
+                df = pd.read_csv(file_like_object)
+            except Exception as e_csv:
+                raise Exception(f"Failed to parse CSV: {e_csv}")
+            yield "Data", 1, RAGFlowExcelParser._dataframe_rows(df), []
+            return
+
+        try:
+            wb = load_workbook(file_like_object, read_only=True, data_only=True)
+        except Exception as e:
+            logging.info(f"openpyxl load error: {e}, try pandas instead")
+            try:
+                file_like_object.seek(0)
+                try:
+                    df = pd.read_excel(file_like_object)
+                except Exception as ex:
+                    logging.info(f"pandas with default engine load error: {ex}, try calamine instead")
+                    file_like_object.seek(0)
+                    df = pd.read_excel(file_like_object, engine="calamine")
+            except Exception as e_pandas:
+                raise Exception(f"pandas.read_excel error: {e_pandas}, original openpyxl error: {e}")
+            yield "Data", 1, RAGFlowExcelParser._dataframe_rows(df), []
+            return
+
+        try:
+            for ws in wb.worksheets:
+                if not hasattr(ws, "iter_rows"):
+                    continue
+                if ws.max_row is not None and ws.max_row <= 1 and ws.max_column is not None and ws.max_column <= 1:
+                    # Some writers leave a dimension of A1 whatever the content, don't let it truncate the sheet.
+                    ws.reset_dimensions()
+                rows = (list(r) for r in ws.iter_rows(values_only=True))
+                yield ws.title, 1, rows, RAGFlowExcelParser._merged_ranges(ws) if merged else []
+        finally:
+            wb.close()
+
+    @staticmethod
+    def _merged_ranges(ws):
+        """Merged cell ranges of a read-only worksheet, which openpyxl doesn't parse in that mode."""
+        refs = {}
+        try:
+            with ws._get_source() as src:
+                tail = b""
+                while True:
+                    buf = src.read(1 << 20)
+                    if not buf:
+                        break
+                    buf = tail + buf
+                    for m in MERGE_CELL_RE.finditer(buf):
+                        refs[m.group(1).decode()] = None
+                    tail = buf[-512:]
+        except Exception:
+            logging.exception(f"Failed to read merged cells of sheet {ws.title}")
+        return [CellRange(ref) for ref in refs]
+
+    @staticmethod
+    def _dataframe_rows(df):
+        df = RAGFlowExcelParser._clean_dataframe(df)
+        yield list(df.columns)
+        for row in df.itertuples(index=False, name=None):
+            yield list(row)
+
     @staticmethod
     def _clean_dataframe(df: pd.DataFrame):
         def clean_string(s):
@@ -93,7 +178,6 @@ class RAGFlowExcelParser:
         from html import escape
 
         file_like_object = BytesIO(fnm) if not isinstance(fnm, str) else fnm
-        wb = RAGFlowExcelParser._load_excel_to_workbook(file_like_object)
         tb_chunks = []
 
         def _fmt(v):
@@ -101,31 +185,38 @@ class RAGFlowExcelParser:
                 return ""
             return str(v).strip()
 
-        for sheetname in wb.sheetnames:
-            ws = wb[sheetname]
-            rows = list(ws.rows)
-            if not rows:
+        for sheetname, _, rows, _ in RAGFlowExcelParser._load_excel_to_rows(file_like_object):
+            header = next(rows, None)
+            if header is None:
                 continue
 
             tb_rows_0 = "<tr>"
-            for t in list(rows[0]):
-                tb_rows_0 += f"<th>{escape(_fmt(t.value))}</th>"
+            for v in header:
+                tb_rows_0 += f"<th>{escape(_fmt(v))}</th>"
             tb_rows_0 += "</tr>"
 
-            for chunk_i in range((len(rows) - 1) // chunk_rows + 1):
+            def _table(batch):
                 tb = ""
                 tb += f"<table><caption>{sheetname}</caption>"
                 tb += tb_rows_0
-                for r in list(rows[1 + chunk_i * chunk_rows : min(1 + (chunk_i + 1) * chunk_rows, len(rows))]):
+                for r in batch:
                     tb += "<tr>"
-                    for i, c in enumerate(r):
-                        if c.value is None:
+                    for v in r:
+                        if v is None:
                             tb += "<td></td>"
                         else:
-                            tb += f"<td>{escape(_fmt(c.value))}</td>"
+                            tb += f"<td>{escape(_fmt(v))}</td>"
                     tb += "</tr>"
                 tb += "</table>\n"
-                tb_chunks.append(tb)
+                return tb
+
+            batch = []
+            for r in rows:
+                batch.append(r)
+                if len(batch) == chunk_rows:
+                    tb_chunks.append(_table(batch))
+                    batch = []
+            tb_chunks.append(_table(batch))
 
         return tb_chunks
 
@@ -145,22 +236,19 @@ class RAGFlowExcelParser:
 
     def __call__(self, fnm):
         file_like_object = BytesIO(fnm) if not isinstance(fnm, str) else fnm
-        wb = RAGFlowExcelParser._load_excel_to_workbook(file_like_object)
 
         res = []
-        for sheetname in wb.sheetnames:
-            ws = wb[sheetname]
-            rows = list(ws.rows)
-            if not rows:
+        for sheetname, _, rows, _ in RAGFlowExcelParser._load_excel_to_rows(file_like_object):
+            ti = next(rows, None)
+            if ti is None:
                 continue
-            ti = list(rows[0])
-            for r in list(rows[1:]):
+            for r in rows:
                 fields = []
-                for i, c in enumerate(r):
-                    if not c.value:
+                for i, v in enumerate(r):
+                    if not v:
                         continue
-                    t = str(ti[i].value) if i < len(ti) else ""
-                    t += ("：" if t else "") + str(c.value)
+                    t = str(ti[i]) if i < len(ti) else ""
+                    t += ("：" if t else "") + str(v)
                     fields.append(t)
                 line = "; ".join(fields)
                 if sheetname.lower().find("sheet") < 0:
@@ -171,11 +259,9 @@ class RAGFlowExcelParser:
     @staticmethod
     def row_number(fnm, binary):
         if fnm.split(".")[-1].lower().find("xls") >= 0:
-            wb = RAGFlowExcelParser._load_excel_to_workbook(BytesIO(binary))
             total = 0
-            for sheetname in wb.sheetnames:
-                ws = wb[sheetname]
-                total += len(list(ws.rows))
+            for _, _, rows, _ in RAGFlowExcelParser._load_excel_to_rows(BytesIO(binary)):
+                total += sum(1 for _ in rows)
             return total
 
         if fnm.split(".")[-1].lower() in ["csv", "txt"]:
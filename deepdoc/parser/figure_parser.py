@@ -13,13 +13,33 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import os
+import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import numpy as np
+import xxhash
+from cachetools import TTLCache
 from PIL import Image
 
 from api.utils.api_utils import timeout
 from rag.app.picture import vision_llm_chunk as picture_vision_llm_chunk
 from rag.prompts.generator import vision_llm_figure_describe_prompt
+from rag.utils.redis_conn import REDIS_CONN
+
+FIGURE_DESC_CACHE_TTL = int(os.environ.get("FIGURE_DESC_CACHE_TTL", 7 * 24 * 3600))
+FIGURE_DESC_CACHE_SIZE = int(os.environ.get("FIGURE_DESC_CACHE_SIZE", 4096))
+FIGURE_DESC_CACHE_MAX_BYTES = int(os.environ.get("FIGURE_DESC_CACHE_MAX_BYTES", 64 * 1024))
+
+FIGURE_HASH_MARGIN = 4
+# Figures with the same perceptual hash are the same figure if at most this many pixels differ by
+# more than FIGURE_PIXEL_TOLERANCE gray levels; a changed digit in a label is a few dozen pixels.
+FIGURE_MAX_DIFF_PIXELS = 4
+FIGURE_PIXEL_TOLERANCE = 48
+
+# Descriptions of recent figures in this process, in front of the ones shared through Redis.
+_figure_desc_cache = TTLCache(maxsize=max(1, FIGURE_DESC_CACHE_SIZE), ttl=max(1, FIGURE_DESC_CACHE_TTL))
+_figure_desc_cache_lock = threading.Lock()
 
 
 def vision_figure_parser_figure_data_wrapper(figures_data_without_positions):
@@ -33,6 +53,71 @@ def vision_figure_parser_figure_data_wrapper(figures_data_without_positions):
     ]
 
 
+def figure_hash(img: Image.Image) -> str:
+    """
+    Perceptual hash of a figure: the 256 bit difference hash of its 17x16 grayscale thumbnail and
+    its aspect ratio. Re-encoded copies of a figure get the same hash. Neighbours closer than FIGURE_HASH_MARGIN gray levels count as equal, so
+    compression noise in flat areas doesn't flip bits.
+    Text and numbers don't survive the thumbnail, so figures with the same hash still have to be compared with same_figure().
+    """
+    thumb = np.asarray(img.convert("L").resize((17, 16), Image.Resampling.LANCZOS), dtype=np.int16)
+    bits = np.packbits((thumb[:, 1:] - thumb[:, :-1] > FIGURE_HASH_MARGIN).ravel())
+    ratio = round(img.width / max(1, img.height), 1)
+    return f"{bits.tobytes().hex()}:{ratio}"
+
+
+def same_figure(a: Image.Image, b: Image.Image) -> bool:
+    """Whether two figures are the same at full resolution, up to a pixel of size and a few noisy pixels."""
+    if abs(a.width - b.width) > 1 or abs(a.height - b.height) > 1:
+        return False
+    w, h = min(a.width, b.width), min(a.height, b.height)
+    pa = np.asarray(a.convert("L"), dtype=np.int16)[:h, :w]
+    pb = np.asarray(b.convert("L"), dtype=np.int16)[:h, :w]
+    return int((np.abs(pa - pb) > FIGURE_PIXEL_TOLERANCE).sum()) <= FIGURE_MAX_DIFF_PIXELS
+
+
+def figure_digest(img: Image.Image) -> str:
+    """Exact content hash of a figure."""
+    hasher = xxhash.xxh128()
+    hasher.update(f"{img.mode}:{img.width}x{img.height}:".encode("utf-8"))
+    hasher.update(img.tobytes())
+    return hasher.hexdigest()
+
+
+def _figure_desc_cache_key(tenant_id, llmnm, prompt, digest):
+    hasher = xxhash.xxh64()
+    hasher.update(str(llmnm).encode("utf-8"))
+    hasher.update(str(prompt).encode("utf-8"))
+    hasher.update(str(digest).encode("utf-8"))
+    return f"figure_desc:{tenant_id}:{hasher.hexdigest()}"
+
+
+def get_figure_desc_cache(keys):
+    """Cached descriptions of the keys, None for the ones not cached."""
+    res = [None] * len(keys)
+    missing = []
+    with _figure_desc_cache_lock:
+        for i, k in enumerate(keys):
+            res[i] = _figure_desc_cache.get(k)
+            if res[i] is None:
+                missing.append(i)
+    if missing:
+        for i, v in zip(missing, REDIS_CONN.mget([keys[i] for i in missing]) or []):
+            if v:
+                res[i] = v
+                with _figure_desc_cache_lock:
+                    _figure_desc_cache[keys[i]] = v
+    return res
+
+
+def set_figure_desc_cache(key, txt):
+    if not txt or len(txt.encode("utf-8")) > FIGURE_DESC_CACHE_MAX_BYTES:
+        return
+    with _figure_desc_cache_lock:
+        _figure_desc_cache[key] = txt
+    REDIS_CONN.set(key, txt, FIGURE_DESC_CACHE_TTL)
+
+
 shared_executor = ThreadPoolExecutor(max_workers=10)
 
 
@@ -79,27 +164,62 @@ class VisionFigureParser:
         return self.assembled
 
     def __call__(self, **kwargs):
-        callback = kwargs.get("callback", lambda prog, msg: None)
+        callback = kwargs.get("callback", lambda prog=None, msg="": None)
+        prompt = vision_llm_figure_describe_prompt()
 
         @timeout(30, 3)
-        def process(figure_idx, figure_binary):
-            description_text = picture_vision_llm_chunk(
+        def process(figure_binary):
+            return picture_vision_llm_chunk(
                 binary=figure_binary,
                 vision_model=self.vision_model,
-                prompt=vision_llm_figure_describe_prompt(),
+                prompt=prompt,
                 callback=callback,
             )
-            return figure_idx, description_text
 
-        futures = []
+        # Repeated figures of the document (same perceptual hash, confirmed pixel by pixel) are described
+        # once. Across documents, descriptions are reused for identical figures of the same tenant,
+        # vision model and prompt.
+        tenant_id = getattr(self.vision_model, "tenant_id", None)
+        llmnm = getattr(self.vision_model, "llm_name", None) or getattr(getattr(self.vision_model, "mdl", None), "model_name", None)
+        use_cache = bool(tenant_id and llmnm)
+        groups = []
+        by_hash = {}
         for idx, img_binary in enumerate(self.figures or []):
-            futures.append(shared_executor.submit(process, idx, img_binary))
+            similar = by_hash.setdefault(figure_hash(img_binary), [])
+            for group in similar:
+                if same_figure(self.figures[group[0]], img_binary):
+                    group.append(idx)
+                    break
+            else:
+                similar.append([idx])
+                groups.append(similar[-1])
+        keys = [_figure_desc_cache_key(tenant_id, llmnm, prompt, figure_digest(self.figures[group[0]])) if use_cache else None for group in groups]
+        cached = get_figure_desc_cache(keys) if use_cache else [None] * len(keys)
+
+        texts = {}
+        futures = {}
+        for g, txt in enumerate(cached):
+            if txt:
+                texts[g] = txt
+            else:
+                futures[shared_executor.submit(process, self.figures[groups[g][0]])] = g
 
         for future in as_completed(futures):
-            figure_num, txt = future.result()
-            if txt:
+            g = futures[future]
+            texts[g] = future.result()
+            if use_cache:
+                set_figure_desc_cache(keys[g], texts[g])
+
+        for g, txt in texts.items():
+            if not txt:
+                continue
+            for figure_num in groups[g]:
                 self.descriptions[figure_num] = txt + "\n".join(self.descriptions[figure_num])
 
+        saved = len(self.figures or []) - len(futures)
+        if saved:
+            callback(msg=f"Figure descriptions: {len(futures)} vision model calls, {saved} saved by the figure cache.")
+
         self._assemble()
 
         return self.assembled
@@ -18,31 +18,151 @@ import logging
 import os
 import random
 import re
-import sys
+import tempfile
 import threading
+import weakref
+from collections.abc import Sequence
 from copy import deepcopy
 from io import BytesIO
 from timeit import default_timer as timer
 
 import numpy as np
-import pdfplumber
 import trio
 import xgboost as xgb
+from cachetools import LRUCache
 from huggingface_hub import snapshot_download
 from PIL import Image
 from pypdf import PdfReader as pdf2_read
 
 from api import settings
 from api.utils.file_utils import get_project_base_directory
-from deepdoc.vision import OCR, AscendLayoutRecognizer, LayoutRecognizer, Recognizer, TableStructureRecognizer
+from deepdoc.parser.pdf_worker import PdfDocument, has_color
+from deepdoc.vision import OCR, AscendLayoutRecognizer, BoxArray, LayoutRecognizer, RecognitionScheduler, Recognizer, TableStructureRecognizer, shared_model
 from rag.app.picture import vision_llm_chunk as picture_vision_llm_chunk
 from rag.nlp import rag_tokenizer
 from rag.prompts.generator import vision_llm_describe_prompt
 from rag.settings import PARALLEL_DEVICES
 
-LOCK_KEY_pdfplumber = "global_shared_lock_pdfplumber"
-if LOCK_KEY_pdfplumber not in sys.modules:
-    sys.modules[LOCK_KEY_pdfplumber] = threading.Lock()
+PDF_PAGE_IMAGE_CACHE = int(os.environ.get("PDF_PAGE_IMAGE_CACHE", 16))
+PDF_PAGE_SPILL_DIR = os.environ.get("PDF_PAGE_SPILL_DIR") or None
+
+
+class _SpillingLRUCache(LRUCache):
+    def __init__(self, maxsize, spill):
+        super().__init__(maxsize=maxsize)
+        self.spill = spill
+
+    def popitem(self):
+        key, value = super().popitem()
+        self.spill(key, value)
+        return key, value
+
+
+class PageImages(Sequence):
+    """
+    Page bitmaps of pages [page_from, page_to) of a PDF, rendered at 72*zoomin DPI on first access.
+    At most `cache_size` of them are kept in memory. Evicted pages are written raw to a file in
+    PDF_PAGE_SPILL_DIR and read back when they are needed later on, e.g. to crop tables, figures
+    and chunk images, so every page is rasterized only once.
+    """
+
+    def __init__(self, doc: PdfDocument, total_page, zoomin=3, page_from=0, page_to=299, cache_size=PDF_PAGE_IMAGE_CACHE):
+        self.doc = doc
+        self.zoomin = zoomin
+        self.page_from = page_from
+        self.page_count = len(range(total_page)[page_from:page_to])
+        self.sizes = [None] * self.page_count
+        self.cache = _SpillingLRUCache(max(1, cache_size), self._spill)
+        # page index -> (file, mode, size) of the evicted pages
+        self.spilled = {}
+        self.lock = threading.Lock()
+        weakref.finalize(self, PageImages._remove_spilled, self.spilled)
+
+    @staticmethod
+    def _remove_spilled(spilled):
+        for fnm, _, _ in spilled.values():
+            try:
+                os.remove(fnm)
+            except OSError:
+                pass
+        spilled.clear()
+
+    def _spill(self, i, img):
+        if i in self.spilled:
+            return
+        try:
+            with tempfile.NamedTemporaryFile(dir=PDF_PAGE_SPILL_DIR, prefix="ragflow_page_", delete=False) as f:
+                self.spilled[i] = (f.name, img.mode, img.size)
+                f.write(img.tobytes())
+        except Exception:
+            logging.exception("PageImages: failed to spill a page bitmap, it will be rendered again")
+            fnm = self.spilled.pop(i, (None,))[0]
+            if fnm:
+                PageImages._remove_spilled({i: (fnm, None, None)})
+
+    def _load(self, i):
+        fnm, mode, size = self.spilled[i]
+        try:
+            return Image.frombuffer(mode, size, np.fromfile(fnm, dtype=np.uint8), "raw", mode, 0, 1)
+        except Exception:
+            logging.exception("PageImages: failed to read a spilled page bitmap, rendering it again")
+            return None
+
+    def __len__(self):
+        return self.page_count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.page_count))]
+        if i < 0:
+            i += self.page_count
+        if i < 0 or i >= self.page_count:
+            raise IndexError("page index out of range")
+        with self.lock:
+            img = self.cache.get(i)
+            spilled = i in self.spilled
+        if img is not None:
+            return img
+        if spilled:
+            img = self._load(i)
+        if img is None:
+            img = self.doc.render(self.page_from + i, 72 * self.zoomin)
+        with self.lock:
+            self.cache[i] = img
+            self.sizes[i] = img.size
+        return img
+
+    def page_size(self, i):
+        """Size of a page bitmap, rendering the page only if it has never been rendered."""
+        if self.sizes[i] is None:
+            return self[i].size
+        return self.sizes[i]
+
+    def close(self):
+        with self.lock:
+            # Dropped, not evicted: nothing to spill.
+            self.cache = LRUCache(maxsize=self.cache.maxsize)
+            PageImages._remove_spilled(self.spilled)
+        self.doc.close()
+
+
+def load_updown_concat_model():
+    mdl = xgb.Booster()
+    if not settings.LIGHTEN:
+        try:
+            import torch.cuda
+
+            if torch.cuda.is_available():
+                mdl.set_param({"device": "cuda"})
+        except Exception:
+            logging.exception("RAGFlowPdfParser __init__")
+    try:
+        model_dir = os.path.join(get_project_base_directory(), "rag/res/deepdoc")
+        mdl.load_model(os.path.join(model_dir, "updown_concat_xgb.model"))
+    except Exception:
+        model_dir = snapshot_download(repo_id="InfiniFlow/text_concat_xgb_v1.0", local_dir=os.path.join(get_project_base_directory(), "rag/res/deepdoc"), local_dir_use_symlinks=False)
+        mdl.load_model(os.path.join(model_dir, "updown_concat_xgb.model"))
+    return mdl
 
 
 class RAGFlowPdfParser:
@@ -59,7 +179,8 @@ class RAGFlowPdfParser:
 
         """
 
-        self.ocr = OCR()
+        # Models are loaded once per process and shared by all parser instances.
+        self.ocr = shared_model("ocr", OCR)
         self.parallel_limiter = None
         if PARALLEL_DEVICES > 1:
             self.parallel_limiter = [trio.CapacityLimiter(1) for _ in range(PARALLEL_DEVICES)]
@@ -75,27 +196,12 @@ class RAGFlowPdfParser:
 
         if layout_recognizer_type == "ascend":
             logging.debug("Using Ascend LayoutRecognizer")
-            self.layouter = AscendLayoutRecognizer(recognizer_domain)
+            self.layouter = shared_model(f"ascend:{recognizer_domain}", lambda: AscendLayoutRecognizer(recognizer_domain))
         else:  # onnx
             logging.debug("Using Onnx LayoutRecognizer")
-            self.layouter = LayoutRecognizer(recognizer_domain)
-        self.tbl_det = TableStructureRecognizer()
-
-        self.updown_cnt_mdl = xgb.Booster()
-        if not settings.LIGHTEN:
-            try:
-                import torch.cuda
-
-                if torch.cuda.is_available():
-                    self.updown_cnt_mdl.set_param({"device": "cuda"})
-            except Exception:
-                logging.exception("RAGFlowPdfParser __init__")
-        try:
-            model_dir = os.path.join(get_project_base_directory(), "rag/res/deepdoc")
-            self.updown_cnt_mdl.load_model(os.path.join(model_dir, "updown_concat_xgb.model"))
-        except Exception:
-            model_dir = snapshot_download(repo_id="InfiniFlow/text_concat_xgb_v1.0", local_dir=os.path.join(get_project_base_directory(), "rag/res/deepdoc"), local_dir_use_symlinks=False)
-            self.updown_cnt_mdl.load_model(os.path.join(model_dir, "updown_concat_xgb.model"))
+            self.layouter = shared_model(f"onnx:{recognizer_domain}", lambda: LayoutRecognizer(recognizer_domain))
+        self.tbl_det = shared_model("tsr", TableStructureRecognizer)
+        self.updown_cnt_mdl = shared_model("updown_concat_xgb", load_updown_concat_model)
 
         self.page_from = 0
         self.column_num = 1
@@ -184,11 +290,7 @@ class RAGFlowPdfParser:
         return arr
 
     def _has_color(self, o):
-        if o.get("ncs", "") == "DeviceGray":
-            if o["stroking_color"] and o["stroking_color"][0] == 1 and o["non_stroking_color"] and o["non_stroking_color"][0] == 1:
-                if re.match(r"[a-zT_\[\]\(\)-]+", o.get("text", "")):
-                    return False
-        return True
+        return has_color(o)
 
     def _table_transformer_job(self, ZM):
         logging.debug("Table processing...")
@@ -234,9 +336,11 @@ class RAGFlowPdfParser:
                     pg.append(it)
             self.tb_cpns.extend(pg)
 
+        boxes = BoxArray(self.boxes)
+
         def gather(kwd, fzy=10, ption=0.6):
             eles = Recognizer.sort_Y_firstly([r for r in self.tb_cpns if re.match(kwd, r["label"])], fzy)
-            eles = Recognizer.layouts_cleanup(self.boxes, eles, 5, ption)
+            eles = Recognizer.layouts_cleanup(boxes, eles, 5, ption)
             return Recognizer.sort_Y_firstly(eles, 0)
 
         # add R,H,C,SP tag to boxes within table layout
@@ -244,17 +348,18 @@ class RAGFlowPdfParser:
         rows = gather(r".* (row|header)")
         spans = gather(r".*spanning")
         clmns = sorted([r for r in self.tb_cpns if re.match(r"table column$", r["label"])], key=lambda x: (x["pn"], x["layoutno"], x["x0"]))
-        clmns = Recognizer.layouts_cleanup(self.boxes, clmns, 5, 0.5)
+        clmns = Recognizer.layouts_cleanup(boxes, clmns, 5, 0.5)
+        rows_arr, headers_arr, spans_arr = BoxArray(rows), BoxArray(headers), BoxArray(spans)
         for b in self.boxes:
             if b.get("layout_type", "") != "table":
                 continue
-            ii = Recognizer.find_overlapped_with_threshold(b, rows, thr=0.3)
+            ii = Recognizer.find_overlapped_with_threshold(b, rows_arr, thr=0.3)
             if ii is not None:
                 b["R"] = ii
                 b["R_top"] = rows[ii]["top"]
                 b["R_bott"] = rows[ii]["bottom"]
 
-            ii = Recognizer.find_overlapped_with_threshold(b, headers, thr=0.3)
+            ii = Recognizer.find_overlapped_with_threshold(b, headers_arr, thr=0.3)
             if ii is not None:
                 b["H_top"] = headers[ii]["top"]
                 b["H_bott"] = headers[ii]["bottom"]
@@ -268,7 +373,7 @@ class RAGFlowPdfParser:
                 b["C_left"] = clmns[ii]["x0"]
                 b["C_right"] = clmns[ii]["x1"]
 
-            ii = Recognizer.find_overlapped_with_threshold(b, spans, thr=0.3)
+            ii = Recognizer.find_overlapped_with_threshold(b, spans_arr, thr=0.3)
             if ii is not None:
                 b["H_top"] = spans[ii]["top"]
                 b["H_bott"] = spans[ii]["bottom"]
@@ -276,14 +381,19 @@ class RAGFlowPdfParser:
                 b["H_right"] = spans[ii]["x1"]
                 b["SP"] = ii
 
-    def __ocr(self, pagenum, img, chars, ZM=3, device_id: int | None = None):
+    def __ocr(self, pagenum, img, chars, ZM=3, device_id: int | None = None, scheduler: RecognitionScheduler | None = None):
+        """
+        Detects the text lines of a page and fills in their text, from the PDF chars or by recognition.
+        Line crops are recognized through `scheduler` when given, batched with other pages, and
+        self.boxes[pagenum - 1] is set once they are done.
+        """
         start = timer()
         bxs = self.ocr.detect(np.array(img), device_id)
         logging.info(f"__ocr detecting boxes of a image cost ({timer() - start}s)")
 
         start = timer()
         if not bxs:
-            self.boxes.append([])
+            self.boxes[pagenum - 1] = []
             return
         bxs = [(line[0], line[1][0]) for line in bxs]
         bxs = Recognizer.sort_Y_firstly(
@@ -296,8 +406,7 @@ class RAGFlowPdfParser:
         )
 
         # merge chars in the same rect
-        for c in chars:
-            ii = Recognizer.find_overlapped(c, bxs)
+        for c, ii in zip(chars, Recognizer.find_overlapped_batch(chars, bxs)):
             if ii is None:
                 self.lefted_chars.append(c)
                 continue
@@ -322,24 +431,31 @@ class RAGFlowPdfParser:
             del b["chars"]
 
         logging.info(f"__ocr sorting {len(chars)} chars cost {timer() - start}s")
-        start = timer()
         boxes_to_reg = []
+        box_images = []
         img_np = np.array(img)
         for b in bxs:
             if not b["text"]:
                 left, right, top, bott = b["x0"] * ZM, b["x1"] * ZM, b["top"] * ZM, b["bottom"] * ZM
-                b["box_image"] = self.ocr.get_rotate_crop_image(img_np, np.array([[left, top], [right, top], [right, bott], [left, bott]], dtype=np.float32))
+                box_images.append(self.ocr.get_rotate_crop_image(img_np, np.array([[left, top], [right, top], [right, bott], [left, bott]], dtype=np.float32)))
                 boxes_to_reg.append(b)
             del b["txt"]
-        texts = self.ocr.recognize_batch([b["box_image"] for b in boxes_to_reg], device_id)
-        for i in range(len(boxes_to_reg)):
-            boxes_to_reg[i]["text"] = texts[i]
-            del boxes_to_reg[i]["box_image"]
+
+        def recognized(texts):
+            nonlocal bxs
+            for i in range(len(boxes_to_reg)):
+                boxes_to_reg[i]["text"] = texts[i]
+            bxs = [b for b in bxs if b["text"]]
+            if self.mean_height[pagenum - 1] == 0:
+                self.mean_height[pagenum - 1] = np.median([b["bottom"] - b["top"] for b in bxs])
+            self.boxes[pagenum - 1] = bxs
+
+        if scheduler is not None:
+            scheduler.submit(box_images, recognized)
+            return
+        start = timer()
+        recognized(self.ocr.recognize_batch(box_images, device_id))
         logging.info(f"__ocr recognize {len(bxs)} boxes cost {timer() - start}s")
-        bxs = [b for b in bxs if b["text"]]
-        if self.mean_height[pagenum - 1] == 0:
-            self.mean_height[pagenum - 1] = np.median([b["bottom"] - b["top"] for b in bxs])
-        self.boxes.append(bxs)
 
     def _layouts_rec(self, ZM, drop=True):
         assert len(self.page_images) == len(self.boxes)
@@ -408,9 +524,9 @@ class RAGFlowPdfParser:
         column_width = np.median([b["x1"] - b["x0"] for b in self.boxes])
         if not column_width or math.isnan(column_width):
             column_width = self.mean_width[0]
-        self.column_num = int(self.page_images[0].size[0] / zoomin / column_width)
-        if column_width < self.page_images[0].size[0] / zoomin / self.column_num:
-            logging.info("Multi-column................... {} {}".format(column_width, self.page_images[0].size[0] / zoomin / self.column_num))
+        self.column_num = int(self.page_images.page_size(0)[0] / zoomin / column_width)
+        if column_width < self.page_images.page_size(0)[0] / zoomin / self.column_num:
+            logging.info("Multi-column................... {} {}".format(column_width, self.page_images.page_size(0)[0] / zoomin / self.column_num))
             self.boxes = self.sort_X_by_page(self.boxes, column_width / self.column_num)
 
         i = 0
@@ -457,6 +573,54 @@ class RAGFlowPdfParser:
             bxs.pop(i + 1)
         self.boxes = bxs
 
+    @staticmethod
+    def _updown_concat_candidate(up, down, mw):
+        if up.get("R", "") != down.get("R", "") and up["text"][-1] != "，":
+            return False
+        if re.match(r"[0-9]{2,3}/[0-9]{3}$", up["text"]) or re.match(r"[0-9]{2,3}/[0-9]{3}$", down["text"]) or not down["text"].strip():
+            return False
+        if not down["text"].strip() or not up["text"].strip():
+            return False
+        if up["x1"] < down["x0"] - 10 * mw or up["x0"] > down["x1"] + 10 * mw:
+            return False
+        return True
+
+    def _updown_concat_scores(self, boxes, concat_between_pages=True, window=12, text_window=5):
+        """
+        Scores, in one prediction, the up/down pairs the DFS of _concat_downward may ask the model
+        about: the candidates among the `window` boxes following each box, up to the DFS's distance limits,
+        except the first `text_window` ones after a text box, which the DFS decides from the layout.
+        Returns {(id(up), id(down)): score}. Pairs missing, e.g. because boxes popped in between
+        bring farther ones into the DFS window, are scored one by one there.
+        """
+        pairs, feas = [], []
+        for i, up in enumerate(boxes):
+            mh = self.mean_height[up["page_number"] - 1]
+            mw = self.mean_width[up["page_number"] - 1]
+            for k, down in enumerate(boxes[i + 1 : i + 1 + window]):
+                ydis = self._y_dis(up, down)
+                smpg = up["page_number"] == down["page_number"]
+                if smpg and ydis > mh * 4:
+                    break
+                if not smpg and ydis > mh * 16:
+                    break
+                if not concat_between_pages and down["page_number"] > up["page_number"]:
+                    break
+                if k < text_window and up.get("layout_type") == "text":
+                    continue
+                try:
+                    if not self._updown_concat_candidate(up, down, mw):
+                        continue
+                    fea = self._updown_concat_features(up, down)
+                except Exception:
+                    # left to the DFS, which fails the same way if it ever gets to this pair
+                    continue
+                pairs.append((id(up), id(down)))
+                feas.append(fea)
+        if not feas:
+            return {}
+        return dict(zip(pairs, self.updown_cnt_mdl.predict(xgb.DMatrix(feas)).tolist()))
+
     def _concat_downward(self, concat_between_pages=True):
         self.boxes = Recognizer.sort_Y_firstly(self.boxes, 0)
         return
@@ -479,6 +643,7 @@ class RAGFlowPdfParser:
 
         # concat between rows
         boxes = deepcopy(self.boxes)
+        scores = self._updown_concat_scores(boxes, concat_between_pages)
         blocks = []
         while boxes:
             chunks = []
@@ -499,19 +664,7 @@ class RAGFlowPdfParser:
                     if not concat_between_pages and down["page_number"] > up["page_number"]:
                         break
 
-                    if up.get("R", "") != down.get("R", "") and up["text"][-1] != "，":
-                        i += 1
-                        continue
-
-                    if re.match(r"[0-9]{2,3}/[0-9]{3}$", up["text"]) or re.match(r"[0-9]{2,3}/[0-9]{3}$", down["text"]) or not down["text"].strip():
-                        i += 1
-                        continue
-
-                    if not down["text"].strip() or not up["text"].strip():
-                        i += 1
-                        continue
-
-                    if up["x1"] < down["x0"] - 10 * mw or up["x0"] > down["x1"] + 10 * mw:
+                    if not self._updown_concat_candidate(up, down, mw):
                         i += 1
                         continue
 
@@ -523,8 +676,10 @@ class RAGFlowPdfParser:
                         i += 1
                         continue
 
-                    fea = self._updown_concat_features(up, down)
-                    if self.updown_cnt_mdl.predict(xgb.DMatrix([fea]))[0] <= 0.5:
+                    score = scores.get((id(up), id(down)))
+                    if score is None:
+                        score = self.updown_cnt_mdl.predict(xgb.DMatrix([self._updown_concat_features(up, down)]))[0]
+                    if score <= 0.5:
                         i += 1
                         continue
                     dfs(down, i + 1)
@@ -839,8 +994,8 @@ class RAGFlowPdfParser:
         page_images_cnt = len(self.page_images)
         if pn[-1] - 1 >= page_images_cnt:
             return ""
-        while bott * ZM > self.page_images[pn[-1] - 1].size[1]:
-            bott -= self.page_images[pn[-1] - 1].size[1] / ZM
+        while bott * ZM > self.page_images.page_size(pn[-1] - 1)[1]:
+            bott -= self.page_images.page_size(pn[-1] - 1)[1] / ZM
             pn.append(pn[-1] + 1)
             if pn[-1] - 1 >= page_images_cnt:
                 return ""
@@ -857,7 +1012,7 @@ class RAGFlowPdfParser:
         def usefull(b):
             if b.get("layout_type"):
                 return True
-            if width(b) > self.page_images[b["page_number"] - 1].size[0] / ZM / 3:
+            if width(b) > self.page_images.page_size(b["page_number"] - 1)[0] / ZM / 3:
                 return True
             if b["bottom"] - b["top"] > self.mean_height[b["page_number"] - 1]:
                 return True
@@ -867,7 +1022,7 @@ class RAGFlowPdfParser:
         while boxes:
             lines = []
             widths = []
-            pw = self.page_images[boxes[0]["page_number"] - 1].size[0] / ZM
+            pw = self.page_images.page_size(boxes[0]["page_number"] - 1)[0] / ZM
             mh = self.mean_height[boxes[0]["page_number"] - 1]
             mj = self.proj_match(boxes[0]["text"]) or boxes[0].get("layout_type", "") == "title"
 
@@ -910,11 +1065,7 @@ class RAGFlowPdfParser:
     @staticmethod
     def total_page_number(fnm, binary=None):
         try:
-            with sys.modules[LOCK_KEY_pdfplumber]:
-                pdf = pdfplumber.open(fnm) if not binary else pdfplumber.open(BytesIO(binary))
-            total_page = len(pdf.pages)
-            pdf.close()
-            return total_page
+            return PdfDocument(fnm if not binary else binary).page_count()
         except Exception:
             logging.exception("total_page_number")
 
@@ -929,19 +1080,11 @@ class RAGFlowPdfParser:
         self.page_from = page_from
         start = timer()
         try:
-            with sys.modules[LOCK_KEY_pdfplumber]:
-                with pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm)) as pdf:
-                    self.pdf = pdf
-                    self.page_images = [p.to_image(resolution=72 * zoomin, antialias=True).annotated for i, p in enumerate(self.pdf.pages[page_from:page_to])]
-
-                    try:
-                        self.page_chars = [[c for c in page.dedupe_chars().chars if self._has_color(c)] for page in self.pdf.pages[page_from:page_to]]
-                    except Exception as e:
-                        logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
-                        self.page_chars = [[] for _ in range(page_to - page_from)]  # If failed to extract, using empty list instead.
-
-                    self.total_page = len(self.pdf.pages)
-
+            # Chars are extracted and pages rendered by the PDF worker processes. Pages are rendered
+            # on demand, one OCR job at a time, so only a bounded number of bitmaps is alive.
+            doc = PdfDocument(fnm)
+            self.total_page, self.page_chars = doc.extract_chars(page_from, page_to)
+            self.page_images = PageImages(doc, self.total_page, zoomin, page_from, page_to)
         except Exception:
             logging.exception("RAGFlowPdfParser __images__")
         logging.info(f"__images__ dedupe_chars cost {timer() - start}s")
@@ -978,7 +1121,7 @@ class RAGFlowPdfParser:
         else:
             self.is_english = False
 
-        async def __img_ocr(i, id, img, chars, limiter):
+        async def __img_ocr(i, id, chars, limiter):
             j = 0
             while j + 1 < len(chars):
                 if (
@@ -992,9 +1135,9 @@ class RAGFlowPdfParser:
 
             if limiter:
                 async with limiter:
-                    await trio.to_thread.run_sync(lambda: self.__ocr(i + 1, img, chars, zoomin, id))
+                    await trio.to_thread.run_sync(lambda: self.__ocr(i + 1, self.page_images[i], chars, zoomin, id, schedulers[id]))
             else:
-                self.__ocr(i + 1, img, chars, zoomin, id)
+                self.__ocr(i + 1, self.page_images[i], chars, zoomin, id, schedulers[id])
 
             if callback and i % 6 == 5:
                 callback(prog=(i + 1) * 0.6 / len(self.page_images), msg="")
@@ -1004,24 +1147,35 @@ class RAGFlowPdfParser:
                 chars = self.page_chars[i] if not self.is_english else []
                 self.mean_height.append(np.median(sorted([c["height"] for c in chars])) if chars else 0)
                 self.mean_width.append(np.median(sorted([c["width"] for c in chars])) if chars else 8)
-                self.page_cum_height.append(img.size[1] / zoomin)
                 return chars
 
             if self.parallel_limiter:
                 async with trio.open_nursery() as nursery:
-                    for i, img in enumerate(self.page_images):
+                    for i in range(len(self.page_images)):
                         chars = __ocr_preprocess()
 
-                        nursery.start_soon(__img_ocr, i, i % PARALLEL_DEVICES, img, chars, self.parallel_limiter[i % PARALLEL_DEVICES])
+                        nursery.start_soon(__img_ocr, i, i % PARALLEL_DEVICES, chars, self.parallel_limiter[i % PARALLEL_DEVICES])
                         await trio.sleep(0.1)
+                async with trio.open_nursery() as nursery:
+                    for id, limiter in enumerate(self.parallel_limiter):
+                        nursery.start_soon(__flush, id, limiter)
             else:
-                for i, img in enumerate(self.page_images):
+                for i in range(len(self.page_images)):
                     chars = __ocr_preprocess()
-                    await __img_ocr(i, 0, img, chars, None)
+                    await __img_ocr(i, 0, chars, None)
+                schedulers[0].flush()
+
+        async def __flush(id, limiter):
+            async with limiter:
+                await trio.to_thread.run_sync(schedulers[id].flush)
 
         start = timer()
 
+        # Text line crops that need recognition are queued across pages and recognized in large batches.
+        schedulers = [RecognitionScheduler(self.ocr, id) for id in range(max(1, len(self.parallel_limiter or [])))]
+        self.boxes = [[] for _ in range(len(self.page_images))]
         trio.run(__img_ocr_launcher)
+        self.page_cum_height.extend([self.page_images.page_size(i)[1] / zoomin for i in range(len(self.page_images))])
 
         logging.info(f"__images__ {len(self.page_images)} pages cost {timer() - start}s")
 
@@ -1139,23 +1293,23 @@ class RAGFlowPdfParser:
         pos = poss[0]
         poss.insert(0, ([pos[0][0]], pos[1], pos[2], max(0, pos[3] - 120), max(pos[3] - GAP, 0)))
         pos = poss[-1]
-        poss.append(([pos[0][-1]], pos[1], pos[2], min(self.page_images[pos[0][-1]].size[1] / ZM, pos[4] + GAP), min(self.page_images[pos[0][-1]].size[1] / ZM, pos[4] + 120)))
+        poss.append(([pos[0][-1]], pos[1], pos[2], min(self.page_images.page_size(pos[0][-1])[1] / ZM, pos[4] + GAP), min(self.page_images.page_size(pos[0][-1])[1] / ZM, pos[4] + 120)))
 
         positions = []
         for ii, (pns, left, right, top, bottom) in enumerate(poss):
             right = left + max_width
             bottom *= ZM
             for pn in pns[1:]:
-                bottom += self.page_images[pn - 1].size[1]
-            imgs.append(self.page_images[pns[0]].crop((left * ZM, top * ZM, right * ZM, min(bottom, self.page_images[pns[0]].size[1]))))
+                bottom += self.page_images.page_size(pn - 1)[1]
+            imgs.append(self.page_images[pns[0]].crop((left * ZM, top * ZM, right * ZM, min(bottom, self.page_images.page_size(pns[0])[1]))))
             if 0 < ii < len(poss) - 1:
-                positions.append((pns[0] + self.page_from, left, right, top, min(bottom, self.page_images[pns[0]].size[1]) / ZM))
-            bottom -= self.page_images[pns[0]].size[1]
+                positions.append((pns[0] + self.page_from, left, right, top, min(bottom, self.page_images.page_size(pns[0])[1]) / ZM))
+            bottom -= self.page_images.page_size(pns[0])[1]
             for pn in pns[1:]:
-                imgs.append(self.page_images[pn].crop((left * ZM, 0, right * ZM, min(bottom, self.page_images[pn].size[1]))))
+                imgs.append(self.page_images[pn].crop((left * ZM, 0, right * ZM, min(bottom, self.page_images.page_size(pn)[1]))))
                 if 0 < ii < len(poss) - 1:
-                    positions.append((pn + self.page_from, left, right, 0, min(bottom, self.page_images[pn].size[1]) / ZM))
-                bottom -= self.page_images[pn].size[1]
+                    positions.append((pn + self.page_from, left, right, 0, min(bottom, self.page_images.page_size(pn)[1]) / ZM))
+                bottom -= self.page_images.page_size(pn)[1]
 
         if not imgs:
             if need_position:
@@ -1186,12 +1340,12 @@ class RAGFlowPdfParser:
         pn = bx["page_number"]
         top = bx["top"] - self.page_cum_height[pn - 1]
         bott = bx["bottom"] - self.page_cum_height[pn - 1]
-        poss.append((pn, bx["x0"], bx["x1"], top, min(bott, self.page_images[pn - 1].size[1] / ZM)))
-        while bott * ZM > self.page_images[pn - 1].size[1]:
-            bott -= self.page_images[pn - 1].size[1] / ZM
+        poss.append((pn, bx["x0"], bx["x1"], top, min(bott, self.page_images.page_size(pn - 1)[1] / ZM)))
+        while bott * ZM > self.page_images.page_size(pn - 1)[1]:
+            bott -= self.page_images.page_size(pn - 1)[1] / ZM
             top = 0
             pn += 1
-            poss.append((pn, bx["x0"], bx["x1"], top, min(bott, self.page_images[pn - 1].size[1] / ZM)))
+            poss.append((pn, bx["x0"], bx["x1"], top, min(bott, self.page_images.page_size(pn - 1)[1] / ZM)))
         return poss
 
 
@@ -1236,10 +1390,10 @@ class VisionParser(RAGFlowPdfParser):
 
     def __images__(self, fnm, zoomin=3, page_from=0, page_to=299, callback=None):
         try:
-            with sys.modules[LOCK_KEY_pdfplumber]:
-                self.pdf = pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm))
-                self.page_images = [p.to_image(resolution=72 * zoomin).annotated for i, p in enumerate(self.pdf.pages[page_from:page_to])]
-                self.total_page = len(self.pdf.pages)
+            doc = PdfDocument(fnm)
+            self.total_page = doc.page_count()
+            self.page_images = [doc.render(i, 72 * zoomin) for i in range(self.total_page)[page_from:page_to]]
+            doc.close()
         except Exception:
             self.page_images = None
             self.total_page = 0
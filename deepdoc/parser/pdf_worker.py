@@ -0,0 +1,222 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+pdfplumber work (char extraction and page rasterization) in a pool of worker processes.
+
+pdfplumber and pypdfium2 aren't thread safe, so in-process calls are serialized behind the
+process-global pdfplumber lock. Running them in PDF_WORKERS processes lets several documents
+be parsed at once. Documents passed as bytes are written once to a file in PDF_WORKER_TMP_DIR that
+the workers open, and page bitmaps come back the same way instead of being pickled through pipes.
+With PDF_WORKERS=0 everything runs in-process behind the lock, as before.
+"""
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+import numpy as np
+import pdfplumber
+from PIL import Image
+
+from rag.utils.process_pool import pool_context, preload_in_workers
+
+LOCK_KEY_pdfplumber = "global_shared_lock_pdfplumber"
+if LOCK_KEY_pdfplumber not in sys.modules:
+    sys.modules[LOCK_KEY_pdfplumber] = threading.Lock()
+
+preload_in_workers(__name__)
+
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", min(4, os.cpu_count() or 1)))
+# Not /dev/shm by default: Docker caps it at 64MB, less than a single large PDF.
+PDF_WORKER_TMP_DIR = os.environ.get("PDF_WORKER_TMP_DIR") or None
+
+_pool = None
+_pool_lock = threading.Lock()
+# Documents opened by this worker process, most recently used last.
+_opened = OrderedDict()
+_MAX_OPENED = 4
+
+
+def has_color(o):
+    if o.get("ncs", "") == "DeviceGray":
+        if o["stroking_color"] and o["stroking_color"][0] == 1 and o["non_stroking_color"] and o["non_stroking_color"][0] == 1:
+            if re.match(r"[a-zT_\[\]\(\)-]+", o.get("text", "")):
+                return False
+    return True
+
+
+def _open(path):
+    pdf = _opened.pop(path, None)
+    if pdf is None:
+        pdf = pdfplumber.open(path)
+        while len(_opened) >= _MAX_OPENED:
+            _, old = _opened.popitem(last=False)
+            old.close()
+    _opened[path] = pdf
+    return pdf
+
+
+def _extract_chars(pdf, page_from, page_to):
+    page_chars = []
+    try:
+        for page in pdf.pages[page_from:page_to]:
+            page_chars.append([c for c in page.dedupe_chars().chars if has_color(c)])
+            page.close()
+    except Exception as e:
+        logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
+        page_chars = [[] for _ in range(page_to - page_from)]  # If failed to extract, using empty list instead.
+    return len(pdf.pages), page_chars
+
+
+def _render(pdf, page_no, resolution):
+    page = pdf.pages[page_no]
+    img = page.to_image(resolution=resolution, antialias=True).annotated
+    page.close()
+    return img
+
+
+def _worker_extract_chars(path, page_from, page_to):
+    return _extract_chars(_open(path), page_from, page_to)
+
+
+def _worker_render(path, page_no, resolution):
+    img = _render(_open(path), page_no, resolution)
+    fnm = None
+    try:
+        with tempfile.NamedTemporaryFile(dir=PDF_WORKER_TMP_DIR, prefix="ragflow_page_", delete=False) as f:
+            fnm = f.name
+            f.write(img.tobytes())
+    except OSError as e:
+        # E.g. the directory is full, the page is rendered again in process.
+        logging.warning(f"PdfDocument: can't write the bitmap of page {page_no}: {e}")
+        if fnm:
+            _remove(fnm)
+        return None
+    return fnm, img.mode, img.size
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=pool_context())
+        return _pool
+
+
+def _reset_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class PdfDocument:
+    """
+    A PDF given as a path or bytes, parsed by the worker pool.
+    Calls fall back to in-process pdfplumber behind the global lock if the pool is disabled or broken.
+    """
+
+    def __init__(self, fnm):
+        self.path = fnm if isinstance(fnm, str) else None
+        self.binary = None if isinstance(fnm, str) else fnm
+        self.pdf = None
+        if PDF_WORKERS > 0 and self.path is None:
+            path = None
+            try:
+                with tempfile.NamedTemporaryFile(dir=PDF_WORKER_TMP_DIR, prefix="ragflow_pdf_", suffix=".pdf", delete=False) as f:
+                    path = f.name
+                    f.write(fnm)
+                self.path = path
+                weakref.finalize(self, _remove, path)
+            except OSError as e:
+                # E.g. the directory is full, the document is then parsed in process.
+                logging.warning(f"PdfDocument: can't write the PDF for the worker pool, parsing it in process: {e}")
+                if path:
+                    _remove(path)
+
+    def _local(self):
+        if self.pdf is None:
+            self.pdf = pdfplumber.open(self.path) if self.binary is None else pdfplumber.open(BytesIO(self.binary))
+        return self.pdf
+
+    def _submit(self, fn, *args):
+        # Errors of the document itself are raised as in process. Only a dead worker resets
+        # the shared pool, and this call then runs in process.
+        if PDF_WORKERS > 0 and self.path is not None:
+            pool = _get_pool()
+            try:
+                future = pool.submit(fn, self.path, *args)
+            except BrokenProcessPool:
+                future = None
+            except RuntimeError:
+                # Shut down by another document that found it broken.
+                logging.warning(f"PdfDocument: the PDF worker pool is being reset, running {fn.__name__} in process")
+                return None
+            try:
+                if future is not None:
+                    return future.result()
+            except BrokenProcessPool:
+                pass
+            logging.error(f"PdfDocument: the PDF worker pool broke during {fn.__name__}, running it in process")
+            _reset_pool(pool)
+        return None
+
+    def extract_chars(self, page_from, page_to):
+        """Returns the total number of pages, and the colored chars of pages [page_from, page_to)."""
+        res = self._submit(_worker_extract_chars, page_from, page_to)
+        if res is not None:
+            return res
+        with sys.modules[LOCK_KEY_pdfplumber]:
+            return _extract_chars(self._local(), page_from, page_to)
+
+    def render(self, page_no, resolution):
+        res = self._submit(_worker_render, page_no, resolution)
+        if res is not None:
+            fnm, mode, size = res
+            try:
+                return Image.fromarray(np.fromfile(fnm, dtype=np.uint8).reshape(size[1], size[0], len(mode)), mode)
+            finally:
+                _remove(fnm)
+        with sys.modules[LOCK_KEY_pdfplumber]:
+            return _render(self._local(), page_no, resolution)
+
+    def page_count(self):
+        if PDF_WORKERS > 0:
+            res = self._submit(_worker_extract_chars, 0, 0)
+            if res is not None:
+                return res[0]
+        with sys.modules[LOCK_KEY_pdfplumber]:
+            return len(self._local().pages)
+
+    def close(self):
+        if self.pdf is not None:
+            self.pdf.close()
+            self.pdf = None
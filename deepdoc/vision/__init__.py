@@ -19,8 +19,8 @@ import threading
 
 import pdfplumber
 
-from .ocr import OCR
-from .recognizer import Recognizer
+from .ocr import OCR, RecognitionScheduler, shared_model
+from .recognizer import BoxArray, Recognizer
 from .layout_recognizer import AscendLayoutRecognizer
 from .layout_recognizer import LayoutRecognizer4YOLOv10 as LayoutRecognizer
 from .table_structure_recognizer import TableStructureRecognizer
@@ -82,9 +82,12 @@ def init_in_out(args):
 
 __all__ = [
     "OCR",
+    "RecognitionScheduler",
     "Recognizer",
+    "BoxArray",
     "LayoutRecognizer",
     "AscendLayoutRecognizer",
     "TableStructureRecognizer",
     "init_in_out",
+    "shared_model",
 ]
@@ -0,0 +1,109 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Box geometry of Recognizer on lists of dict boxes and on BoxArray, on synthetic dense pages,
+checking both give the same results.
+
+    python -m deepdoc.vision.box_benchmark --boxes 2000 --chars 8 --pages 3
+"""
+import argparse
+import random
+from copy import deepcopy
+from timeit import default_timer as timer
+
+from deepdoc.vision.recognizer import BoxArray, Recognizer
+
+
+def dense_page(n_boxes, n_chars, seed):
+    """Text lines in two columns, the chars of each line, and table rows and layouts over them."""
+    rnd = random.Random(seed)
+    boxes, chars, rows, layouts = [], [], [], []
+    lines = (n_boxes + 1) // 2
+    line_height = 14.0
+    height = 20 + lines * line_height
+    for i in range(n_boxes):
+        col, ln = i % 2, i // 2
+        x0 = 20 + col * 300 + rnd.uniform(0, 10)
+        x1 = x0 + rnd.uniform(100, 280)
+        top = 20 + ln * line_height + rnd.uniform(0, line_height * 0.2)
+        bottom = top + line_height * rnd.uniform(0.6, 1.1)
+        boxes.append({"x0": x0, "x1": x1, "top": top, "bottom": bottom, "text": ""})
+        w = (x1 - x0) / n_chars
+        for j in range(n_chars):
+            cx = x0 + j * w + rnd.uniform(-w / 2, w / 2)
+            chars.append({"x0": cx, "x1": cx + w * rnd.uniform(0.5, 1.2), "top": top + rnd.uniform(-1, 1), "bottom": bottom + rnd.uniform(-1, 1)})
+    for top in range(20, int(height), 15):
+        rows.append({"x0": 10.0, "x1": 620.0, "top": float(top), "bottom": top + rnd.uniform(10, 20)})
+    for top in range(20, int(height), 40):
+        for col in range(2):
+            x0 = 15 + col * 300 + rnd.uniform(-5, 5)
+            layouts.append({"type": rnd.choice(["text", "title"]), "x0": x0, "x1": x0 + 290, "top": float(top), "bottom": top + rnd.uniform(30, 60)})
+    boxes = Recognizer.sort_Y_firstly(boxes, line_height / 3)
+    layouts = Recognizer.sort_Y_firstly(layouts, 10)
+    return boxes, chars, rows, layouts
+
+
+def timed(fn, repeat):
+    res = None
+    st = timer()
+    for _ in range(repeat):
+        res = fn()
+    return res, (timer() - st) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--boxes", type=int, default=2000, help="Text boxes per page.")
+    parser.add_argument("--chars", type=int, default=8, help="Chars per text box.")
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    totals = {}
+    mismatches = 0
+    for pn in range(args.pages):
+        boxes, chars, rows, layouts = dense_page(args.boxes, args.chars, pn)
+        cases = {
+            "find_overlapped": (
+                lambda: [Recognizer.find_overlapped(c, boxes) for c in chars],
+                lambda: Recognizer.find_overlapped_batch(chars, BoxArray(boxes)),
+            ),
+            "find_overlapped_with_threshold": (
+                lambda: [Recognizer.find_overlapped_with_threshold(b, rows, thr=0.3) for b in boxes],
+                lambda: [Recognizer.find_overlapped_with_threshold(b, arr, thr=0.3) for arr in [BoxArray(rows)] for b in boxes],
+            ),
+            "layouts_cleanup": (
+                lambda: Recognizer.layouts_cleanup(boxes, deepcopy(layouts), 5, 0.5),
+                lambda: Recognizer.layouts_cleanup(BoxArray(boxes), deepcopy(layouts), 5, 0.5),
+            ),
+        }
+        for name, (loop, array) in cases.items():
+            a, t_loop = timed(loop, args.repeat)
+            b, t_array = timed(array, args.repeat)
+            if a != b:
+                mismatches += 1
+                print(f"MISMATCH {name} on page {pn}")
+            t = totals.setdefault(name, [0.0, 0.0])
+            t[0] += t_loop
+            t[1] += t_array
+
+    print(f"pages: {args.pages}, boxes per page: {args.boxes}, chars per page: {args.boxes * args.chars}, mismatches: {mismatches}")
+    for name, (t_loop, t_array) in totals.items():
+        print(f"{name:32s} lists: {t_loop * 1000 / args.pages:9.1f} ms/page  BoxArray: {t_array * 1000 / args.pages:9.1f} ms/page ({t_loop / t_array:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -26,7 +26,7 @@ import numpy as np
 from huggingface_hub import snapshot_download
 
 from api.utils.file_utils import get_project_base_directory
-from deepdoc.vision import Recognizer
+from deepdoc.vision import BoxArray, Recognizer
 from deepdoc.vision.operators import nms
 
 
@@ -78,6 +78,7 @@ class LayoutRecognizer(Recognizer):
         page_layout = []
         for pn, lts in enumerate(layouts):
             bxs = ocr_res[pn]
+            page_height = image_list.page_size(pn)[1] if hasattr(image_list, "page_size") else image_list[pn].size[1]
             lts = [
                 {
                     "type": b["type"],
@@ -92,7 +93,7 @@ class LayoutRecognizer(Recognizer):
                 if float(b["score"]) >= 0.4 or b["type"] not in self.garbage_layouts
             ]
             lts = self.sort_Y_firstly(lts, np.mean([lt["bottom"] - lt["top"] for lt in lts]) / 2)
-            lts = self.layouts_cleanup(bxs, lts)
+            lts = self.layouts_cleanup(BoxArray(bxs), lts)
             page_layout.append(lts)
 
             def findLayout(ty):
@@ -114,8 +115,8 @@ class LayoutRecognizer(Recognizer):
                         continue
                     lts_[ii]["visited"] = True
                     keep_feats = [
-                        lts_[ii]["type"] == "footer" and bxs[i]["bottom"] < image_list[pn].size[1] * 0.9 / scale_factor,
-                        lts_[ii]["type"] == "header" and bxs[i]["top"] > image_list[pn].size[1] * 0.1 / scale_factor,
+                        lts_[ii]["type"] == "footer" and bxs[i]["bottom"] < page_height * 0.9 / scale_factor,
+                        lts_[ii]["type"] == "header" and bxs[i]["top"] > page_height * 0.1 / scale_factor,
                     ]
                     if drop and lts_[ii]["type"] in self.garbage_layouts and not any(keep_feats):
                         if lts_[ii]["type"] not in garbages:
@@ -393,7 +394,7 @@ class AscendLayoutRecognizer(Recognizer):
                 lts = self.sort_Y_firstly(lts, avg_h / 2 if avg_h > 0 else 0)
 
             bxs = ocr_res[pn]
-            lts = self.layouts_cleanup(bxs, lts)
+            lts = self.layouts_cleanup(BoxArray(bxs), lts)
             page_layout.append(lts)
 
             def _tag_layout(ty):
@@ -16,8 +16,10 @@
 import gc
 import logging
 import copy
+import threading
 import time
 import os
+import platform
 
 from huggingface_hub import snapshot_download
 
@@ -33,6 +35,30 @@ import onnxruntime as ort
 from .postprocess import build_post_process
 
 loaded_models = {}
+loaded_models_lock = threading.RLock()
+shared_models = {}
+
+
+def _available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# ONNX Runtime threads of every session. Sessions are shared by all parsers of a process.
+ORT_INTRA_OP_THREADS = int(os.environ.get("ORT_INTRA_OP_THREADS", _available_cores()))
+ORT_INTER_OP_THREADS = int(os.environ.get("ORT_INTER_OP_THREADS", _available_cores()))
+# Directory where graph-optimized models are saved on first load, and loaded from afterwards.
+ORT_OPTIMIZED_MODEL_DIR = os.environ.get("ORT_OPTIMIZED_MODEL_DIR", "")
+
+# Text line recognition batches: at most OCR_REC_BATCH_SIZE crops, and at most OCR_REC_BATCH_WIDTH
+# columns of padded input summed over the batch. Padded widths are rounded up to OCR_REC_WIDTH_BUCKET.
+OCR_REC_BATCH_SIZE = int(os.environ.get("OCR_REC_BATCH_SIZE", 64))
+OCR_REC_BATCH_WIDTH = int(os.environ.get("OCR_REC_BATCH_WIDTH", 64 * 320))
+OCR_REC_WIDTH_BUCKET = int(os.environ.get("OCR_REC_WIDTH_BUCKET", 32))
+# Crops queued across pages by RecognitionScheduler before they are recognized.
+OCR_REC_QUEUE_SIZE = int(os.environ.get("OCR_REC_QUEUE_SIZE", 512))
 
 def transform(data, ops=None):
     """ transform """
@@ -67,16 +93,53 @@ def create_operators(op_param_list, global_config=None):
     return ops
 
 
+def shared_model(key, factory):
+    """
+    Returns the model registered under `key`, built by `factory()` the first time it's asked for.
+    Models are shared by all parser instances and threads of the process, so they must not keep
+    per-call state on the instance.
+    """
+    model = shared_models.get(key)
+    if model is not None:
+        return model
+    with loaded_models_lock:
+        model = shared_models.get(key)
+        if model is None:
+            model = factory()
+            shared_models[key] = model
+            logging.info(f"shared_model {key} loaded")
+        return model
+
+
+def _optimized_model_path(model_file_path, provider):
+    if not ORT_OPTIMIZED_MODEL_DIR:
+        return None
+    # Optimized graphs are specific to the execution provider, the machine and the ONNX Runtime build.
+    stat = os.stat(model_file_path)
+    nm = os.path.splitext(os.path.basename(model_file_path))[0]
+    return os.path.join(ORT_OPTIMIZED_MODEL_DIR, f"{nm}.{stat.st_size}.{int(stat.st_mtime)}.{provider}.{platform.machine()}.{ort.__version__}.onnx")
+
+
 def load_model(model_dir, nm, device_id: int | None = None):
     model_file_path = os.path.join(model_dir, nm + ".onnx")
     model_cached_tag = model_file_path + str(device_id) if device_id is not None else model_file_path
 
-    global loaded_models
     loaded_model = loaded_models.get(model_cached_tag)
     if loaded_model:
         logging.info(f"load_model {model_file_path} reuses cached model")
         return loaded_model
 
+    with loaded_models_lock:
+        loaded_model = loaded_models.get(model_cached_tag)
+        if loaded_model:
+            logging.info(f"load_model {model_file_path} reuses cached model")
+            return loaded_model
+        loaded_model = _load_model(model_file_path, device_id)
+        loaded_models[model_cached_tag] = loaded_model
+        return loaded_model
+
+
+def _load_model(model_file_path, device_id: int | None = None):
     if not os.path.exists(model_file_path):
         raise ValueError("not find model file path {}".format(
             model_file_path))
@@ -91,44 +154,63 @@ def load_model(model_dir, nm, device_id: int | None = None):
         return False
 
     options = ort.SessionOptions()
-    options.enable_cpu_mem_arena = False
+    # The CPU arena is kept, and shrunk after every run through run_options below.
+    options.enable_cpu_mem_arena = True
     options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
-    options.intra_op_num_threads = 2
-    options.inter_op_num_threads = 2
+    options.intra_op_num_threads = ORT_INTRA_OP_THREADS
+    options.inter_op_num_threads = ORT_INTER_OP_THREADS
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+    use_cuda = cuda_is_available()
+    sess_path = model_file_path
+    optimized_path = _optimized_model_path(model_file_path, "cuda" if use_cuda else "cpu")
+    saving_path = None
+    if optimized_path and os.path.exists(optimized_path):
+        # Already optimized, skip the graph optimizations.
+        sess_path = optimized_path
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+    elif optimized_path:
+        os.makedirs(ORT_OPTIMIZED_MODEL_DIR, exist_ok=True)
+        saving_path = f"{optimized_path[:-len('.onnx')]}.{os.getpid()}.tmp.onnx"
+        options.optimized_model_filepath = saving_path
 
     # https://github.com/microsoft/onnxruntime/issues/9509#issuecomment-951546580
     # Shrink GPU memory after execution
     run_options = ort.RunOptions()
-    if cuda_is_available():
+    if use_cuda:
         cuda_provider_options = {
             "device_id": device_id, # Use specific GPU
             "gpu_mem_limit": 512 * 1024 * 1024, # Limit gpu memory
             "arena_extend_strategy": "kNextPowerOfTwo",  # gpu memory allocation strategy
         }
         sess = ort.InferenceSession(
-            model_file_path,
-            options=options,
+            sess_path,
+            sess_options=options,
             providers=['CUDAExecutionProvider'],
             provider_options=[cuda_provider_options]
             )
         run_options.add_run_config_entry("memory.enable_memory_arena_shrinkage", "gpu:" + str(device_id))
-        logging.info(f"load_model {model_file_path} uses GPU")
+        logging.info(f"load_model {sess_path} uses GPU")
     else:
         sess = ort.InferenceSession(
-            model_file_path,
-            options=options,
+            sess_path,
+            sess_options=options,
             providers=['CPUExecutionProvider'])
         run_options.add_run_config_entry("memory.enable_memory_arena_shrinkage", "cpu")
-        logging.info(f"load_model {model_file_path} uses CPU")
-    loaded_model = (sess, run_options)
-    loaded_models[model_cached_tag] = loaded_model
-    return loaded_model
+        logging.info(f"load_model {sess_path} uses CPU")
+    if saving_path:
+        try:
+            os.replace(saving_path, optimized_path)
+            logging.info(f"load_model saved the optimized model {optimized_path}")
+        except OSError:
+            logging.exception(f"load_model failed to save the optimized model {optimized_path}")
+    return sess, run_options
 
 
 class TextRecognizer:
     def __init__(self, model_dir, device_id: int | None = None):
         self.rec_image_shape = [int(v) for v in "3, 48, 320".split(",")]
-        self.rec_batch_num = 16
+        self.rec_batch_num = OCR_REC_BATCH_SIZE
         postprocess_params = {
             'name': 'CTCLabelDecode',
             "character_dict_path": os.path.join(model_dir, "ocr.res"),
@@ -137,6 +219,79 @@ class TextRecognizer:
         self.postprocess_op = build_post_process(postprocess_params)
         self.predictor, self.run_options = load_model(model_dir, 'rec', device_id)
         self.input_tensor = self.predictor.get_inputs()[0]
+        self.output_name = self.predictor.get_outputs()[0].name
+        # The input buffer and the IO binding are reused between calls, one of each per calling thread.
+        self.local = threading.local()
+
+    def batch_width(self, max_wh_ratio):
+        """Padded input width of a batch, rounded up to a bucket so input shapes repeat."""
+        imgH = self.rec_image_shape[1]
+        w = self.input_tensor.shape[3:][0]
+        if not isinstance(w, str) and w is not None and w > 0:
+            return w
+        imgW = int((imgH * max_wh_ratio))
+        return max(OCR_REC_WIDTH_BUCKET, -(-imgW // OCR_REC_WIDTH_BUCKET) * OCR_REC_WIDTH_BUCKET)
+
+    def input_buffer(self, batch_size, imgW):
+        """
+        A (batch_size, C, H, imgW) batch viewed on a single buffer per calling thread, grown when a batch
+        doesn't fit. Batches are capped by OCR_REC_BATCH_WIDTH, so is the buffer.
+        """
+        imgC, imgH = self.rec_image_shape[:2]
+        size = batch_size * imgC * imgH * imgW
+        buf = getattr(self.local, "buffer", None)
+        if buf is None or len(buf) < size:
+            buf = self.local.buffer = np.empty(size, dtype=np.float32)
+        return buf[:size].reshape(batch_size, imgC, imgH, imgW)
+
+    def norm_img_into(self, img, out):
+        """Same as resize_norm_img, written into a slot of a pre-allocated batch."""
+        imgC, imgH, imgW = out.shape
+        assert imgC == img.shape[2]
+        h, w = img.shape[:2]
+        resized_w = min(imgW, int(math.ceil(imgH * w / float(h))))
+        resized_image = cv2.resize(img, (resized_w, imgH))
+        dst = out[:, :, :resized_w]
+        dst[...] = resized_image.transpose((2, 0, 1))
+        dst /= 255
+        dst -= 0.5
+        dst /= 0.5
+        out[:, :, resized_w:] = 0
+
+    def batches(self, img_list):
+        """
+        Groups crops of similar aspect ratio into batches so that little padding is needed.
+        Returns (indices, width) pairs, widest batches last.
+        """
+        imgC, imgH, imgW = self.rec_image_shape[:3]
+        ratios = np.array([img.shape[1] / float(img.shape[0]) for img in img_list])
+        # Sorting can speed up the recognition process
+        indices = np.argsort(ratios, kind="stable")
+        res = []
+        beg = 0
+        while beg < len(indices):
+            end = beg + 1
+            while end < len(indices) and end - beg < self.rec_batch_num:
+                # ratios are sorted, so the last crop of a batch sets its width
+                width = self.batch_width(max(imgW / imgH, ratios[indices[end]]))
+                if (end - beg + 1) * width > OCR_REC_BATCH_WIDTH:
+                    break
+                end += 1
+            res.append((indices[beg:end], self.batch_width(max(imgW / imgH, ratios[indices[end - 1]]))))
+            beg = end
+        return res
+
+    def run(self, norm_img_batch):
+        binding = getattr(self.local, "binding", None)
+        if binding is None:
+            binding = self.local.binding = self.predictor.io_binding()
+        binding.bind_cpu_input(self.input_tensor.name, norm_img_batch)
+        binding.bind_output(self.output_name)
+        self.predictor.run_with_iobinding(binding, self.run_options)
+        outputs = binding.copy_outputs_to_cpu()
+        binding.clear_binding_inputs()
+        binding.clear_binding_outputs()
+        return outputs
 
     def resize_norm_img(self, img, max_wh_ratio):
         imgC, imgH, imgW = self.rec_image_shape
@@ -357,39 +512,17 @@ class TextRecognizer:
 
     def __call__(self, img_list):
         img_num = len(img_list)
-        # Calculate the aspect ratio of all text bars
-        width_list = []
-        for img in img_list:
-            width_list.append(img.shape[1] / float(img.shape[0]))
-        # Sorting can speed up the recognition process
-        indices = np.argsort(np.array(width_list))
         rec_res = [['', 0.0]] * img_num
-        batch_num = self.rec_batch_num
         st = time.time()
 
-        for beg_img_no in range(0, img_num, batch_num):
-            end_img_no = min(img_num, beg_img_no + batch_num)
-            norm_img_batch = []
-            imgC, imgH, imgW = self.rec_image_shape[:3]
-            max_wh_ratio = imgW / imgH
-            # max_wh_ratio = 0
-            for ino in range(beg_img_no, end_img_no):
-                h, w = img_list[indices[ino]].shape[0:2]
-                wh_ratio = w * 1.0 / h
-                max_wh_ratio = max(max_wh_ratio, wh_ratio)
-            for ino in range(beg_img_no, end_img_no):
-                norm_img = self.resize_norm_img(img_list[indices[ino]],
-                                                max_wh_ratio)
-                norm_img = norm_img[np.newaxis, :]
-                norm_img_batch.append(norm_img)
-            norm_img_batch = np.concatenate(norm_img_batch)
-            norm_img_batch = norm_img_batch.copy()
-
-            input_dict = {}
-            input_dict[self.input_tensor.name] = norm_img_batch
+        for indices, imgW in self.batches(img_list):
+            norm_img_batch = self.input_buffer(len(indices), imgW)
+            for i, ino in enumerate(indices):
+                self.norm_img_into(img_list[ino], norm_img_batch[i])
+
             for i in range(100000):
                 try:
-                    outputs = self.predictor.run(None, input_dict, self.run_options)
+                    outputs = self.run(norm_img_batch)
                     break
                 except Exception as e:
                     if i >= 3:
@@ -398,7 +531,7 @@ class TextRecognizer:
             preds = outputs[0]
             rec_result = self.postprocess_op(preds)
             for rno in range(len(rec_result)):
-                rec_res[indices[beg_img_no + rno]] = rec_result[rno]
+                rec_res[indices[rno]] = rec_result[rno]
 
         return rec_res, time.time() - st
 
@@ -744,3 +877,42 @@ class OCR:
         #    print(f"{bno}, {rec_res[bno]}")
 
         return list(zip([a.tolist() for a in filter_boxes], filter_rec_res))
+
+
+class RecognitionScheduler:
+    """
+    Collects text-line crops of many pages and recognizes them together, so that the recognizer
+    sees large batches of similar widths instead of a few lines per page.
+
+    `submit` queues the crops of a page with a callback receiving their texts, in order. The queue
+    is recognized once it holds `max_pending` crops, or on `flush`.
+    """
+
+    def __init__(self, ocr: OCR, device_id: int | None = None, max_pending: int = OCR_REC_QUEUE_SIZE):
+        self.ocr = ocr
+        self.device_id = device_id
+        self.max_pending = max_pending
+        self.pending = []
+        self.pending_num = 0
+        self.lock = threading.Lock()
+
+    def submit(self, img_list, done):
+        with self.lock:
+            self.pending.append((img_list, done))
+            self.pending_num += len(img_list)
+            full = self.pending_num >= self.max_pending
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            jobs, self.pending, self.pending_num = self.pending, [], 0
+        if not jobs:
+            return
+        st = time.time()
+        texts = self.ocr.recognize_batch([img for img_list, _ in jobs for img in img_list], self.device_id)
+        logging.info(f"RecognitionScheduler recognized {len(texts)} text lines of {len(jobs)} pages in {time.time() - st}s")
+        i = 0
+        for img_list, done in jobs:
+            done(texts[i:i + len(img_list)])
+            i += len(img_list)
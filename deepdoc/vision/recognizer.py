@@ -28,6 +28,54 @@ from .operators import preprocess
 from . import operators
 from .ocr import load_model
 
+BOX_DTYPE = np.dtype([("x0", np.float64), ("x1", np.float64), ("top", np.float64), ("bottom", np.float64)])
+
+
+class BoxArray:
+    """
+    The coordinates of a list of dict boxes in a structured array, so that geometry queries run over
+    all boxes at once. Boxes are also indexed on y: sorted by top, with the running max of bottom, so a
+    query only looks at the boxes whose y range can intersect its own.
+    Recognizer.find_overlapped_batch, find_overlapped_with_threshold and layouts_cleanup take one in
+    place of the list.
+    """
+
+    def __init__(self, boxes):
+        self.boxes = boxes
+        self.coords = np.fromiter(((b["x0"], b["x1"], b["top"], b["bottom"]) for b in boxes), dtype=BOX_DTYPE, count=len(boxes))
+        self.order = np.argsort(self.coords["top"], kind="stable")
+        self.tops = self.coords["top"][self.order]
+        self.max_bottoms = np.maximum.accumulate(self.coords["bottom"][self.order]) if len(boxes) else self.tops
+
+    def __len__(self):
+        return len(self.boxes)
+
+    @staticmethod
+    def coords_of(box):
+        return np.array((box["x0"], box["x1"], box["top"], box["bottom"]), dtype=BOX_DTYPE)
+
+    def in_y_range(self, top, bottom):
+        """Indices, ascending, of the boxes with bottom >= top and top <= bottom."""
+        lo = np.searchsorted(self.max_bottoms, top, "left")
+        hi = np.searchsorted(self.tops, bottom, "right")
+        if lo >= hi:
+            return np.empty(0, dtype=np.int64)
+        idx = self.order[lo:hi]
+        return np.sort(idx[self.coords["bottom"][idx] >= top])
+
+    @staticmethod
+    def overlapped_areas(a, b, ratio=True):
+        """Recognizer.overlapped_area(a, b, ratio) over arrays of BOX_DTYPE, broadcast against each other."""
+        disjoint = (b["x0"] > a["x1"]) | (b["x1"] < a["x0"]) | (b["bottom"] < a["top"]) | (b["top"] > a["bottom"])
+        w = a["x1"] - a["x0"]
+        h = a["bottom"] - a["top"]
+        ov = (np.minimum(b["bottom"], a["bottom"]) - np.maximum(b["top"], a["top"])) * (np.minimum(b["x1"], a["x1"]) - np.maximum(b["x0"], a["x0"]))
+        ov = np.where(disjoint | (w == 0) | (h == 0), 0.0, ov)
+        if ratio:
+            ov = np.divide(ov, w * h, out=ov, where=ov > 0)
+        return ov
+
+
 class Recognizer:
     def __init__(self, label_list, task_name, model_dir=None):
         """
@@ -131,8 +179,15 @@ class Recognizer:
             ov /= (x1 - x0) * (btm - tp)
         return ov
 
+    @staticmethod
+    def overlapped_box_areas(boxes: BoxArray, box):
+        """overlapped_area(b, box, False) of the boxes b overlapping box, in list order."""
+        idx = boxes.in_y_range(box["top"], box["bottom"])
+        return BoxArray.overlapped_areas(boxes.coords[idx], BoxArray.coords_of(box), False)
+
     @staticmethod
     def layouts_cleanup(boxes, layouts, far=2, thr=0.7):
+        """`boxes` is a list of dict boxes, or a BoxArray of them."""
         def not_overlapped(a, b):
             return any([a["x1"] < b["x0"],
                         a["x0"] > b["x1"],
@@ -162,11 +217,16 @@ class Recognizer:
                 continue
 
             area_i, area_i_1 = 0, 0
-            for b in boxes:
-                if not not_overlapped(b, layouts[i]):
-                    area_i += Recognizer.overlapped_area(b, layouts[i], False)
-                if not not_overlapped(b, layouts[j]):
-                    area_i_1 += Recognizer.overlapped_area(b, layouts[j], False)
+            if isinstance(boxes, BoxArray):
+                # summed in list order, like the loop below
+                area_i = sum(Recognizer.overlapped_box_areas(boxes, layouts[i]).tolist())
+                area_i_1 = sum(Recognizer.overlapped_box_areas(boxes, layouts[j]).tolist())
+            else:
+                for b in boxes:
+                    if not not_overlapped(b, layouts[i]):
+                        area_i += Recognizer.overlapped_area(b, layouts[i], False)
+                    if not not_overlapped(b, layouts[j]):
+                        area_i_1 += Recognizer.overlapped_area(b, layouts[j], False)
 
             if area_i > area_i_1:
                 layouts.pop(j)
@@ -249,6 +309,53 @@ class Recognizer:
 
         return max_overlapped_i
 
+    @staticmethod
+    def find_overlapped_batch(boxes, boxes_sorted_by_y, naive=False, chunk=256):
+        """
+        find_overlapped for every box of `boxes` at once. `boxes_sorted_by_y` is a list of dict boxes,
+        or a BoxArray of them. The binary searches run on all boxes together, and the overlaps of a
+        chunk of boxes are computed against the boxes in its y range only.
+        """
+        bxs = boxes_sorted_by_y if isinstance(boxes_sorted_by_y, BoxArray) else BoxArray(boxes_sorted_by_y)
+        res = [None] * len(boxes)
+        if not len(boxes) or not len(bxs):
+            return res
+        q = BoxArray(boxes).coords
+        tops, bottoms = bxs.coords["top"], bxs.coords["bottom"]
+        n = len(bxs)
+        s = np.zeros(len(q), dtype=np.int64)
+        e = np.full(len(q), n, dtype=np.int64)
+        ii = np.zeros(len(q), dtype=np.int64)
+        active = s < e
+        while not naive and active.any():
+            act = np.flatnonzero(active)
+            mid = (e[act] + s[act]) // 2
+            ii[act] = mid
+            go_up = q["bottom"][act] < tops[mid]
+            go_down = ~go_up & (q["top"][act] > bottoms[mid])
+            e[act[go_up]] = mid[go_up]
+            s[act[go_down]] = mid[go_down] + 1
+            active[act[~go_up & ~go_down]] = False
+            active &= s < e
+        if not naive:
+            # find_overlapped moves each end at most one step after the search
+            s += (s < ii) & (q["top"] > bottoms[np.minimum(s, n - 1)])
+            e -= (e - 1 > ii) & (q["bottom"] < tops[np.clip(e - 1, 0, n - 1)])
+
+        order = np.argsort(q["top"], kind="stable")
+        for beg in range(0, len(order), chunk):
+            rows = order[beg:beg + chunk]
+            cols = bxs.in_y_range(q["top"][rows].min(), q["bottom"][rows].max())
+            if not len(cols):
+                continue
+            ov = BoxArray.overlapped_areas(bxs.coords[cols][np.newaxis, :], q[rows][:, np.newaxis])
+            ov[(cols[np.newaxis, :] < s[rows][:, np.newaxis]) | (cols[np.newaxis, :] >= e[rows][:, np.newaxis])] = 0
+            best = ov.argmax(axis=1)
+            for r, b, v in zip(rows.tolist(), best.tolist(), ov[np.arange(len(rows)), best].tolist()):
+                if v > 0:
+                    res[r] = int(cols[b])
+        return res
+
     @staticmethod
     def find_horizontally_tightest_fit(box, boxes):
         if not boxes:
@@ -265,8 +372,23 @@ class Recognizer:
 
     @staticmethod
     def find_overlapped_with_threshold(box, boxes, thr=0.3):
-        if not boxes:
+        """`boxes` is a list of dict boxes, or a BoxArray of them."""
+        if not len(boxes):
             return
+        if isinstance(boxes, BoxArray):
+            # Boxes not overlapping at all score (0, 0), which never passes a positive threshold.
+            idx = boxes.in_y_range(box["top"], box["bottom"]) if thr > 0 else np.arange(len(boxes))
+            if not len(idx):
+                return
+            coords, q = boxes.coords[idx], BoxArray.coords_of(box)
+            ov = BoxArray.overlapped_areas(q, coords)
+            _ov = BoxArray.overlapped_areas(coords, q)
+            # the last of the lexicographically largest (ov, _ov), like the loop below
+            m = ov.max()
+            _m = _ov[ov == m].max()
+            if (m, _m) < (thr, 0):
+                return
+            return int(idx[np.flatnonzero((ov == m) & (_ov == _m))[-1]])
         max_overlapped_i, max_overlapped, _max_overlapped = None, thr, 0
         s, e = 0, len(boxes)
         for i in range(s, e):
@@ -414,18 +536,15 @@ class Recognizer:
 
     def __call__(self, image_list, thr=0.7, batch_size=16):
         res = []
-        images = []
-        for i in range(len(image_list)):
-            if not isinstance(image_list[i], np.ndarray):
-                images.append(np.array(image_list[i]))
-            else:
-                images.append(image_list[i])
-
-        batch_loop_cnt = math.ceil(float(len(images)) / batch_size)
+        # Images are converted batch by batch, so only one batch of page arrays is alive at a time.
+        batch_loop_cnt = math.ceil(float(len(image_list)) / batch_size)
         for i in range(batch_loop_cnt):
             start_index = i * batch_size
-            end_index = min((i + 1) * batch_size, len(images))
-            batch_image_list = images[start_index:end_index]
+            end_index = min((i + 1) * batch_size, len(image_list))
+            batch_image_list = []
+            for j in range(start_index, end_index):
+                img = image_list[j]
+                batch_image_list.append(img if isinstance(img, np.ndarray) else np.array(img))
             inputs = self.preprocess(batch_image_list)
             logging.debug("preprocess")
             for ins in inputs:
@@ -35,6 +35,11 @@ GRAPH_FIELD_SEP = "<SEP>"
 ErrorHandlerFn = Callable[[BaseException | None, str | None, dict | None], None]
 
 chat_limiter = trio.CapacityLimiter(int(os.environ.get("MAX_CONCURRENT_CHATS", 10)))
+GRAPH_BULK_SIZE = int(os.environ.get("GRAPH_BULK_SIZE", 256))
+GRAPH_BULK_BYTES = int(os.environ.get("GRAPH_BULK_BYTES", 16 * 1024 * 1024))
+GRAPH_BULK_CONCURRENCY = int(os.environ.get("GRAPH_BULK_CONCURRENCY", 4))
+GRAPH_DELETE_BATCH_SIZE = int(os.environ.get("GRAPH_DELETE_BATCH_SIZE", 1024))
+GRAPH_EMBEDDING_BATCH_SIZE = int(os.environ.get("GRAPH_EMBEDDING_BATCH_SIZE", 64))
 
 
 @dataclasses.dataclass
@@ -115,26 +120,39 @@ def set_llm_cache(llmnm, txt, v, history, genconf):
     REDIS_CONN.set(k, v.encode("utf-8"), 24 * 3600)
 
 
-def get_embed_cache(llmnm, txt):
+def _embed_cache_key(llmnm, txt):
     hasher = xxhash.xxh64()
     hasher.update(str(llmnm).encode("utf-8"))
     hasher.update(str(txt).encode("utf-8"))
+    return hasher.hexdigest()
 
-    k = hasher.hexdigest()
-    bin = REDIS_CONN.get(k)
+
+def get_embed_cache(llmnm, txt):
+    bin = REDIS_CONN.get(_embed_cache_key(llmnm, txt))
     if not bin:
         return
     return np.array(json.loads(bin))
 
 
 def set_embed_cache(llmnm, txt, arr):
-    hasher = xxhash.xxh64()
-    hasher.update(str(llmnm).encode("utf-8"))
-    hasher.update(str(txt).encode("utf-8"))
-
-    k = hasher.hexdigest()
     arr = json.dumps(arr.tolist() if isinstance(arr, np.ndarray) else arr)
-    REDIS_CONN.set(k, arr.encode("utf-8"), 24 * 3600)
+    REDIS_CONN.set(_embed_cache_key(llmnm, txt), arr.encode("utf-8"), 24 * 3600)
+
+
+def get_embed_caches(llmnm, txts):
+    """Same as get_embed_cache for every text, in a single MGET."""
+    res = []
+    for bin in REDIS_CONN.mget([_embed_cache_key(llmnm, txt) for txt in txts]) or [None] * len(txts):
+        res.append(np.array(json.loads(bin)) if bin else None)
+    return res
+
+
+def set_embed_caches(llmnm, txts, arrs):
+    """Same as set_embed_cache for every text, in a single pipelined round-trip."""
+    mapping = {}
+    for txt, arr in zip(txts, arrs):
+        mapping[_embed_cache_key(llmnm, txt)] = json.dumps(arr.tolist() if isinstance(arr, np.ndarray) else arr)
+    REDIS_CONN.mset(mapping, 24 * 3600)
 
 
 def get_tags_from_cache(kb_ids):
@@ -301,9 +319,7 @@ def chunk_id(chunk):
     return xxhash.xxh64((chunk["content_with_weight"] + chunk["kb_id"]).encode("utf-8")).hexdigest()
 
 
-async def graph_node_to_chunk(kb_id, embd_mdl, ent_name, meta, chunks):
-    global chat_limiter
-    enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
+def graph_node_to_chunk(kb_id, ent_name, meta):
     chunk = {
         "id": get_uuid(),
         "important_kwd": [ent_name],
@@ -318,16 +334,7 @@ async def graph_node_to_chunk(kb_id, embd_mdl, ent_name, meta, chunks):
         "available_int": 0,
     }
     chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
-    ebd = get_embed_cache(embd_mdl.llm_name, ent_name)
-    if ebd is None:
-        async with chat_limiter:
-            with trio.fail_after(3 if enable_timeout_assertion else 30000000):
-                ebd, _ = await trio.to_thread.run_sync(lambda: embd_mdl.encode([ent_name]))
-        ebd = ebd[0]
-        set_embed_cache(embd_mdl.llm_name, ent_name, ebd)
-    assert ebd is not None
-    chunk["q_%d_vec" % len(ebd)] = ebd
-    chunks.append(chunk)
+    return chunk
 
 
 @timeout(3, 3)
@@ -352,8 +359,7 @@ def get_relation(tenant_id, kb_id, from_ent_name, to_ent_name, size=1):
     return res
 
 
-async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta, chunks):
-    enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
+def graph_edge_to_chunk(kb_id, from_ent_name, to_ent_name, meta):
     chunk = {
         "id": get_uuid(),
         "from_entity_kwd": from_ent_name,
@@ -368,17 +374,40 @@ async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta,
         "available_int": 0,
     }
     chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
-    txt = f"{from_ent_name}->{to_ent_name}"
-    ebd = get_embed_cache(embd_mdl.llm_name, txt)
-    if ebd is None:
+    return chunk
+
+
+async def embed_graph_chunks(embd_mdl, chunks, cache_txts, embd_txts, callback=None, label="nodes"):
+    """
+    Sets the vector of every chunk. `cache_txts` key the embedding cache, which is read with one MGET;
+    the misses are encoded `embd_txts` in batches of GRAPH_EMBEDDING_BATCH_SIZE and written back pipelined.
+    """
+    global chat_limiter
+    enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
+    ebds = await trio.to_thread.run_sync(get_embed_caches, embd_mdl.llm_name, cache_txts)
+    missing = [i for i, ebd in enumerate(ebds) if ebd is None]
+    done = len(chunks) - len(missing)
+
+    async def encode(idxs):
+        nonlocal done
         async with chat_limiter:
-            with trio.fail_after(3 if enable_timeout_assertion else 300000000):
-                ebd, _ = await trio.to_thread.run_sync(lambda: embd_mdl.encode([txt + f": {meta['description']}"]))
-        ebd = ebd[0]
-        set_embed_cache(embd_mdl.llm_name, txt, ebd)
-    assert ebd is not None
-    chunk["q_%d_vec" % len(ebd)] = ebd
-    chunks.append(chunk)
+            with trio.fail_after(3 if enable_timeout_assertion else 30000000):
+                vts, _ = await trio.to_thread.run_sync(embd_mdl.encode, [embd_txts[i] for i in idxs])
+        assert len(vts) == len(idxs)
+        for i, v in zip(idxs, vts):
+            ebds[i] = v
+        await trio.to_thread.run_sync(set_embed_caches, embd_mdl.llm_name, [cache_txts[i] for i in idxs], vts)
+        done += len(idxs)
+        if callback:
+            callback(msg=f"Get embedding of {label}: {done}/{len(chunks)}")
+
+    async with trio.open_nursery() as nursery:
+        for b in range(0, len(missing), GRAPH_EMBEDDING_BATCH_SIZE):
+            nursery.start_soon(encode, missing[b : b + GRAPH_EMBEDDING_BATCH_SIZE])
+
+    for chunk, ebd in zip(chunks, ebds):
+        assert ebd is not None
+        chunk["q_%d_vec" % len(ebd)] = ebd
 
 
 async def does_graph_contains(tenant_id, kb_id, doc_id):
@@ -432,24 +461,26 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
 
     await trio.to_thread.run_sync(settings.docStoreConn.delete, {"knowledge_graph_kwd": ["graph", "subgraph"]}, search.index_name(tenant_id), kb_id)
 
-    if change.removed_nodes:
-        await trio.to_thread.run_sync(settings.docStoreConn.delete, {"knowledge_graph_kwd": ["entity"], "entity_kwd": sorted(change.removed_nodes)}, search.index_name(tenant_id), kb_id)
+    # Removals are sent as `terms` deletes of up to GRAPH_DELETE_BATCH_SIZE values each.
+    conditions = []
+    removed_nodes = sorted(change.removed_nodes)
+    for b in range(0, len(removed_nodes), GRAPH_DELETE_BATCH_SIZE):
+        conditions.append({"knowledge_graph_kwd": ["entity"], "entity_kwd": removed_nodes[b : b + GRAPH_DELETE_BATCH_SIZE]})
+    conditions.extend(removed_edge_conditions(change.removed_edges))
 
-    if change.removed_edges:
-
-        async def del_edges(from_node, to_node):
-            async with chat_limiter:
-                await trio.to_thread.run_sync(
-                    settings.docStoreConn.delete, {"knowledge_graph_kwd": ["relation"], "from_entity_kwd": from_node, "to_entity_kwd": to_node}, search.index_name(tenant_id), kb_id
-                )
+    async def delete(condition):
+        async with chat_limiter:
+            await trio.to_thread.run_sync(settings.docStoreConn.delete, condition, search.index_name(tenant_id), kb_id)
 
-        async with trio.open_nursery() as nursery:
-            for from_node, to_node in change.removed_edges:
-                nursery.start_soon(del_edges, from_node, to_node)
+    async with trio.open_nursery() as nursery:
+        for condition in conditions:
+            nursery.start_soon(delete, condition)
 
     now = trio.current_time()
     if callback:
-        callback(msg=f"set_graph removed {len(change.removed_nodes)} nodes and {len(change.removed_edges)} edges from index in {now - start:.2f}s.")
+        callback(
+            msg=f"set_graph removed {len(change.removed_nodes)} nodes and {len(change.removed_edges)} edges from index with {len(conditions)} requests in {now - start:.2f}s ({(len(change.removed_nodes) + len(change.removed_edges)) / max(now - start, 1e-3):.0f}/s)."
+        )
     start = now
 
     chunks = [
@@ -482,41 +513,95 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
             }
         )
 
-    async with trio.open_nursery() as nursery:
-        for ii, node in enumerate(change.added_updated_nodes):
-            node_attrs = graph.nodes[node]
-            nursery.start_soon(graph_node_to_chunk, kb_id, embd_mdl, node, node_attrs, chunks)
-            if ii % 100 == 9 and callback:
-                callback(msg=f"Get embedding of nodes: {ii}/{len(change.added_updated_nodes)}")
+    nodes = sorted(change.added_updated_nodes)
+    node_chunks = await trio.to_thread.run_sync(lambda: [graph_node_to_chunk(kb_id, node, graph.nodes[node]) for node in nodes])
+    await embed_graph_chunks(embd_mdl, node_chunks, nodes, nodes, callback, "nodes")
+    chunks.extend(node_chunks)
 
-    async with trio.open_nursery() as nursery:
-        for ii, (from_node, to_node) in enumerate(change.added_updated_edges):
-            edge_attrs = graph.get_edge_data(from_node, to_node)
-            if not edge_attrs:
-                # added_updated_edges could record a non-existing edge if both from_node and to_node participate in nodes merging.
-                continue
-            nursery.start_soon(graph_edge_to_chunk, kb_id, embd_mdl, from_node, to_node, edge_attrs, chunks)
-            if ii % 100 == 9 and callback:
-                callback(msg=f"Get embedding of edges: {ii}/{len(change.added_updated_edges)}")
+    edges = []
+    for from_node, to_node in sorted(change.added_updated_edges):
+        edge_attrs = graph.get_edge_data(from_node, to_node)
+        if not edge_attrs:
+            # added_updated_edges could record a non-existing edge if both from_node and to_node participate in nodes merging.
+            continue
+        edges.append((from_node, to_node, edge_attrs))
+    edge_chunks = await trio.to_thread.run_sync(lambda: [graph_edge_to_chunk(kb_id, f, t, attrs) for f, t, attrs in edges])
+    await embed_graph_chunks(
+        embd_mdl,
+        edge_chunks,
+        [f"{f}->{t}" for f, t, _ in edges],
+        [f"{f}->{t}: {attrs['description']}" for f, t, attrs in edges],
+        callback,
+        "edges",
+    )
+    chunks.extend(edge_chunks)
 
     now = trio.current_time()
     if callback:
-        callback(msg=f"set_graph converted graph change to {len(chunks)} chunks in {now - start:.2f}s.")
+        callback(msg=f"set_graph converted graph change to {len(chunks)} chunks in {now - start:.2f}s ({len(chunks) / max(now - start, 1e-3):.0f}/s).")
     start = now
 
     enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
-    es_bulk_size = 4
-    for b in range(0, len(chunks), es_bulk_size):
-        with trio.fail_after(3 if enable_timeout_assertion else 30000000):
-            doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(chunks[b : b + es_bulk_size], search.index_name(tenant_id), kb_id))
-        if b % 100 == es_bulk_size and callback:
-            callback(msg=f"Insert chunks: {b}/{len(chunks)}")
+    inserted = 0
+
+    async def insert(batch):
+        nonlocal inserted
+        async with bulk_limiter:
+            with trio.fail_after(3 if enable_timeout_assertion else 30000000):
+                doc_store_result = await trio.to_thread.run_sync(settings.docStoreConn.insert, batch, search.index_name(tenant_id), kb_id)
         if doc_store_result:
             error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
             raise Exception(error_message)
+        inserted += len(batch)
+        if callback:
+            callback(msg=f"Insert chunks: {inserted}/{len(chunks)}")
+
+    bulk_limiter = trio.CapacityLimiter(GRAPH_BULK_CONCURRENCY)
+    async with trio.open_nursery() as nursery:
+        for batch in bulk_batches(chunks):
+            nursery.start_soon(insert, batch)
     now = trio.current_time()
     if callback:
-        callback(msg=f"set_graph added/updated {len(change.added_updated_nodes)} nodes and {len(change.added_updated_edges)} edges from index in {now - start:.2f}s.")
+        callback(
+            msg=f"set_graph added/updated {len(change.added_updated_nodes)} nodes and {len(change.added_updated_edges)} edges from index in {now - start:.2f}s ({len(chunks) / max(now - start, 1e-3):.0f} chunks/s)."
+        )
+
+
+def removed_edge_conditions(removed_edges) -> list[dict]:
+    """
+    Delete conditions for relation chunks of `removed_edges`. Edges are grouped by whichever end
+    gives fewer groups, so each group is one exact `terms` delete instead of one delete per edge.
+    """
+    by_from = defaultdict(set)
+    by_to = defaultdict(set)
+    for from_node, to_node in removed_edges:
+        by_from[from_node].add(to_node)
+        by_to[to_node].add(from_node)
+    key, other, groups = ("from_entity_kwd", "to_entity_kwd", by_from) if len(by_from) <= len(by_to) else ("to_entity_kwd", "from_entity_kwd", by_to)
+    conditions = []
+    for node in sorted(groups):
+        others = sorted(groups[node])
+        for b in range(0, len(others), GRAPH_DELETE_BATCH_SIZE):
+            conditions.append({"knowledge_graph_kwd": ["relation"], key: node, other: others[b : b + GRAPH_DELETE_BATCH_SIZE]})
+    return conditions
+
+
+def bulk_batches(chunks, max_size=None, max_bytes=None):
+    """Splits chunks into bulk requests of at most `max_size` chunks and roughly `max_bytes` of content."""
+    max_size = max_size or GRAPH_BULK_SIZE
+    max_bytes = max_bytes or GRAPH_BULK_BYTES
+    batch = []
+    size = 0
+    for ck in chunks:
+        ck_size = len(ck.get("content_with_weight", ""))
+        if batch and (len(batch) >= max_size or size + ck_size > max_bytes):
+            yield batch
+            batch = []
+            size = 0
+        batch.append(ck)
+        size += ck_size
+    if batch:
+        yield batch
 
 
 def is_continuous_subsequence(subseq, seq):
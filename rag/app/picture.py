@@ -22,13 +22,13 @@ from PIL import Image
 
 from api.db import LLMType
 from api.db.services.llm_service import LLMBundle
-from deepdoc.vision import OCR
+from deepdoc.vision import OCR, shared_model
 from rag.nlp import tokenize
 from rag.utils import clean_markdown_block
 from rag.nlp import rag_tokenizer
 
 
-ocr = OCR()
+ocr = shared_model("ocr", OCR)
 
 
 def chunk(filename, binary, tenant_id, lang, callback=None, **kwargs):
@@ -35,27 +35,30 @@ from rag.utils import get_float
 
 class Excel(ExcelParser):
     def __call__(self, fnm, binary=None, callback=None):
+        # Read-only mode streams the rows instead of building every cell of the workbook.
         if not binary:
-            wb = load_workbook(fnm)
+            wb = load_workbook(fnm, read_only=True)
         else:
-            wb = load_workbook(BytesIO(binary))
+            wb = load_workbook(BytesIO(binary), read_only=True)
         total = 0
-        for sheetname in wb.sheetnames:
-            total += len(list(wb[sheetname].rows))
+        for ws in wb.worksheets:
+            if ws.max_row is not None and ws.max_row <= 1 and ws.max_column is not None and ws.max_column <= 1:
+                # Some writers leave a dimension of A1 whatever the content.
+                ws.reset_dimensions()
+            total += ws.max_row or 0
+        total = max(total, 1)
 
         res, fails = [], []
-        for sheetname in wb.sheetnames:
-            ws = wb[sheetname]
-            rows = list(ws.rows)
-            for i, r in enumerate(rows):
+        for ws in wb.worksheets:
+            for i, r in enumerate(ws.iter_rows(values_only=True)):
                 q, a = "", ""
-                for cell in r:
-                    if not cell.value:
+                for v in r:
+                    if not v:
                         continue
                     if not q:
-                        q = str(cell.value)
+                        q = str(v)
                     elif not a:
-                        a = str(cell.value)
+                        a = str(v)
                     else:
                         break
                 if q and a:
@@ -63,11 +66,12 @@ class Excel(ExcelParser):
                 else:
                     fails.append(str(i + 1))
                 if len(res) % 999 == 0:
-                    callback(len(res) *
-                             0.6 /
-                             total, ("Extract pairs: {}".format(len(res)) +
-                                     (f"{len(fails)} failure, line: %s..." %
-                                      (",".join(fails[:3])) if fails else "")))
+                    callback(min(len(res) *
+                                 0.6 /
+                                 total, 0.6), ("Extract pairs: {}".format(len(res)) +
+                                               (f"{len(fails)} failure, line: %s..." %
+                                                (",".join(fails[:3])) if fails else "")))
+        wb.close()
 
         callback(0.6, ("Extract pairs: {}. ".format(len(res)) + (
             f"{len(fails)} failure, line: %s..." % (",".join(fails[:3])) if fails else "")))
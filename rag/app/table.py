@@ -17,6 +17,7 @@
 import copy
 import re
 from io import BytesIO
+from itertools import chain, islice
 from xpinyin import Pinyin
 import numpy as np
 import pandas as pd
@@ -31,33 +32,70 @@ from rag.nlp import rag_tokenizer, tokenize
 from deepdoc.parser import ExcelParser
 
 
+class MergedCells:
+    """
+    Values of merged cells while the rows of a sheet stream by. A merged range takes the value of its
+    top-left cell, which is remembered when its row is observed.
+    """
+
+    def __init__(self, ranges):
+        self.ranges = ranges
+        self.values = {}
+        self.starting = {}
+        for k, rng in enumerate(ranges):
+            self.starting.setdefault(rng.min_row, []).append(k)
+        self.open = []
+        self.last_row = 0
+
+    def observe(self, row_num, row):
+        if row_num <= self.last_row:
+            return
+        self.last_row = row_num
+        for k in self.starting.get(row_num, []):
+            c = self.ranges[k].min_col - 1
+            self.values[k] = row[c] if c < len(row) else None
+            self.open.append(k)
+        self.open.sort()
+
+    def covering(self, row_num):
+        """The ranges over an observed row. Rows must be asked in increasing order."""
+        self.open = [k for k in self.open if self.ranges[k].max_row >= row_num]
+        return [k for k in self.open if self.ranges[k].min_row <= row_num]
+
+    def value(self, row, col, ranges=None):
+        for k in ranges if ranges is not None else range(len(self.ranges)):
+            rng = self.ranges[k]
+            if rng.min_row <= row <= rng.max_row and rng.min_col <= col <= rng.max_col:
+                return self.values.get(k)
+        return None
+
+
 class Excel(ExcelParser):
     def __call__(self, fnm, binary=None, from_page=0, to_page=10000000000, callback=None):
-        if not binary:
-            wb = Excel._load_excel_to_workbook(fnm)
-        else:
-            wb = Excel._load_excel_to_workbook(BytesIO(binary))
-        total = 0
-        for sheetname in wb.sheetnames:
-            total += len(list(wb[sheetname].rows))
+        # Rows are streamed: only the rows in [from_page, to_page) are kept.
+        file_like_object = fnm if not binary else BytesIO(binary)
         res, fails, done = [], [], 0
         rn = 0
-        for sheetname in wb.sheetnames:
-            ws = wb[sheetname]
-            rows = list(ws.rows)
-            if not rows:
+        for sheetname, first_row, rows, merged_ranges in Excel._load_excel_to_rows(file_like_object, merged=True):
+            merged = MergedCells(merged_ranges)
+            head = list(islice(rows, 5))
+            if not head:
                 continue
-            headers, header_rows = self._parse_headers(ws, rows)
+            for i, r in enumerate(head):
+                merged.observe(first_row + i, r)
+            headers, header_rows = self._parse_headers(head, first_row, merged)
             if not headers:
                 continue
             data = []
-            for i, r in enumerate(rows[header_rows:]):
+            for i, r in enumerate(chain(head[header_rows:], rows)):
+                row_num = first_row + header_rows + i
+                merged.observe(row_num, r)
                 rn += 1
                 if rn - 1 < from_page:
                     continue
                 if rn - 1 >= to_page:
                     break
-                row_data = self._extract_row_data(ws, r, header_rows + i, len(headers))
+                row_data = self._extract_row_data(r, row_num, len(headers), merged)
                 if row_data is None:
                     fails.append(str(i))
                     continue
@@ -72,22 +110,21 @@ class Excel(ExcelParser):
         callback(0.3, ("Extract records: {}~{}".format(from_page + 1, min(to_page, from_page + rn)) + (f"{len(fails)} failure, line: %s..." % (",".join(fails[:3])) if fails else "")))
         return res
 
-    def _parse_headers(self, ws, rows):
+    def _parse_headers(self, rows, first_row, merged):
         if len(rows) == 0:
             return [], 0
-        has_complex_structure = self._has_complex_header_structure(ws, rows)
+        has_complex_structure = self._has_complex_header_structure(rows, first_row, merged)
         if has_complex_structure:
-            return self._parse_multi_level_headers(ws, rows)
+            return self._parse_multi_level_headers(rows, first_row, merged)
         else:
             return self._parse_simple_headers(rows)
 
-    def _has_complex_header_structure(self, ws, rows):
+    def _has_complex_header_structure(self, rows, first_row, merged):
         if len(rows) < 1:
             return False
-        merged_ranges = list(ws.merged_cells.ranges)
         # 检查前两行是否涉及合并单元格
-        for rng in merged_ranges:
-            if rng.min_row <= 2:  # 只要合并区域涉及第1或第2行
+        for rng in merged.ranges:
+            if rng.min_row <= first_row + 1:  # 只要合并区域涉及第1或第2行
                 return True
         return False
 
@@ -95,10 +132,10 @@ class Excel(ExcelParser):
         header_like_cells = 0
         data_like_cells = 0
         non_empty_cells = 0
-        for cell in row:
-            if cell.value is not None:
+        for v in row:
+            if v is not None:
                 non_empty_cells += 1
-                val = str(cell.value).strip()
+                val = str(v).strip()
                 if self._looks_like_header(val):
                     header_like_cells += 1
                 elif self._looks_like_data(val):
@@ -111,18 +148,10 @@ class Excel(ExcelParser):
         if not rows:
             return [], 0
         header_row = rows[0]
-        headers = []
-        for cell in header_row:
-            if cell.value is not None:
-                header_value = str(cell.value).strip()
-                if header_value:
-                    headers.append(header_value)
-            else:
-                pass
         final_headers = []
-        for i, cell in enumerate(header_row):
-            if cell.value is not None:
-                header_value = str(cell.value).strip()
+        for i, v in enumerate(header_row):
+            if v is not None:
+                header_value = str(v).strip()
                 if header_value:
                     final_headers.append(header_value)
                 else:
@@ -131,14 +160,14 @@ class Excel(ExcelParser):
                 final_headers.append(f"Column_{i + 1}")
         return final_headers, 1
 
-    def _parse_multi_level_headers(self, ws, rows):
+    def _parse_multi_level_headers(self, rows, first_row, merged):
         if len(rows) < 2:
             return [], 0
         header_rows = self._detect_header_rows(rows)
         if header_rows == 1:
             return self._parse_simple_headers(rows)
         else:
-            return self._build_hierarchical_headers(ws, rows, header_rows), header_rows
+            return self._build_hierarchical_headers(rows, header_rows, first_row, merged), header_rows
 
     def _detect_header_rows(self, rows):
         if len(rows) < 2:
@@ -173,16 +202,15 @@ class Excel(ExcelParser):
             return True
         return False
 
-    def _build_hierarchical_headers(self, ws, rows, header_rows):
+    def _build_hierarchical_headers(self, rows, header_rows, first_row, merged):
         headers = []
         max_col = max(len(row) for row in rows[:header_rows]) if header_rows > 0 else 0
-        merged_ranges = list(ws.merged_cells.ranges)
         for col_idx in range(max_col):
             header_parts = []
             for row_idx in range(header_rows):
                 if col_idx < len(rows[row_idx]):
-                    cell_value = rows[row_idx][col_idx].value
-                    merged_value = self._get_merged_cell_value(ws, row_idx + 1, col_idx + 1, merged_ranges)
+                    cell_value = rows[row_idx][col_idx]
+                    merged_value = merged.value(first_row + row_idx, col_idx + 1)
                     if merged_value is not None:
                         cell_value = merged_value
                     if cell_value is not None:
@@ -206,39 +234,16 @@ class Excel(ExcelParser):
             return False
         return True
 
-    def _get_merged_cell_value(self, ws, row, col, merged_ranges):
-        for merged_range in merged_ranges:
-            if merged_range.min_row <= row <= merged_range.max_row and merged_range.min_col <= col <= merged_range.max_col:
-                return ws.cell(merged_range.min_row, merged_range.min_col).value
-        return None
-
-    def _extract_row_data(self, ws, row, absolute_row_idx, expected_cols):
+    def _extract_row_data(self, row, row_num, expected_cols, merged):
         row_data = []
-        merged_ranges = list(ws.merged_cells.ranges)
-        actual_row_num = absolute_row_idx + 1
+        ranges = merged.covering(row_num)
         for col_idx in range(expected_cols):
-            cell_value = None
-            actual_col_num = col_idx + 1
-            try:
-                cell_value = ws.cell(row=actual_row_num, column=actual_col_num).value
-            except ValueError:
-                if col_idx < len(row):
-                    cell_value = row[col_idx].value
-            if cell_value is None:
-                merged_value = self._get_merged_cell_value(ws, actual_row_num, actual_col_num, merged_ranges)
-                if merged_value is not None:
-                    cell_value = merged_value
-                else:
-                    cell_value = self._get_inherited_value(ws, actual_row_num, actual_col_num, merged_ranges)
+            cell_value = row[col_idx] if col_idx < len(row) else None
+            if cell_value is None and ranges:
+                cell_value = merged.value(row_num, col_idx + 1, ranges)
             row_data.append(cell_value)
         return row_data
 
-    def _get_inherited_value(self, ws, row, col, merged_ranges):
-        for merged_range in merged_ranges:
-            if merged_range.min_row <= row <= merged_range.max_row and merged_range.min_col <= col <= merged_range.max_col:
-                return ws.cell(merged_range.min_row, merged_range.min_col).value
-        return None
-
     def _is_empty_row(self, row_data):
         for val in row_data:
             if val is not None and str(val).strip() != "":
@@ -264,35 +269,37 @@ def column_data_type(arr):
     arr = list(arr)
     counts = {"int": 0, "float": 0, "text": 0, "datetime": 0, "bool": 0}
     trans = {t: f for f, t in [(int, "int"), (float, "float"), (trans_datatime, "datetime"), (trans_bool, "bool"), (str, "text")]}
-    float_flag = False
-    for a in arr:
-        if a is None:
-            continue
-        if re.match(r"[+-]?[0-9]+$", str(a).replace("%%", "")) and not str(a).replace("%%", "").startswith("0"):
-            counts["int"] += 1
-            if int(str(a)) > 2**63 - 1:
-                float_flag = True
-                break
-        elif re.match(r"[+-]?[0-9.]{,19}$", str(a).replace("%%", "")) and not str(a).replace("%%", "").startswith("0"):
-            counts["float"] += 1
-        elif re.match(r"(true|yes|是|\*|✓|✔|☑|✅|√|false|no|否|⍻|×)$", str(a), flags=re.IGNORECASE):
-            counts["bool"] += 1
-        elif trans_datatime(str(a)):
-            counts["datetime"] += 1
-        else:
-            counts["text"] += 1
+    present = np.array([a is not None for a in arr], dtype=bool)
+    vals = pd.Series(arr, dtype=object)[present].map(str)
+    # Classify the whole column at once; only date parsing and conversion run per distinct value.
+    digits = vals.str.replace("%%", "", regex=False)
+    no_lead0 = ~digits.str.startswith("0")
+    is_int = digits.str.match(r"[+-]?[0-9]+$") & no_lead0
+    is_float = ~is_int & digits.str.match(r"[+-]?[0-9.]{,19}$") & no_lead0
+    is_bool = ~is_int & ~is_float & vals.str.match(r"(true|yes|是|\*|✓|✔|☑|✅|√|false|no|否|⍻|×)$", case=False)
+    rest = vals[~(is_int | is_float | is_bool)]
+    is_datetime = rest.map({v: bool(trans_datatime(v)) for v in rest.unique()})
+    counts["int"] = int(is_int.sum())
+    counts["float"] = int(is_float.sum())
+    counts["bool"] = int(is_bool.sum())
+    counts["datetime"] = int(is_datetime.sum())
+    counts["text"] = len(rest) - counts["datetime"]
+    # Only integers of 19 digits or more can exceed int64.
+    long_ints = digits[is_int & (digits.str.len() > 18)]
+    float_flag = any(int(v) > 2**63 - 1 for v in long_ints)
     if float_flag:
         ty = "float"
     else:
         counts = sorted(counts.items(), key=lambda x: x[1] * -1)
         ty = counts[0][0]
-    for i in range(len(arr)):
-        if arr[i] is None:
-            continue
+    converted = {}
+    for v in vals.unique():
         try:
-            arr[i] = trans[ty](str(arr[i]))
+            converted[v] = trans[ty](v)
         except Exception:
-            arr[i] = None
+            converted[v] = None
+    for i, v in zip(np.flatnonzero(present), vals):
+        arr[i] = converted[v]
     # if ty == "text":
     #    if len(arr) > 128 and uni / len(arr) < 0.1:
     #        ty = "keyword"
@@ -313,7 +313,7 @@ class Parser(ProcessBase):
             self.set_output("text", result)
 
     def _image(self, from_upstream: ParserFromUpstream):
-        from deepdoc.vision import OCR
+        from deepdoc.vision import OCR, shared_model
 
         self.callback(random.randint(1, 5) / 100.0, "Start to work on an image.")
 
@@ -326,7 +326,7 @@ class Parser(ProcessBase):
 
         if conf["parse_method"] == "ocr":
             # use ocr, recognize chars only
-            ocr = OCR()
+            ocr = shared_model("ocr", OCR)
             bxs = ocr(np.array(img))  # return boxes and recognize result
             txt = "\n".join([t[0] for _, t in bxs if t[0]])
 
@@ -271,8 +271,19 @@ def tokenize(d, t, eng):
     d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
 
 
+def tokenize_batch(ds, ts, eng):
+    """Same as tokenize(d, t, eng) for every pair, but long batches are tokenized by the tokenizer process pool."""
+    for d, t in zip(ds, ts):
+        d["content_with_weight"] = t
+    ts = [re.sub(r"</?(table|td|caption|tr|th)( [^<>]{0,12})?>", " ", t) for t in ts]
+    for d, (ltks, sm_ltks) in zip(ds, rag_tokenizer.tokenize_batch(ts)):
+        d["content_ltks"] = ltks
+        d["content_sm_ltks"] = sm_ltks
+
+
 def tokenize_chunks(chunks, doc, eng, pdf_parser=None):
     res = []
+    cks = []
     # wrap up as es documents
     for ii, ck in enumerate(chunks):
         if len(ck.strip()) == 0:
@@ -288,12 +299,14 @@ def tokenize_chunks(chunks, doc, eng, pdf_parser=None):
                 pass
         else:
             add_positions(d, [[ii]*5])
-        tokenize(d, ck, eng)
         res.append(d)
+        cks.append(ck)
+    tokenize_batch(res, cks, eng)
     return res
 
 def tokenize_chunks_with_images(chunks, doc, eng, images):
     res = []
+    cks = []
     # wrap up as es documents
     for ii, (ck, image) in enumerate(zip(chunks, images)):
         if len(ck.strip()) == 0:
@@ -302,37 +315,39 @@ def tokenize_chunks_with_images(chunks, doc, eng, images):
         d = copy.deepcopy(doc)
         d["image"] = image
         add_positions(d, [[ii]*5])
-        tokenize(d, ck, eng)
         res.append(d)
+        cks.append(ck)
+    tokenize_batch(res, cks, eng)
     return res
 
 def tokenize_table(tbls, doc, eng, batch_size=10):
     res = []
+    txts = []
     # add tables
     for (img, rows), poss in tbls:
         if not rows:
             continue
         if isinstance(rows, str):
             d = copy.deepcopy(doc)
-            tokenize(d, rows, eng)
-            d["content_with_weight"] = rows
             if img:
                 d["image"] = img
                 d["doc_type_kwd"] = "image"
             if poss:
                 add_positions(d, poss)
             res.append(d)
+            txts.append(rows)
             continue
         de = "; " if eng else "； "
         for i in range(0, len(rows), batch_size):
             d = copy.deepcopy(doc)
             r = de.join(rows[i:i + batch_size])
-            tokenize(d, r, eng)
             if img:
                 d["image"] = img
                 d["doc_type_kwd"] = "image"
             add_positions(d, poss)
             res.append(d)
+            txts.append(r)
+    tokenize_batch(res, txts, eng)
     return res
 
 
@@ -19,6 +19,9 @@ import json
 import re
 from collections import defaultdict
 
+import numpy as np
+from scipy import sparse
+
 from rag.utils.doc_store_conn import MatchTextExpr
 from rag.nlp import rag_tokenizer, term_weight, synonym
 
@@ -217,28 +220,47 @@ class FulltextQueryer:
         return None, keywords
 
     def hybrid_similarity(self, avec, bvecs, atks, btkss, tkweight=0.3, vtweight=0.7):
-        from sklearn.metrics.pairwise import cosine_similarity as CosineSimilarity
-        import numpy as np
-
-        sims = CosineSimilarity([avec], bvecs)
+        sims = self.vector_similarity(avec, bvecs)
         tksim = self.token_similarity(atks, btkss)
-        if np.sum(sims[0]) == 0:
-            return np.array(tksim), tksim, sims[0]
-        return np.array(sims[0]) * vtweight + np.array(tksim) * tkweight, tksim, sims[0]
+        if np.sum(sims) == 0:
+            return np.array(tksim), tksim, sims
+        return sims * vtweight + np.array(tksim) * tkweight, tksim, sims
+
+    @staticmethod
+    def vector_similarity(avec, bvecs):
+        """Cosine similarity between `avec` and every row of `bvecs`, computed as sklearn does."""
+        bvecs = np.asarray(bvecs, dtype=np.float64)
+        if bvecs.size == 0:
+            return np.zeros(len(bvecs))
+        avec = np.asarray(avec, dtype=np.float64)
+        anorm = np.sqrt(np.dot(avec, avec))
+        bnorms = np.sqrt(np.einsum("ij,ij->i", bvecs, bvecs))
+        bnorms[bnorms == 0] = 1.
+        return (bvecs / bnorms[:, np.newaxis]) @ (avec / (anorm if anorm else 1.))
 
     def token_similarity(self, atks, btkss):
-        def toDict(tks):
+        """
+        Share of the query term weight covered by each candidate.
+        Only the presence of a query term in a candidate counts, so candidates are
+        turned into a sparse query-term incidence matrix and scored with one product.
+        """
+        if isinstance(atks, str):
+            atks = atks.split()
+        qtwt = defaultdict(int)
+        for t, c in self.tw.weights(atks, preprocess=False):
+            qtwt[t] += c
+        terms = list(qtwt.keys())
+        weights = np.array([qtwt[t] for t in terms], dtype=np.float64)
+
+        indices, indptr = [], [0]
+        for tks in btkss:
             if isinstance(tks, str):
                 tks = tks.split()
-            d = defaultdict(int)
-            wts = self.tw.weights(tks, preprocess=False)
-            for i, (t, c) in enumerate(wts):
-                d[t] += c
-            return d
-
-        atks = toDict(atks)
-        btkss = [toDict(tks) for tks in btkss]
-        return [self.similarity(atks, btks) for btks in btkss]
+            tks = tks if isinstance(tks, (set, frozenset)) else set(tks)
+            indices.extend([j for j, t in enumerate(terms) if t in tks])
+            indptr.append(len(indices))
+        incidence = sparse.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(btkss), len(terms)))
+        return ((incidence @ weights + 1e-9) / (np.sum(weights) + 1e-9)).tolist()
 
     def similarity(self, qtwt, dtwt):
         if isinstance(dtwt, type("")):
@@ -22,10 +22,14 @@ import os
 import re
 import string
 import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from hanziconv import HanziConv
 from nltk import word_tokenize
 from nltk.stem import PorterStemmer, WordNetLemmatizer
 from api.utils.file_utils import get_project_base_directory
+from rag.utils.process_pool import pool_context, preload_in_workers
 
 
 class RagTokenizer:
@@ -57,16 +61,34 @@ class RagTokenizer:
             of.close()
         except Exception:
             logging.exception(f"[HUQIE]:Build trie {fnm} failed")
-
-    def __init__(self, debug=False):
+        self.init_caches_()
+
+    def init_caches_(self):
+        """
+        Memoize trie probes and per-span segmentations by text. Segmentation only depends on
+        the text and the dictionary, so cached results are identical to recomputed ones.
+        Must be called again whenever the trie changes.
+        """
+        size = self.cache_size
+        self.prefix_ = lru_cache(maxsize=size)(lambda t: self.trie_.has_keys_with_prefix(self.key_(t)))
+        self.rprefix_ = lru_cache(maxsize=size)(lambda t: self.trie_.has_keys_with_prefix(self.rkey_(t)))
+        self.lookup_ = lru_cache(maxsize=size)(lambda t: self.trie_.get(self.key_(t)))
+        self.best_tokens_ = lru_cache(maxsize=size)(self._best_tokens)
+        self.fine_grained_token_ = lru_cache(maxsize=size)(self._fine_grained_token)
+        self.en_normalize_ = lru_cache(maxsize=size)(lambda t: self.stemmer.stem(self.lemmatizer.lemmatize(t)))
+
+    def __init__(self, debug=False, cache_size=None):
         self.DEBUG = debug
         self.DENOMINATOR = 1000000
+        self.cache_size = int(os.environ.get("TOKENIZER_CACHE_SIZE", 1 << 17)) if cache_size is None else cache_size
         self.DIR_ = os.path.join(get_project_base_directory(), "rag/res", "huqie")
 
         self.stemmer = PorterStemmer()
         self.lemmatizer = WordNetLemmatizer()
 
         self.SPLIT_CHAR = r"([ ,\.<>/?;:'\[\]\\`!@#$%^&*\(\)\{\}\|_+=《》，。？、；‘’：“”【】~！￥%……（）——-]+|[a-zA-Z0-9,\.-]+)"
+        self.trie_ = None
+        self.init_caches_()
 
         trie_file_name = self.DIR_ + ".txt.trie"
         # check if trie file existence
@@ -90,6 +112,7 @@ class RagTokenizer:
     def loadUserDict(self, fnm):
         try:
             self.trie_ = datrie.Trie.load(fnm + ".trie")
+            self.init_caches_()
             return
         except Exception:
             self.trie_ = datrie.Trie(string.printable)
@@ -150,10 +173,10 @@ class RagTokenizer:
                     end += 1
                 mid = s + min(10, end - s)
                 t = "".join(chars[s:mid])
-                k = self.key_(t)
+                v = self.lookup_(t)
                 copy_pretks = copy.deepcopy(preTks)
-                if k in self.trie_:
-                    copy_pretks.append((t, self.trie_[k]))
+                if v is not None:
+                    copy_pretks.append((t, v))
                 else:
                     copy_pretks.append((t, (-12, '')))
                 next_res = self.dfs_(chars, mid, copy_pretks, tkslist, _depth + 1, _memo)
@@ -165,21 +188,21 @@ class RagTokenizer:
         if s + 2 <= len(chars):
             t1 = "".join(chars[s:s + 1])
             t2 = "".join(chars[s:s + 2])
-            if self.trie_.has_keys_with_prefix(self.key_(t1)) and not self.trie_.has_keys_with_prefix(self.key_(t2)):
+            if self.prefix_(t1) and not self.prefix_(t2):
                 S = s + 2
         if len(preTks) > 2 and len(preTks[-1][0]) == 1 and len(preTks[-2][0]) == 1 and len(preTks[-3][0]) == 1:
             t1 = preTks[-1][0] + "".join(chars[s:s + 1])
-            if self.trie_.has_keys_with_prefix(self.key_(t1)):
+            if self.prefix_(t1):
                 S = s + 2
     
         for e in range(S, len(chars) + 1):
             t = "".join(chars[s:e])
-            k = self.key_(t)
-            if e > s + 1 and not self.trie_.has_keys_with_prefix(k):
+            if e > s + 1 and not self.prefix_(t):
                 break
-            if k in self.trie_:
+            v = self.lookup_(t)
+            if v is not None:
                 pretks = copy.deepcopy(preTks)
-                pretks.append((t, self.trie_[k]))
+                pretks.append((t, v))
                 res = max(res, self.dfs_(chars, e, pretks, tkslist, _depth + 1, _memo))
         
         if res > s:
@@ -187,10 +210,10 @@ class RagTokenizer:
             return res
     
         t = "".join(chars[s:s + 1])
-        k = self.key_(t)
+        v = self.lookup_(t)
         copy_pretks = copy.deepcopy(preTks)
-        if k in self.trie_:
-            copy_pretks.append((t, self.trie_[k]))
+        if v is not None:
+            copy_pretks.append((t, v))
         else:
             copy_pretks.append((t, (-12, '')))
         result = self.dfs_(chars, s + 1, copy_pretks, tkslist, _depth + 1, _memo)
@@ -198,16 +221,16 @@ class RagTokenizer:
         return result
 
     def freq(self, tk):
-        k = self.key_(tk)
-        if k not in self.trie_:
+        v = self.lookup_(tk)
+        if v is None:
             return 0
-        return int(math.exp(self.trie_[k][0]) * self.DENOMINATOR + 0.5)
+        return int(math.exp(v[0]) * self.DENOMINATOR + 0.5)
 
     def tag(self, tk):
-        k = self.key_(tk)
-        if k not in self.trie_:
+        v = self.lookup_(tk)
+        if v is None:
             return ""
-        return self.trie_[k][1]
+        return v[1]
 
     def score_(self, tfts):
         B = 30
@@ -252,17 +275,17 @@ class RagTokenizer:
         while s < len(line):
             e = s + 1
             t = line[s:e]
-            while e < len(line) and self.trie_.has_keys_with_prefix(
-                    self.key_(t)):
+            while e < len(line) and self.prefix_(t):
                 e += 1
                 t = line[s:e]
 
-            while e - 1 > s and self.key_(t) not in self.trie_:
+            while e - 1 > s and self.lookup_(t) is None:
                 e -= 1
                 t = line[s:e]
 
-            if self.key_(t) in self.trie_:
-                res.append((t, self.trie_[self.key_(t)]))
+            v = self.lookup_(t)
+            if v is not None:
+                res.append((t, v))
             else:
                 res.append((t, (0, '')))
 
@@ -276,16 +299,17 @@ class RagTokenizer:
         while s >= 0:
             e = s + 1
             t = line[s:e]
-            while s > 0 and self.trie_.has_keys_with_prefix(self.rkey_(t)):
+            while s > 0 and self.rprefix_(t):
                 s -= 1
                 t = line[s:e]
 
-            while s + 1 < e and self.key_(t) not in self.trie_:
+            while s + 1 < e and self.lookup_(t) is None:
                 s += 1
                 t = line[s:e]
 
-            if self.key_(t) in self.trie_:
-                res.append((t, self.trie_[self.key_(t)]))
+            v = self.lookup_(t)
+            if v is not None:
+                res.append((t, v))
             else:
                 res.append((t, (0, '')))
 
@@ -294,7 +318,7 @@ class RagTokenizer:
         return self.score_(res[::-1])
 
     def english_normalize_(self, tks):
-        return [self.stemmer.stem(self.lemmatizer.lemmatize(t)) if re.match(r"[a-zA-Z_-]+$", t) else t for t in tks]
+        return [self.en_normalize_(t) if re.match(r"[a-zA-Z_-]+$", t) else t for t in tks]
 
     def _split_by_lang(self, line):
         txt_lang_pairs = []
@@ -328,7 +352,7 @@ class RagTokenizer:
         res = []
         for L,lang in arr:
             if not lang:
-                res.extend([self.stemmer.stem(self.lemmatizer.lemmatize(t)) for t in word_tokenize(L)])
+                res.extend([self.en_normalize_(t) for t in word_tokenize(L)])
                 continue
             if len(L) < 2 or re.match(
                     r"[a-z\.-]+$", L) or re.match(r"[0-9\.-]+$", L):
@@ -367,9 +391,7 @@ class RagTokenizer:
                     j += 1
                     continue
                 # backward tokens from_i to i are different from forward tokens from _j to j.
-                tkslist = []
-                self.dfs_("".join(tks[_j:j]), 0, [], tkslist)
-                res.append(" ".join(self.sortTks_(tkslist)[0][0]))
+                res.append(" ".join(self.best_tokens_("".join(tks[_j:j]))))
 
                 same = 1
                 while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
@@ -383,14 +405,42 @@ class RagTokenizer:
             if _i < len(tks1):
                 assert _j < len(tks)
                 assert "".join(tks1[_i:]) == "".join(tks[_j:])
-                tkslist = []
-                self.dfs_("".join(tks[_j:]), 0, [], tkslist)
-                res.append(" ".join(self.sortTks_(tkslist)[0][0]))
+                res.append(" ".join(self.best_tokens_("".join(tks[_j:]))))
 
         res = " ".join(res)
         logging.debug("[TKS] {}".format(self.merge_(res)))
         return self.merge_(res)
 
+    def _best_tokens(self, span):
+        tkslist = []
+        self.dfs_(span, 0, [], tkslist)
+        return tuple(self.sortTks_(tkslist)[0][0])
+
+    def _fine_grained_token(self, tk):
+        if len(tk) < 3 or re.match(r"[0-9,\.-]+$", tk):
+            return tk
+        tkslist = []
+        if len(tk) > 10:
+            tkslist.append(tk)
+        else:
+            self.dfs_(tk, 0, [], tkslist)
+        if len(tkslist) < 2:
+            return tk
+        stk = self.sortTks_(tkslist)[1][0]
+        if len(stk) == len(tk):
+            stk = tk
+        else:
+            if re.match(r"[a-z\.-]+$", tk):
+                for t in stk:
+                    if len(t) < 3:
+                        stk = tk
+                        break
+                else:
+                    stk = " ".join(stk)
+            else:
+                stk = " ".join(stk)
+        return stk
+
     def fine_grained_tokenize(self, tks):
         tks = tks.split()
         zh_num = len([1 for c in tks if c and is_chinese(c[0])])
@@ -400,35 +450,7 @@ class RagTokenizer:
                 res.extend(tk.split("/"))
             return " ".join(res)
 
-        res = []
-        for tk in tks:
-            if len(tk) < 3 or re.match(r"[0-9,\.-]+$", tk):
-                res.append(tk)
-                continue
-            tkslist = []
-            if len(tk) > 10:
-                tkslist.append(tk)
-            else:
-                self.dfs_(tk, 0, [], tkslist)
-            if len(tkslist) < 2:
-                res.append(tk)
-                continue
-            stk = self.sortTks_(tkslist)[1][0]
-            if len(stk) == len(tk):
-                stk = tk
-            else:
-                if re.match(r"[a-z\.-]+$", tk):
-                    for t in stk:
-                        if len(t) < 3:
-                            stk = tk
-                            break
-                    else:
-                        stk = " ".join(stk)
-                else:
-                    stk = " ".join(stk)
-
-            res.append(stk)
-
+        res = [self.fine_grained_token_(tk) for tk in tks]
         return " ".join(self.english_normalize_(res))
 
 
@@ -474,6 +496,54 @@ addUserDict = tokenizer.addUserDict
 tradi2simp = tokenizer._tradi2simp
 strQ2B = tokenizer._strQ2B
 
+# Workers are forked from a server process that has loaded the trie once,
+# so its pages are shared copy-on-write instead of loaded per worker.
+preload_in_workers(__name__)
+
+TOKENIZER_WORKERS = int(os.environ.get("TOKENIZER_WORKERS", min(4, os.cpu_count() or 1)))
+TOKENIZE_BATCH_MIN = int(os.environ.get("TOKENIZE_BATCH_MIN", 64))
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _tokenize_texts(texts):
+    res = []
+    for t in texts:
+        tks = tokenizer.tokenize(t)
+        res.append((tks, tokenizer.fine_grained_tokenize(tks)))
+    return res
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=TOKENIZER_WORKERS, mp_context=pool_context())
+        return _pool
+
+
+def tokenize_batch(texts: list[str]) -> list[tuple[str, str]]:
+    """
+    Returns (tokenize(t), fine_grained_tokenize(tokenize(t))) for every text, in order.
+    Long lists are spread over a pool of TOKENIZER_WORKERS processes.
+    """
+    global _pool
+    if TOKENIZER_WORKERS < 2 or len(texts) < TOKENIZE_BATCH_MIN:
+        return _tokenize_texts(texts)
+    size = max(16, math.ceil(len(texts) / (TOKENIZER_WORKERS * 4)))
+    try:
+        res = []
+        for part in _get_pool().map(_tokenize_texts, [texts[i:i + size] for i in range(0, len(texts), size)]):
+            res.extend(part)
+        return res
+    except Exception:
+        logging.exception("tokenize_batch: tokenizer pool failed, tokenizing in process")
+        with _pool_lock:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+                _pool = None
+        return _tokenize_texts(texts)
+
 if __name__ == '__main__':
     tknzr = RagTokenizer(debug=True)
     # huqie.addUserDict("/tmp/tmp.new.tks.dict")
@@ -0,0 +1,99 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Benchmark of FulltextQueryer.hybrid_similarity against the former per-candidate implementation.
+
+    python -m rag.nlp.rerank_benchmark --dim 1024 --repeat 20
+"""
+import argparse
+import random
+from collections import defaultdict, OrderedDict
+from timeit import default_timer as timer
+
+import numpy as np
+
+from rag.nlp import query
+
+
+def reference_hybrid_similarity(qryr, avec, bvecs, atks, btkss, tkweight=0.3, vtweight=0.7):
+    """The implementation the vectorized one replaced, kept to check scores stay identical."""
+    from sklearn.metrics.pairwise import cosine_similarity as CosineSimilarity
+
+    def toDict(tks):
+        d = defaultdict(int)
+        for t, c in qryr.tw.weights(tks, preprocess=False):
+            d[t] += c
+        return d
+
+    sims = CosineSimilarity([avec], bvecs)
+    atks = toDict(atks)
+    tksim = [qryr.similarity(atks, toDict(tks)) for tks in btkss]
+    if np.sum(sims[0]) == 0:
+        return np.array(tksim), tksim, sims[0]
+    return np.array(sims[0]) * vtweight + np.array(tksim) * tkweight, tksim, sims[0]
+
+
+def make_candidates(n, dim, vocab, rng):
+    vecs = rng.standard_normal((n, dim)).astype(np.float32).tolist()
+    chunks = []
+    for _ in range(n):
+        content = [random.choice(vocab) for _ in range(random.randint(64, 512))]
+        title = [random.choice(vocab) for _ in range(random.randint(2, 8))]
+        important = [random.choice(vocab) for _ in range(random.randint(0, 5))]
+        question = [random.choice(vocab) for _ in range(random.randint(0, 10))]
+        chunks.append((content, title, important, question))
+    return vecs, chunks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--sizes", type=str, default="64,128,256,512,1024")
+    args = parser.parse_args()
+
+    random.seed(0)
+    rng = np.random.default_rng(0)
+    qryr = query.FulltextQueryer()
+    vocab = ["term%d" % i for i in range(5000)]
+    keywords = random.sample(vocab, 16)
+    qvec = rng.standard_normal(args.dim).tolist()
+
+    print("{:>6} {:>12} {:>12} {:>8} {:>10}".format("n", "before(ms)", "after(ms)", "speedup", "max|diff|"))
+    for n in [int(s) for s in args.sizes.split(",")]:
+        vecs, chunks = make_candidates(n, args.dim, vocab, rng)
+        # Token lists as Dealer.rerank used to build them, and the token sets it builds now.
+        old_tks = [list(OrderedDict.fromkeys(c)) + t * 2 + i * 5 + q * 6 for c, t, i, q in chunks]
+        new_tks = [set(c).union(t, i, q) for c, t, i, q in chunks]
+
+        st = timer()
+        for _ in range(args.repeat):
+            before = reference_hybrid_similarity(qryr, qvec, vecs, keywords, old_tks)
+        before_ms = (timer() - st) * 1000 / args.repeat
+
+        st = timer()
+        for _ in range(args.repeat):
+            embd = np.array(vecs, dtype=np.float64)
+            after = qryr.hybrid_similarity(qvec, embd, keywords, new_tks)
+        after_ms = (timer() - st) * 1000 / args.repeat
+
+        diff = max(float(np.max(np.abs(np.array(b) - np.array(a)))) for b, a in zip(before, after))
+        assert diff < 1e-9, f"scores differ by {diff}"
+        print("{:>6} {:>12.2f} {:>12.2f} {:>7.1f}x {:>10.1e}".format(n, before_ms, after_ms, before_ms / after_ms, diff))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import copy
+import json
+import os
+import re
+import threading
+
+import xxhash
+from cachetools import TTLCache
+
+from rag.utils.kb_version import get_kb_versions
+
+RETRIEVAL_CACHE_ENABLED = int(os.environ.get("RETRIEVAL_CACHE_ENABLED", "1"))
+RETRIEVAL_CACHE_SIZE = int(os.environ.get("RETRIEVAL_CACHE_SIZE", "1024"))
+RETRIEVAL_CACHE_TTL = int(os.environ.get("RETRIEVAL_CACHE_TTL", "600"))
+
+
+class RetrievalCache:
+    """
+    In-process cache of Dealer.retrieval results.
+    The key includes the current version of every knowledge base searched, so any chunk
+    insert, update or delete in one of them makes the older entries unreachable.
+    """
+
+    def __init__(self, maxsize=RETRIEVAL_CACHE_SIZE, ttl=RETRIEVAL_CACHE_TTL):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(question, kb_ids, **kwargs):
+        """Returns None if the request can't be cached, e.g. when the versions are unknown."""
+        if not kb_ids:
+            return None
+        kb_ids = sorted(set(kb_ids))
+        versions = get_kb_versions(kb_ids)
+        if versions is None:
+            return None
+        for k in ("tenant_ids", "doc_ids"):
+            if isinstance(kwargs.get(k), list):
+                kwargs[k] = sorted(kwargs[k])
+        payload = json.dumps({
+            "question": re.sub(r"\s+", " ", question).strip(),
+            "kb_ids": kb_ids,
+            "versions": versions,
+            **kwargs
+        }, sort_keys=True, ensure_ascii=False, default=str)
+        return xxhash.xxh128(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            res = self.cache.get(key)
+            if res is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return copy.deepcopy(res)
+
+    def set(self, key, value):
+        value = copy.deepcopy(value)
+        with self.lock:
+            self.cache[key] = value
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.,
+                "size": len(self.cache),
+                "maxsize": self.cache.maxsize,
+            }
+
+
+RETRIEVAL_CACHE = RetrievalCache() if RETRIEVAL_CACHE_ENABLED else None
@@ -16,12 +16,12 @@
 import logging
 import re
 import math
-from collections import OrderedDict
 from dataclasses import dataclass
 
 from rag.settings import TAG_FLD, PAGERANK_FLD
 from rag.utils import rmSpace, get_float
 from rag.nlp import rag_tokenizer, query
+from rag.nlp.retrieval_cache import RETRIEVAL_CACHE
 import numpy as np
 from rag.utils.doc_store_conn import DocStoreConnection, MatchDenseExpr, FusionExpr, OrderByExpr
 
@@ -283,26 +283,28 @@ class Dealer:
         _, keywords = self.qryr.question(query)
         vector_size = len(sres.query_vector)
         vector_column = f"q_{vector_size}_vec"
-        zero_vector = [0.0] * vector_size
-        ins_embd = []
-        for chunk_id in sres.ids:
-            vector = sres.field[chunk_id].get(vector_column, zero_vector)
+        if not sres.ids:
+            return [], [], []
+        ins_embd = np.zeros((len(sres.ids), vector_size), dtype=np.float64)
+        for n, chunk_id in enumerate(sres.ids):
+            vector = sres.field[chunk_id].get(vector_column)
+            if vector is None:
+                continue
             if isinstance(vector, str):
                 vector = [get_float(v) for v in vector.split("\t")]
-            ins_embd.append(vector)
-        if not ins_embd:
-            return [], [], []
+            ins_embd[n] = vector
 
         for i in sres.ids:
             if isinstance(sres.field[i].get("important_kwd", []), str):
                 sres.field[i]["important_kwd"] = [sres.field[i]["important_kwd"]]
+        # Token similarity only depends on which query terms a chunk contains,
+        # so each chunk is reduced to the set of its tokens.
         ins_tw = []
         for i in sres.ids:
-            content_ltks = list(OrderedDict.fromkeys(sres.field[i][cfield].split()))
-            title_tks = [t for t in sres.field[i].get("title_tks", "").split() if t]
-            question_tks = [t for t in sres.field[i].get("question_tks", "").split() if t]
-            important_kwd = sres.field[i].get("important_kwd", [])
-            tks = content_ltks + title_tks * 2 + important_kwd * 5 + question_tks * 6
+            tks = set(sres.field[i][cfield].split())
+            tks.update(sres.field[i].get("title_tks", "").split())
+            tks.update(sres.field[i].get("question_tks", "").split())
+            tks.update(sres.field[i].get("important_kwd", []))
             ins_tw.append(tks)
 
         ## For rank feature(tag_fea) scores.
@@ -352,6 +354,19 @@ class Dealer:
         if not question:
             return ranks
 
+        cache_key = None
+        if RETRIEVAL_CACHE:
+            cache_key = RETRIEVAL_CACHE.key(question, kb_ids, tenant_ids=tenant_ids, page=page, page_size=page_size,
+                                            similarity_threshold=similarity_threshold,
+                                            vector_similarity_weight=vector_similarity_weight, top=top,
+                                            doc_ids=doc_ids, aggs=aggs, highlight=highlight, rank_feature=rank_feature,
+                                            embd_mdl=getattr(embd_mdl, "llm_name", None),
+                                            rerank_mdl=getattr(rerank_mdl, "llm_name", None))
+            if cache_key:
+                cached = RETRIEVAL_CACHE.get(cache_key)
+                if cached is not None:
+                    return cached
+
         RERANK_LIMIT = 64
         RERANK_LIMIT = int(RERANK_LIMIT//page_size + ((RERANK_LIMIT%page_size)/(page_size*1.) + 0.5)) * page_size if page_size>1 else 1
         if RERANK_LIMIT < 1: ## when page_size is very large the RERANK_LIMIT will be 0.
@@ -435,6 +450,8 @@ class Dealer:
                                                                    key=lambda x: x[1]["count"] * -1)]
         ranks["chunks"] = ranks["chunks"][:page_size]
 
+        if cache_key:
+            RETRIEVAL_CACHE.set(cache_key, ranks)
         return ranks
 
     def sql_retrieval(self, sql, fetch_size=128, format="json"):
@@ -0,0 +1,74 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Throughput of RagTokenizer with and without its memoization, checking both give the same tokens.
+
+    python -m rag.nlp.tokenizer_benchmark --corpus /path/to/lines.txt --repeat 3
+"""
+import argparse
+from timeit import default_timer as timer
+
+from rag.nlp.rag_tokenizer import RagTokenizer
+
+SAMPLES = [
+    "公开征求意见稿提出，境外投资者可使用自有人民币或外汇投资。使用外汇投资的，可通过债券持有人在香港人民币业务清算行及香港地区经批准可进入境内银行间外汇市场进行交易的境外人民币业务参加行（以下统称香港结算行）办理外汇资金兑换。",
+    "多校划片就是一个小区对应多个小学初中，让买了学区房的家庭也不确定到底能上哪个学校。目的是通过这种方式为学区房降温，把就近入学落到实处。南京市长江大桥",
+    "实际上当时他们已经将业务中心偏移到安全部门和针对政府企业的部门 Scripts are compiled and cached aaaaaaaaa",
+    "蓝月亮如何在外资夹击中生存,那是全宇宙最有意思的",
+    "涡轮增压发动机num最大功率,不像别的共享买车锁电子化的手段,我们接过来是否有意义,黄黄爱美食,不过，今天阿奇要讲到的这家农贸市场，说实话，还真蛮有特色的！",
+    "Unity3D开发经验 测试开发工程师 c++双11双11 985 211 ",
+    "数据分析项目经理|数据分析挖掘|数据分析方向|商品数据分析|搜索数据分析 sql python hive tableau Cocos2d-",
+]
+
+
+def run(tknzr, lines, repeat):
+    out = []
+    chars = 0
+    st = timer()
+    for _ in range(repeat):
+        out = []
+        for line in lines:
+            tks = tknzr.tokenize(line)
+            out.append((tks, tknzr.fine_grained_tokenize(tks)))
+            chars += len(line)
+    return out, chars / (timer() - st)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", type=str, default="", help="Text file, one document per line.")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus, "r", encoding="utf-8") as f:
+            lines = [line.rstrip("\n") for line in f if line.strip()]
+    else:
+        lines = SAMPLES * 20
+
+    reference, ref_speed = run(RagTokenizer(cache_size=0), lines, args.repeat)
+    result, speed = run(RagTokenizer(), lines, args.repeat)
+
+    mismatches = [(line, a, b) for line, a, b in zip(lines, reference, result) if a != b]
+    for line, a, b in mismatches[:10]:
+        print(f"MISMATCH {line[:50]!r}\n  before: {a}\n  after:  {b}")
+    print(f"lines: {len(lines)}, mismatches: {len(mismatches)}")
+    print(f"uncached: {ref_speed:,.0f} chars/sec")
+    print(f"cached:   {speed:,.0f} chars/sec ({speed / ref_speed:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -57,7 +57,12 @@ except Exception:
     pass
 DOC_MAXIMUM_SIZE = int(os.environ.get("MAX_CONTENT_LENGTH", 128 * 1024 * 1024))
 DOC_BULK_SIZE = int(os.environ.get("DOC_BULK_SIZE", 4))
+DOC_BULK_MAX_SIZE = int(os.environ.get("DOC_BULK_MAX_SIZE", 256))
+DOC_BULK_MAX_BYTES = int(os.environ.get("DOC_BULK_MAX_BYTES", 8 * 1024 * 1024))
+DOC_BULK_TARGET_LATENCY = float(os.environ.get("DOC_BULK_TARGET_LATENCY", 1.0))
+DOC_BULK_CONCURRENCY = int(os.environ.get("DOC_BULK_CONCURRENCY", 4))
 EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 16))
+EMBEDDING_BATCH_MAX_WAIT = float(os.environ.get("EMBEDDING_BATCH_MAX_WAIT", 0.05))
 SVR_QUEUE_NAME = "rag_flow_svr_queue"
 SVR_CONSUMER_GROUP_NAME = "rag_flow_svr_task_broker"
 PAGERANK_FLD = "pagerank_fea"
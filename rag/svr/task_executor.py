@@ -61,8 +61,12 @@ from rag.app import laws, paper, presentation, manual, qa, table, book, resume,
     email, tag
 from rag.nlp import search, rag_tokenizer
 from rag.raptor import RecursiveAbstractiveProcessing4TreeOrganizedRetrieval as Raptor
-from rag.settings import DOC_MAXIMUM_SIZE, DOC_BULK_SIZE, EMBEDDING_BATCH_SIZE, SVR_CONSUMER_GROUP_NAME, get_svr_queue_name, get_svr_queue_names, print_rag_settings, TAG_FLD, PAGERANK_FLD
+from rag.settings import DOC_MAXIMUM_SIZE, DOC_BULK_SIZE, DOC_BULK_MAX_SIZE, DOC_BULK_MAX_BYTES, DOC_BULK_TARGET_LATENCY, DOC_BULK_CONCURRENCY, \
+    EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_MAX_WAIT, SVR_CONSUMER_GROUP_NAME, get_svr_queue_name, get_svr_queue_names, print_rag_settings, TAG_FLD, PAGERANK_FLD
 from rag.utils import num_tokens_from_string, truncate
+from rag.utils.bulk_sizer import AdaptiveBulkSize, chunk_bytes
+from rag.utils.embedding_cache import EMBEDDING_CACHE
+from rag.utils.embedding_scheduler import EmbeddingScheduler
 from rag.utils.redis_conn import REDIS_CONN, RedisDistributedLock
 from rag.utils.storage_factory import STORAGE_IMPL
 from graphrag.utils import chat_limiter
@@ -108,6 +112,10 @@ chunk_limiter = trio.CapacityLimiter(MAX_CONCURRENT_CHUNK_BUILDERS)
 embed_limiter = trio.CapacityLimiter(MAX_CONCURRENT_CHUNK_BUILDERS)
 minio_limiter = trio.CapacityLimiter(MAX_CONCURRENT_MINIO)
 kg_limiter = trio.CapacityLimiter(2)
+embed_scheduler = EmbeddingScheduler(EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_MAX_WAIT, embed_limiter)
+EMBEDDING_PIPELINE_SLICE = int(os.environ.get('EMBEDDING_PIPELINE_SLICE', str(max(EMBEDDING_BATCH_SIZE, DOC_BULK_SIZE) * 4)))
+EMBEDDING_PIPELINE_DEPTH = int(os.environ.get('EMBEDDING_PIPELINE_DEPTH', "2"))
+CANCEL_CHECK_INTERVAL = float(os.environ.get('CANCEL_CHECK_INTERVAL', "2"))
 WORKER_HEARTBEAT_TIMEOUT = int(os.environ.get('WORKER_HEARTBEAT_TIMEOUT', '120'))
 stop_event = threading.Event()
 
@@ -430,7 +438,12 @@ def init_kb(row, vector_size: int):
     return settings.docStoreConn.createIdx(idxnm, row.get("kb_id", ""), vector_size)
 
 
-async def embedding(docs, mdl, parser_config=None, callback=None):
+async def embedding(docs, mdl, parser_config=None, callback=None, title_vectors=None, cache_stats=None):
+    """
+    Embeds `docs` in place and returns (token count, vector size).
+    `title_vectors` memoizes title embeddings when a document is embedded in several calls;
+    if `cache_stats` is given, embedding cache hits/misses are accumulated there instead of reported.
+    """
     if parser_config is None:
         parser_config = {}
     tts, cnts = [], []
@@ -446,26 +459,40 @@ async def embedding(docs, mdl, parser_config=None, callback=None):
 
     tk_count = 0
     if len(tts) == len(cnts):
-        vts, c = await trio.to_thread.run_sync(lambda: mdl.encode(tts[0: 1]))
+        if title_vectors is not None and tts[0] in title_vectors:
+            vts = title_vectors[tts[0]]
+        else:
+            vts, c = await trio.to_thread.run_sync(lambda: mdl.encode(tts[0: 1]))
+            tk_count += c
+            if title_vectors is not None:
+                title_vectors[tts[0]] = vts
         tts = np.concatenate([vts for _ in range(len(tts))], axis=0)
-        tk_count += c
 
-    @timeout(60)
-    def batch_encode(txts):
-        nonlocal mdl
-        return mdl.encode([truncate(c, mdl.max_length-10) for c in txts])
-
-    cnts_ = np.array([])
-    for i in range(0, len(cnts), EMBEDDING_BATCH_SIZE):
-        async with embed_limiter:
-            vts, c = await trio.to_thread.run_sync(lambda: batch_encode(cnts[i: i + EMBEDDING_BATCH_SIZE]))
-        if len(cnts_) == 0:
-            cnts_ = vts
-        else:
-            cnts_ = np.concatenate((cnts_, vts), axis=0)
+    # Batches are shared with the other in-flight tasks embedding with the same model.
+    def embed_progress(done, total):
+        callback(prog=0.7 + 0.2 * done / total, msg="")
+
+    cnts = [truncate(c, mdl.max_length-10) for c in cnts]
+    # Per tenant: models with the same name may be served by different endpoints of different tenants.
+    cache_model = "{}/{}".format(mdl.tenant_id, mdl.llm_name)
+    if EMBEDDING_CACHE:
+        vects = await trio.to_thread.run_sync(lambda: EMBEDDING_CACHE.get_many(cache_model, cnts))
+    else:
+        vects = [None] * len(cnts)
+    missed = [i for i, v in enumerate(vects) if v is None]
+    if missed:
+        vts, c = await embed_scheduler.encode(mdl, [cnts[i] for i in missed], embed_progress)
         tk_count += c
-        callback(prog=0.7 + 0.2 * (i + 1) / len(cnts), msg="")
-    cnts = cnts_
+        for i, v in zip(missed, vts):
+            vects[i] = v
+        if EMBEDDING_CACHE:
+            await trio.to_thread.run_sync(lambda: EMBEDDING_CACHE.set_many(cache_model, [cnts[i] for i in missed], vts))
+    if cache_stats is not None:
+        cache_stats["hit"] = cache_stats.get("hit", 0) + len(cnts) - len(missed)
+        cache_stats["miss"] = cache_stats.get("miss", 0) + len(missed)
+    elif EMBEDDING_CACHE:
+        callback(msg="Embedding cache: {} hit, {} miss".format(len(cnts) - len(missed), len(missed)))
+    cnts = np.array(vects)
     filename_embd_weight = parser_config.get("filename_embd_weight", 0.1) # due to the db support none value
     if not filename_embd_weight:
         filename_embd_weight = 0.1
@@ -474,11 +501,12 @@ async def embedding(docs, mdl, parser_config=None, callback=None):
              cnts) if len(tts) == len(cnts) else cnts
 
     assert len(vects) == len(docs)
-    vector_size = 0
+    # Chunks hold rows of one float32 matrix rather than lists of Python floats;
+    # the doc store connectors serialize them directly.
+    vects = np.ascontiguousarray(vects, dtype=np.float32)
+    vector_size = vects.shape[1] if len(vects) else 0
     for i, d in enumerate(docs):
-        v = vects[i].tolist()
-        vector_size = len(v)
-        d["q_%d_vec" % len(v)] = v
+        d["q_%d_vec" % vector_size] = vects[i]
     return tk_count, vector_size
 
 
@@ -613,22 +641,11 @@ async def do_handle_task(task):
         # TODO: exception handler
         ## set_progress(task["did"], -1, "ERROR: ")
         progress_callback(msg="Generate {} chunks".format(len(chunks)))
-        start_ts = timer()
-        try:
-            token_count, vector_size = await embedding(chunks, embedding_model, task_parser_config, progress_callback)
-        except Exception as e:
-            error_message = "Generate embedding error:{}".format(str(e))
-            progress_callback(-1, error_message)
-            logging.exception(error_message)
-            token_count = 0
-            raise
-        progress_message = "Embedding chunks ({:.2f}s)".format(timer() - start_ts)
-        logging.info(progress_message)
-        progress_callback(msg=progress_message)
+        token_count = 0
 
     chunk_count = len(set([chunk["id"] for chunk in chunks]))
+    total_chunks = len(chunks)
     start_ts = timer()
-    doc_store_result = ""
 
     async def delete_image(kb_id, chunk_id):
         try:
@@ -639,33 +656,129 @@ async def do_handle_task(task):
                 "Deleting image of chunk {}/{}/{} got exception".format(task["location"], task["name"], chunk_id))
             raise
 
-    for b in range(0, len(chunks), DOC_BULK_SIZE):
-        doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(chunks[b:b + DOC_BULK_SIZE], search.index_name(task_tenant_id), task_dataset_id))
-        task_canceled = has_canceled(task_id)
+    # Chunks flow through a bounded channel: embedding of the next slice overlaps with
+    # the bulk inserts of the previous one, and indexed slices are released right away.
+    async def embed_chunks(send_channel):
+        nonlocal token_count
+        title_vectors, cache_stats = {}, {}
+        need_embedding = task_type != "raptor"
+
+        # Overall progress is reported by the indexing side.
+        def embedding_progress(prog=None, msg=""):
+            if msg:
+                progress_callback(msg=msg)
+
+        async with send_channel:
+            while chunks:
+                batch = chunks[:EMBEDDING_PIPELINE_SLICE]
+                del chunks[:EMBEDDING_PIPELINE_SLICE]
+                if need_embedding:
+                    try:
+                        tk_count, _ = await embedding(batch, embedding_model, task_parser_config, embedding_progress,
+                                                      title_vectors=title_vectors, cache_stats=cache_stats)
+                    except Exception as e:
+                        error_message = "Generate embedding error:{}".format(str(e))
+                        progress_callback(-1, error_message)
+                        logging.exception(error_message)
+                        raise
+                    token_count += tk_count
+                await send_channel.send(batch)
+        if need_embedding:
+            progress_message = "Embedding chunks ({:.2f}s)".format(timer() - start_ts)
+            if cache_stats:
+                progress_message += ", cache: {} hit, {} miss".format(cache_stats["hit"], cache_stats["miss"])
+            logging.info(progress_message)
+            progress_callback(msg=progress_message)
+
+    async def index_chunks(receive_channel):
+        """
+        Inserts embedded slices as they arrive, with up to DOC_BULK_CONCURRENCY bulks in flight
+        and bulk sizes tuned from their latency and payload. Returns False if the task has to stop.
+        """
+        bulk_size = AdaptiveBulkSize(DOC_BULK_SIZE, DOC_BULK_MAX_SIZE, DOC_BULK_MAX_BYTES, DOC_BULK_TARGET_LATENCY)
+        bulk_slots = trio.Semaphore(DOC_BULK_CONCURRENCY)
+        # Chunks known to the doc store, and the subset recorded on the task.
+        inserted_ids = []
+        recorded = 0
+        task_unknown = False
+        task_canceled = False
+        last_cancel_check = timer()
+
+        async def insert_bulk(bulk, nursery):
+            nonlocal recorded, task_unknown
+            try:
+                st = timer()
+                doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(bulk, search.index_name(task_tenant_id), task_dataset_id))
+                if doc_store_result:
+                    error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
+                    progress_callback(-1, msg=error_message)
+                    raise Exception(error_message)
+                bulk_ids = [chunk["id"] for chunk in bulk]
+                inserted_ids.extend(bulk_ids)
+                bulk_size.observe(len(bulk), sum(chunk_bytes(chunk) for chunk in bulk), timer() - st)
+                try:
+                    await trio.to_thread.run_sync(TaskService.append_chunk_ids, task["id"], bulk_ids)
+                except DoesNotExist:
+                    task_unknown = True
+                    nursery.cancel_scope.cancel()
+                    return
+                recorded += len(bulk_ids)
+                progress_callback(prog=0.7 + 0.2 * recorded / total_chunks, msg="")
+            finally:
+                bulk_slots.release()
+
+        async def insert_bulks(buffer, nursery, flush=False):
+            nonlocal task_canceled, last_cancel_check
+            while bulk := bulk_size.take(buffer, flush):
+                if timer() - last_cancel_check >= CANCEL_CHECK_INTERVAL:
+                    last_cancel_check = timer()
+                    if has_canceled(task_id):
+                        task_canceled = True
+                        nursery.cancel_scope.cancel()
+                        return
+                await bulk_slots.acquire()
+                nursery.start_soon(insert_bulk, bulk, nursery)
+
+        # Embedded slices are buffered, so that bulks can grow larger than a slice.
+        buffer = []
+        async with trio.open_nursery() as nursery:
+            async for batch in receive_channel:
+                buffer.extend(batch)
+                await insert_bulks(buffer, nursery)
+                if task_canceled or task_unknown:
+                    break
+            else:
+                await insert_bulks(buffer, nursery, flush=True)
+
+        if not task_canceled and not task_unknown and has_canceled(task_id):
+            task_canceled = True
         if task_canceled:
             progress_callback(-1, msg="Task has been canceled.")
-            return
-        if b % 128 == 0:
-            progress_callback(prog=0.8 + 0.1 * (b + 1) / len(chunks), msg="")
-        if doc_store_result:
-            error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
-            progress_callback(-1, msg=error_message)
-            raise Exception(error_message)
-        chunk_ids = [chunk["id"] for chunk in chunks[:b + DOC_BULK_SIZE]]
-        chunk_ids_str = " ".join(chunk_ids)
-        try:
-            TaskService.update_chunk_ids(task["id"], chunk_ids_str)
-        except DoesNotExist:
-            logging.warning(f"do_handle_task update_chunk_ids failed since task {task['id']} is unknown.")
-            doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"id": chunk_ids}, search.index_name(task_tenant_id), task_dataset_id))
+            return False
+        if task_unknown:
+            logging.warning(f"do_handle_task append_chunk_ids failed since task {task['id']} is unknown.")
+            if inserted_ids:
+                await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"id": inserted_ids}, search.index_name(task_tenant_id), task_dataset_id))
             async with trio.open_nursery() as nursery:
-                for chunk_id in chunk_ids:
+                for chunk_id in inserted_ids:
                     nursery.start_soon(delete_image, task_dataset_id, chunk_id)
             progress_callback(-1, msg=f"Chunk updates failed since task {task['id']} is unknown.")
-            return
+            return False
+        return True
+
+    # Chunk IDs are appended bulk by bulk from here on.
+    await trio.to_thread.run_sync(TaskService.update_chunk_ids, task["id"], "")
+    send_channel, receive_channel = trio.open_memory_channel(EMBEDDING_PIPELINE_DEPTH)
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(embed_chunks, send_channel)
+        completed = await index_chunks(receive_channel)
+        if not completed:
+            nursery.cancel_scope.cancel()
+    if not completed:
+        return
 
     logging.info("Indexing doc({}), page({}-{}), chunks({}), elapsed: {:.2f}".format(task_document_name, task_from_page,
-                                                                                     task_to_page, len(chunks),
+                                                                                     task_to_page, total_chunks,
                                                                                      timer() - start_ts))
 
     DocumentService.increment_chunk_num(task_doc_id, task_dataset_id, token_count, chunk_count, 0)
@@ -675,7 +788,7 @@ async def do_handle_task(task):
     progress_callback(prog=1.0, msg="Indexing done ({:.2f}s). Task done ({:.2f}s)".format(time_cost, task_time_cost))
     logging.info(
         "Chunk doc({}), page({}-{}), chunks({}), token({}), elapsed:{:.2f}".format(task_document_name, task_from_page,
-                                                                                   task_to_page, len(chunks),
+                                                                                   task_to_page, total_chunks,
                                                                                    token_count, task_time_cost))
 
 
@@ -0,0 +1,71 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Bulk size tuning for doc store inserts.
+
+Every finished bulk reports its chunk count, approximate payload and latency. The next
+bulk is sized so that it should take about `target_latency` seconds and stay under
+`max_bytes`. The size grows at most 2x and shrinks at most 2x per observation.
+"""
+import numpy as np
+
+
+def chunk_bytes(d: dict) -> int:
+    """Rough size of a chunk in a bulk request."""
+    n = 0
+    for v in d.values():
+        if isinstance(v, str):
+            n += len(v)
+        elif isinstance(v, np.ndarray):
+            n += v.nbytes
+        elif isinstance(v, (list, tuple)):
+            n += 8 * len(v)
+        else:
+            n += 8
+    return n
+
+
+class AdaptiveBulkSize:
+    def __init__(self, init_size: int, max_size: int, max_bytes: int, target_latency: float):
+        self.max_size = max(1, max_size)
+        self.size = min(max(1, init_size), self.max_size)
+        self.max_bytes = max_bytes
+        self.target_latency = target_latency
+
+    def observe(self, count: int, nbytes: int, elapsed: float):
+        if count <= 0:
+            return
+        ideal = self.max_size
+        if elapsed > 0:
+            ideal = min(ideal, self.target_latency * count / elapsed)
+        if nbytes > 0:
+            ideal = min(ideal, self.max_bytes * count / nbytes)
+        if ideal > self.size:
+            self.size = int(min(self.size * 2, ideal))
+        else:
+            self.size = int(max(self.size // 2, ideal))
+        self.size = min(max(1, self.size), self.max_size)
+
+    def take(self, buffer: list, flush: bool = False) -> list | None:
+        """
+        Removes the next bulk from the head of `buffer` and returns it, or None if the buffer holds
+        less than a bulk of the current size. With `flush`, the rest of the buffer is a bulk too.
+        """
+        if not buffer or (len(buffer) < self.size and not flush):
+            return None
+        bulk = buffer[:self.size]
+        del buffer[:self.size]
+        return bulk
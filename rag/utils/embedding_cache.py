@@ -0,0 +1,119 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Content-addressed cache of chunk embeddings.
+
+Vectors are keyed by (tenant and embedding model, hash of the whitespace-normalized
+text), so re-parsing a document only pays for the chunks whose text actually changed.
+There are two tiers: a bounded in-process cache and Redis, shared by all task executors.
+"""
+import base64
+import logging
+import os
+import re
+import threading
+
+import numpy as np
+import xxhash
+from cachetools import LFUCache, LRUCache, TTLCache
+
+from rag.utils.redis_conn import REDIS_CONN
+
+EMBEDDING_CACHE_ENABLED = int(os.environ.get("EMBEDDING_CACHE_ENABLED", "1"))
+EMBEDDING_CACHE_LOCAL_SIZE = int(os.environ.get("EMBEDDING_CACHE_LOCAL_SIZE", "20000"))
+# Eviction of the in-process tier: lru, lfu or ttl
+EMBEDDING_CACHE_EVICTION = os.environ.get("EMBEDDING_CACHE_EVICTION", "lru").lower()
+EMBEDDING_CACHE_TTL = int(os.environ.get("EMBEDDING_CACHE_TTL", 7 * 24 * 3600))
+
+
+def _normalize(txt: str) -> str:
+    return re.sub(r"\s+", " ", txt).strip()
+
+
+def _encode_vector(v) -> str:
+    return base64.b64encode(np.asarray(v, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def _decode_vector(s: str):
+    return np.frombuffer(base64.b64decode(s), dtype=np.float32)
+
+
+class EmbeddingCache:
+    def __init__(self, maxsize=EMBEDDING_CACHE_LOCAL_SIZE, eviction=EMBEDDING_CACHE_EVICTION, ttl=EMBEDDING_CACHE_TTL, use_redis=True):
+        if eviction == "lfu":
+            self.local = LFUCache(maxsize=maxsize)
+        elif eviction == "ttl":
+            self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        else:
+            self.local = LRUCache(maxsize=maxsize)
+        self.ttl = ttl
+        self.use_redis = use_redis
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model_name: str, txt: str) -> str:
+        hasher = xxhash.xxh128()
+        hasher.update(str(model_name).encode("utf-8"))
+        hasher.update(b"\x00")
+        hasher.update(_normalize(txt).encode("utf-8", "surrogatepass"))
+        return "embd_cache:" + hasher.hexdigest()
+
+    def get_many(self, model_name: str, texts: list) -> list:
+        """Returns a list aligned with `texts`, holding a vector on hit and None on miss."""
+        keys = [self.key(model_name, t) for t in texts]
+        res = [None] * len(texts)
+        remote = []
+        with self.lock:
+            for i, k in enumerate(keys):
+                v = self.local.get(k)
+                if v is None:
+                    remote.append(i)
+                else:
+                    res[i] = v
+        if remote and self.use_redis:
+            values = REDIS_CONN.mget([keys[i] for i in remote])
+            with self.lock:
+                for i, s in zip(remote, values or []):
+                    if not s:
+                        continue
+                    try:
+                        v = _decode_vector(s)
+                    except Exception:
+                        logging.warning(f"EmbeddingCache: corrupted entry {keys[i]}")
+                        continue
+                    res[i] = v
+                    self.local[keys[i]] = v
+        hits = sum(1 for v in res if v is not None)
+        with self.lock:
+            self.hits += hits
+            self.misses += len(texts) - hits
+        return res
+
+    def set_many(self, model_name: str, texts: list, vectors) -> None:
+        mapping = {}
+        with self.lock:
+            for t, v in zip(texts, vectors):
+                k = self.key(model_name, t)
+                v = np.asarray(v, dtype=np.float32)
+                self.local[k] = v
+                mapping[k] = _encode_vector(v)
+        if mapping and self.use_redis:
+            REDIS_CONN.mset(mapping, self.ttl)
+
+
+EMBEDDING_CACHE = EmbeddingCache() if EMBEDDING_CACHE_ENABLED else None
@@ -0,0 +1,156 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Per-process embedding scheduler.
+
+Texts submitted by concurrently running tasks for the same (tenant, embedding model)
+are merged into full batches before being sent to the embedding endpoint. A partially
+filled batch is flushed once its oldest text has waited `max_wait` seconds, so a lone
+small document never waits longer than that.
+"""
+import logging
+from collections import defaultdict, deque
+
+import numpy as np
+import trio
+
+from api.utils.api_utils import timeout
+
+
+class _Request:
+    def __init__(self, texts, callback=None):
+        self.vectors = [None] * len(texts)
+        self.remaining = len(texts)
+        self.token_count = 0
+        self.error = None
+        self.callback = callback
+        self.done = trio.Event()
+
+    def fill(self, idx, vector, tokens):
+        self.vectors[idx] = vector
+        self.token_count += tokens
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.done.set()
+
+    def fail(self, error):
+        if self.error is None:
+            self.error = error
+        self.done.set()
+
+
+class EmbeddingScheduler:
+    def __init__(self, batch_size: int, max_wait: float, limiter: trio.CapacityLimiter = None):
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self.limiter = limiter
+        # (tenant_id, llm_name) -> deque of (request, index, text, enqueued_at)
+        self._pending = defaultdict(deque)
+        self.batches = 0
+        self.texts = 0
+
+    @staticmethod
+    def _key(mdl):
+        return getattr(mdl, "tenant_id", ""), getattr(mdl, "llm_name", None) or str(id(mdl))
+
+    async def encode(self, mdl, texts: list, callback=None):
+        """
+        Embed `texts` with `mdl`, sharing batches with other in-flight callers of the same model.
+        `callback(done, total)` is invoked whenever some of the texts got their vectors.
+        Returns (ndarray of vectors, token count) like `mdl.encode`.
+        """
+        if not texts:
+            return np.array([]), 0
+        req = _Request(texts, callback)
+        key = self._key(mdl)
+        pending = self._pending[key]
+        now = trio.current_time()
+        for i, txt in enumerate(texts):
+            pending.append((req, i, txt, now))
+
+        try:
+            while not req.done.is_set():
+                if len(pending) >= self.batch_size:
+                    await self._flush(key, mdl)
+                    continue
+                if not pending:
+                    # Our texts are being encoded by another caller. Look again now and then: if that
+                    # caller is cancelled, they are put back into `pending` for us to flush.
+                    with trio.move_on_after(self.max_wait):
+                        await req.done.wait()
+                    continue
+                deadline = pending[0][3] + self.max_wait
+                with trio.move_on_at(deadline):
+                    await req.done.wait()
+                if not req.done.is_set() and pending and pending[0][3] + self.max_wait <= trio.current_time():
+                    await self._flush(key, mdl)
+        except BaseException:
+            # Cancelled: don't encode what is still queued for us, nobody waits for it.
+            if not req.done.is_set():
+                keep = [item for item in pending if item[0] is not req]
+                pending.clear()
+                pending.extend(keep)
+            raise
+
+        if req.error is not None:
+            raise req.error
+        return np.array(req.vectors), req.token_count
+
+    async def _flush(self, key, mdl):
+        pending = self._pending[key]
+        batch = [pending.popleft() for _ in range(min(self.batch_size, len(pending)))]
+        if not batch:
+            return
+
+        @timeout(60)
+        def batch_encode(txts):
+            return mdl.encode(txts)
+
+        try:
+            if self.limiter is not None:
+                async with self.limiter:
+                    vts, c = await trio.to_thread.run_sync(lambda: batch_encode([t for _, _, t, _ in batch]))
+            else:
+                vts, c = await trio.to_thread.run_sync(lambda: batch_encode([t for _, _, t, _ in batch]))
+        except Exception as e:
+            logging.exception("EmbeddingScheduler batch of {} texts for {} failed".format(len(batch), key))
+            for req, _, _, _ in batch:
+                req.fail(e)
+            # Drop what is still queued for the failed requests; their callers are gone.
+            keep = [item for item in pending if item[0].error is None]
+            pending.clear()
+            pending.extend(keep)
+            return
+        except BaseException:
+            # Cancelled before the batch was encoded: the batch holds texts of other callers, put them back
+            # in front of the queue so that one of them flushes them.
+            pending.extendleft(reversed(batch))
+            raise
+
+        self.batches += 1
+        self.texts += len(batch)
+        # Split the token count of the batch among its texts by length, the last one takes the remainder.
+        total_len = sum(len(t) for _, _, t, _ in batch) or 1
+        assigned = 0
+        touched = {}
+        for n, (req, idx, txt, _) in enumerate(batch):
+            tks = c - assigned if n == len(batch) - 1 else int(c * len(txt) / total_len)
+            assigned += tks
+            req.fill(idx, vts[n], tks)
+            touched[id(req)] = req
+        for req in touched.values():
+            if req.callback:
+                req.callback(len(req.vectors) - req.remaining, len(req.vectors))
@@ -29,11 +29,14 @@ from rag.settings import TAG_FLD, PAGERANK_FLD
 from rag.utils import singleton, get_float
 from api.utils.file_utils import get_project_base_directory
 from api.utils.common import convert_bytes
+from rag.utils.kb_version import bumps_kb_version
 from rag.utils.doc_store_conn import DocStoreConnection, MatchExpr, OrderByExpr, MatchTextExpr, MatchDenseExpr, \
     FusionExpr
 from rag.nlp import is_english, rag_tokenizer
 
 ATTEMPT_TIME = 2
+# `true` counts every hit, `false` skips counting and an integer stops counting at that many hits.
+ES_TRACK_TOTAL_HITS = os.environ.get("ES_TRACK_TOTAL_HITS", "true").lower()
 
 logger = logging.getLogger('ragflow.es_conn')
 
@@ -243,6 +246,7 @@ class ESConnection(DocStoreConnection):
 
         if limit > 0:
             s = s[offset:offset + limit]
+        s = s.source(self._source_filter(selectFields))
         q = s.to_dict()
         logger.debug(f"ESConnection.search {str(indexNames)} query: " + json.dumps(q))
 
@@ -253,8 +257,7 @@ class ESConnection(DocStoreConnection):
                                      body=q,
                                      timeout="600s",
                                      # search_type="dfs_query_then_fetch",
-                                     track_total_hits=True,
-                                     _source=True)
+                                     track_total_hits=self._track_total_hits())
                 if str(res.get("timed_out", "")).lower() == "true":
                     raise Exception("Es Timeout.")
                 logger.debug(f"ESConnection.search {str(indexNames)} res: " + str(res))
@@ -270,6 +273,27 @@ class ESConnection(DocStoreConnection):
         logger.error(f"ESConnection.search timeout for {ATTEMPT_TIME} times!")
         raise Exception("ESConnection.search timeout.")
 
+    @staticmethod
+    def _source_filter(selectFields: list[str]) -> bool | list | dict:
+        """
+        `_source` projection of a search: only the selected fields are fetched, and vectors
+        only when one is selected explicitly.
+        """
+        fields = [f for f in selectFields if f not in ["id", "_id", "_score"]]
+        if not fields:
+            return False
+        if "*" in fields:
+            if any(re.match(r"q_[0-9]+_vec$", f) for f in fields):
+                return True
+            return {"includes": ["*"], "excludes": ["q_*_vec"]}
+        return fields
+
+    @staticmethod
+    def _track_total_hits() -> bool | int:
+        if ES_TRACK_TOTAL_HITS in ["true", "false"]:
+            return ES_TRACK_TOTAL_HITS == "true"
+        return int(ES_TRACK_TOTAL_HITS)
+
     def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
         for i in range(ATTEMPT_TIME):
             try:
@@ -288,15 +312,18 @@ class ESConnection(DocStoreConnection):
         logger.error(f"ESConnection.get timeout for {ATTEMPT_TIME} times!")
         raise Exception("ESConnection.get timeout.")
 
+    @bumps_kb_version
     def insert(self, documents: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
         # Refers to https://www.elastic.co/guide/en/elasticsearch/reference/current/docs-bulk.html
         operations = []
         for d in documents:
             assert "_id" not in d
             assert "id" in d
-            d_copy = copy.deepcopy(d)
+            # A shallow copy is enough as nothing nested is modified; numpy vectors are
+            # serialized by the client while it encodes the bulk body.
+            d_copy = {k: v for k, v in d.items() if k != "id"}
             d_copy["kb_id"] = knowledgebaseId
-            meta_id = d_copy.pop("id", "")
+            meta_id = d["id"]
             operations.append(
                 {"index": {"_index": indexName, "_id": meta_id}})
             operations.append(d_copy)
@@ -326,6 +353,7 @@ class ESConnection(DocStoreConnection):
 
         return res
 
+    @bumps_kb_version
     def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
         doc = copy.deepcopy(newValue)
         doc.pop("id", None)
@@ -418,6 +446,7 @@ class ESConnection(DocStoreConnection):
                 break
         return False
 
+    @bumps_kb_version
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         qry = None
         assert "_id" not in condition
@@ -472,6 +501,9 @@ class ESConnection(DocStoreConnection):
     """
 
     def getTotal(self, res):
+        if "total" not in res["hits"]:
+            # ES_TRACK_TOTAL_HITS=false: only the hits returned are known.
+            return len(res["hits"]["hits"])
         if isinstance(res["hits"]["total"], type({})):
             return res["hits"]["total"]["value"]
         return res["hits"]["total"]
@@ -482,6 +514,7 @@ class ESConnection(DocStoreConnection):
     def __getSource(self, res):
         rr = []
         for d in res["hits"]["hits"]:
+            d.setdefault("_source", {})
             d["_source"]["id"] = d["_id"]
             d["_source"]["_score"] = d["_score"]
             rr.append(d["_source"])
@@ -520,7 +553,10 @@ class ESConnection(DocStoreConnection):
                 ans[d["_id"]] = txt
                 continue
 
-            txt = d["_source"][fieldnm]
+            txt = d["_source"].get(fieldnm)
+            if not txt:
+                ans[d["_id"]] = "...".join([a for a in list(hlts.items())[0][1]])
+                continue
             txt = re.sub(r"[\r\n]", " ", txt, flags=re.IGNORECASE | re.MULTILINE)
             txts = []
             for t in re.split(r"[.?!;\n]", txt):
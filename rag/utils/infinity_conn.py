@@ -19,7 +19,6 @@ import os
 import re
 import json
 import time
-import copy
 import infinity
 from infinity.common import ConflictType, InfinityException, SortType
 from infinity.index import IndexInfo, IndexType
@@ -28,10 +27,12 @@ from infinity.errors import ErrorCode
 from rag import settings
 from rag.settings import PAGERANK_FLD, TAG_FLD
 from rag.utils import singleton
+import numpy as np
 import pandas as pd
 from api.utils.file_utils import get_project_base_directory
 from rag.nlp import is_english
 
+from rag.utils.kb_version import bumps_kb_version
 from rag.utils.doc_store_conn import (
     DocStoreConnection,
     MatchExpr,
@@ -474,6 +475,7 @@ class InfinityConnection(DocStoreConnection):
         res_fields = self.getFields(res, res.columns.tolist())
         return res_fields.get(chunkId, None)
 
+    @bumps_kb_version
     def insert(self, documents: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
         inf_conn = self.connPool.get_conn()
         db_instance = inf_conn.get_database(self.dbName)
@@ -505,11 +507,13 @@ class InfinityConnection(DocStoreConnection):
                 continue
             embedding_clmns.append((n, int(r.group(1))))
 
-        docs = copy.deepcopy(documents)
-        for d in docs:
-            assert "_id" not in d
-            assert "id" in d
-            for k, v in d.items():
+        # Rows are converted into new dicts, so the documents are left untouched without copying them.
+        docs = []
+        for doc in documents:
+            assert "_id" not in doc
+            assert "id" in doc
+            d = {}
+            for k, v in doc.items():
                 if field_keyword(k):
                     if isinstance(v, list):
                         d[k] = "###".join(v)
@@ -518,8 +522,10 @@ class InfinityConnection(DocStoreConnection):
                 elif re.search(r"_feas$", k):
                     d[k] = json.dumps(v)
                 elif k == "kb_id":
-                    if isinstance(d[k], list):
-                        d[k] = d[k][0]  # since d[k] is a list, but we need a str
+                    if isinstance(v, list):
+                        d[k] = v[0]  # since d[k] is a list, but we need a str
+                    else:
+                        d[k] = v
                 elif k == "position_int":
                     assert isinstance(v, list)
                     arr = [num for row in v for num in row]
@@ -527,6 +533,8 @@ class InfinityConnection(DocStoreConnection):
                 elif k in ["page_num_int", "top_int"]:
                     assert isinstance(v, list)
                     d[k] = "_".join(f"{num:08x}" for num in v)
+                elif isinstance(v, np.ndarray):
+                    d[k] = v.tolist()
                 else:
                     d[k] = v
 
@@ -534,6 +542,7 @@ class InfinityConnection(DocStoreConnection):
                 if n in d:
                     continue
                 d[n] = [0] * vs
+            docs.append(d)
         ids = ["'{}'".format(d["id"]) for d in docs]
         str_ids = ", ".join(ids)
         str_filter = f"id IN ({str_ids})"
@@ -546,6 +555,7 @@ class InfinityConnection(DocStoreConnection):
         logger.debug(f"INFINITY inserted into {table_name} {str_ids}.")
         return []
 
+    @bumps_kb_version
     def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
         # if 'position_int' in newValue:
         #     logger.info(f"update position_int: {newValue['position_int']}")
@@ -621,6 +631,7 @@ class InfinityConnection(DocStoreConnection):
         self.connPool.release_conn(inf_conn)
         return True
 
+    @bumps_kb_version
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         inf_conn = self.connPool.get_conn()
         db_instance = inf_conn.get_database(self.dbName)
@@ -0,0 +1,110 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Per knowledge base version counters kept in Redis.
+
+The doc store connectors bump the version of a knowledge base whenever its chunks are
+inserted, updated or deleted, so caches derived from its content can be keyed by version.
+Writes only become searchable at the next refresh of the doc store, so the version is bumped
+again KB_VERSION_REFRESH_DELAY seconds later: results cached in between are not reused.
+"""
+import inspect
+import logging
+import os
+import threading
+import time
+from functools import wraps
+
+from rag.utils.redis_conn import REDIS_CONN
+
+# Longer than the refresh interval of the indices (conf/mapping.json).
+KB_VERSION_REFRESH_DELAY = float(os.environ.get("KB_VERSION_REFRESH_DELAY", "2"))
+
+# kb_id -> when its delayed bump is due; one timer per knowledge base, postponed by further writes.
+_delayed_bumps = {}
+_delayed_bumps_lock = threading.Lock()
+
+
+def _version_key(kb_id):
+    return f"kb_version:{kb_id}"
+
+
+def get_kb_versions(kb_ids: list) -> list | None:
+    """Current versions of `kb_ids`, or None when they can't be read."""
+    if not REDIS_CONN.is_alive():
+        return None
+    versions = REDIS_CONN.mget([_version_key(kb_id) for kb_id in kb_ids])
+    if versions is None or len(versions) != len(kb_ids):
+        return None
+    return [int(v) if v else 0 for v in versions]
+
+
+def bump_kb_version(kb_id):
+    if not kb_id or not REDIS_CONN.is_alive():
+        return
+    if isinstance(kb_id, list):
+        for k in kb_id:
+            bump_kb_version(k)
+        return
+    if REDIS_CONN.incr(_version_key(kb_id)) is None:
+        logging.warning(f"bump_kb_version({kb_id}) failed")
+
+
+def _start_timer(delay, kb_id):
+    timer = threading.Timer(delay, _delayed_bump, args=(kb_id,))
+    timer.daemon = True
+    timer.start()
+
+
+def _delayed_bump(kb_id):
+    with _delayed_bumps_lock:
+        remaining = _delayed_bumps[kb_id] - time.monotonic()
+        if remaining > 0:
+            _start_timer(remaining, kb_id)
+            return
+        del _delayed_bumps[kb_id]
+    bump_kb_version(kb_id)
+
+
+def bump_kb_version_after_refresh(kb_id):
+    """Bumps the version now, and once the write is visible to searches."""
+    bump_kb_version(kb_id)
+    if not kb_id or KB_VERSION_REFRESH_DELAY <= 0:
+        return
+    for k in kb_id if isinstance(kb_id, list) else [kb_id]:
+        with _delayed_bumps_lock:
+            pending = k in _delayed_bumps
+            _delayed_bumps[k] = time.monotonic() + KB_VERSION_REFRESH_DELAY
+        if not pending:
+            _start_timer(KB_VERSION_REFRESH_DELAY, k)
+
+
+def bumps_kb_version(func):
+    """Decorates a doc store write method taking `knowledgebaseId`; the version is bumped once it returns, and after the next refresh."""
+    signature = inspect.signature(func)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            try:
+                bound = signature.bind_partial(*args, **kwargs)
+                bump_kb_version_after_refresh(bound.arguments.get("knowledgebaseId"))
+            except Exception:
+                logging.exception(f"{func.__qualname__} failed to bump the knowledge base version")
+
+    return wrapper
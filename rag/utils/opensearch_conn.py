@@ -28,6 +28,7 @@ from rag import settings
 from rag.settings import TAG_FLD, PAGERANK_FLD
 from rag.utils import singleton
 from api.utils.file_utils import get_project_base_directory
+from rag.utils.kb_version import bumps_kb_version
 from rag.utils.doc_store_conn import DocStoreConnection, MatchExpr, OrderByExpr, MatchTextExpr, MatchDenseExpr, \
     FusionExpr
 from rag.nlp import is_english, rag_tokenizer
@@ -285,14 +286,17 @@ class OSConnection(DocStoreConnection):
         logger.error(f"OSConnection.get timeout for {ATTEMPT_TIME} times!")
         raise Exception("OSConnection.get timeout.")
 
+    @bumps_kb_version
     def insert(self, documents: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
         # Refers to https://opensearch.org/docs/latest/api-reference/document-apis/bulk/
         operations = []
         for d in documents:
             assert "_id" not in d
             assert "id" in d
-            d_copy = copy.deepcopy(d)
-            meta_id = d_copy.pop("id", "")
+            # A shallow copy is enough as nothing nested is modified; numpy vectors are
+            # serialized by the client while it encodes the bulk body.
+            d_copy = {k: v for k, v in d.items() if k != "id"}
+            meta_id = d["id"]
             operations.append(
                 {"index": {"_index": indexName, "_id": meta_id}})
             operations.append(d_copy)
@@ -321,6 +325,7 @@ class OSConnection(DocStoreConnection):
                     continue
         return res
 
+    @bumps_kb_version
     def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
         doc = copy.deepcopy(newValue)
         doc.pop("id", None)
@@ -404,6 +409,7 @@ class OSConnection(DocStoreConnection):
                 break
         return False
 
+    @bumps_kb_version
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         qry = None
         assert "_id" not in condition
@@ -0,0 +1,45 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Multiprocessing context of the worker pools (tokenizer, PDF workers).
+
+Workers are forked from a forkserver, so the modules they need are loaded once in the server
+and shared copy-on-write. A process has a single forkserver, which reads its preload list only
+when it starts, i.e. when the first pool starts. So every module registers itself with
+`preload_in_workers()` when it is imported, before any pool starts, and the list always holds
+the modules of all the pools.
+"""
+import multiprocessing
+import sys
+import threading
+
+_preload = []
+_preload_lock = threading.Lock()
+
+
+def preload_in_workers(module_name: str):
+    if sys.platform == "win32":
+        return
+    with _preload_lock:
+        if module_name not in _preload:
+            _preload.append(module_name)
+        multiprocessing.get_context("forkserver").set_forkserver_preload(list(_preload))
+
+
+def pool_context():
+    if sys.platform == "win32":
+        return multiprocessing.get_context("spawn")
+    return multiprocessing.get_context("forkserver")
@@ -126,6 +126,42 @@ class RedisDB:
             logging.warning("RedisDB.get " + str(k) + " got exception: " + str(e))
             self.__open__()
 
+    def mget(self, keys: list):
+        """Values of the keys, None for the missing ones; None instead of the list when Redis can't be read."""
+        if not keys:
+            return []
+        if not self.REDIS:
+            return None
+        try:
+            return self.REDIS.mget(keys)
+        except Exception as e:
+            logging.warning("RedisDB.mget " + str(len(keys)) + " keys got exception: " + str(e))
+            self.__open__()
+        return None
+
+    def mset(self, mapping: dict, exp=3600):
+        """Set several keys with the same expiration in one pipelined round-trip."""
+        if not mapping:
+            return True
+        try:
+            pipeline = self.REDIS.pipeline(transaction=False)
+            for k, v in mapping.items():
+                pipeline.set(k, v, exp)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.mset " + str(len(mapping)) + " keys got exception: " + str(e))
+            self.__open__()
+        return False
+
+    def incr(self, k):
+        try:
+            return self.REDIS.incr(k)
+        except Exception as e:
+            logging.warning("RedisDB.incr " + str(k) + " got exception: " + str(e))
+            self.__open__()
+        return None
+
     def set_obj(self, k, obj, exp=3600):
         try:
             self.REDIS.set(k, json.dumps(obj, ensure_ascii=False), exp)
@@ -16,9 +16,10 @@
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import pytest
-from common import bulk_upload_documents, list_documents, parse_documents
+from common import bulk_upload_documents, list_chunks, list_documents, parse_documents, update_document, upload_documents
 from configs import INVALID_API_TOKEN
 from libs.auth import RAGFlowHttpApiAuth
+from openpyxl import Workbook
 from utils import wait_for
 
 
@@ -165,6 +166,37 @@ class TestDocumentsParse:
         validate_document_details(HttpApiAuth, dataset_id, document_ids)
 
 
+@pytest.mark.p2
+def test_parse_table_with_leading_empty_rows(HttpApiAuth, add_dataset_func, tmp_path):
+    # The sheet starts at row 3: merged cells must still be filled from the right cell.
+    wb = Workbook()
+    ws = wb.active
+    ws["A3"], ws["B3"], ws["C3"] = "name", "city", "note"
+    ws["A4"], ws["B4"], ws["C4"] = "alice", "paris", "first"
+    ws["A5"], ws["B5"] = "bob", "merged"
+    ws.merge_cells("B5:C5")
+    ws["A6"], ws["B6"], ws["C6"] = "carol", "rome", "last"
+    fp = tmp_path / "ragflow_test_leading_empty_rows.xlsx"
+    wb.save(fp)
+
+    dataset_id = add_dataset_func
+    res = upload_documents(HttpApiAuth, dataset_id, [fp])
+    assert res["code"] == 0
+    document_id = res["data"][0]["id"]
+    res = update_document(HttpApiAuth, dataset_id, document_id, {"chunk_method": "table"})
+    assert res["code"] == 0
+    res = parse_documents(HttpApiAuth, dataset_id, {"document_ids": [document_id]})
+    assert res["code"] == 0
+
+    condition(HttpApiAuth, dataset_id, [document_id])
+
+    res = list_chunks(HttpApiAuth, dataset_id, document_id)
+    assert res["code"] == 0
+    contents = [chunk["content"] for chunk in res["data"]["chunks"] if "bob" in chunk["content"]]
+    assert len(contents) == 1
+    assert contents[0].count("merged") == 2, contents[0]
+
+
 @pytest.mark.p3
 def test_parse_100_files(HttpApiAuth, add_dataset_func, tmp_path):
     @wait_for(200, 1, "Document parsing timeout")